@@ -8,11 +8,15 @@
 contract FiatContract:
     def USD(_id: uint256) -> uint256: constant
     def requestUpdate(_id: uint256):modifying
+    def updatedAt() -> timestamp: constant
+    def latestPrice() -> (uint256, timestamp): constant
 
 
 #定义状态变量
 fiator:public(FiatContract)
 owner:public(address)
+#价格的最长有效时间,为0时不检查,外部Fiat合约没有价格时间,只能用0
+maxPriceAge:public(timedelta)
 
 @public
 def __init__():
@@ -24,12 +28,26 @@ def setFiator(_faitor:address):
     assert msg.sender == self.owner and _faitor !=ZERO_ADDRESS
     self.fiator = FiatContract(_faitor)
 
+#设置价格的最长有效时间
+@public
+def setMaxPriceAge(_age:timedelta):
+    assert msg.sender == self.owner
+    self.maxPriceAge = _age
+
 # @returns $0.01  => wei 假设返回值是 x ,对应的eth 就是 msg.value/return
 @public
 @constant
 def getEthPrice() -> uint256:
+    if self.maxPriceAge > 0:
+        assert self.fiator.updatedAt() + self.maxPriceAge >= block.timestamp, 'eth price is stale'
     return self.fiator.USD(0)
 
+# @returns 价格和价格对应的时间,需要备份合约MyFiat
+@public
+@constant
+def getEthPriceWithTime() -> (uint256, timestamp):
+    return self.fiator.latestPrice()
+
 
 @public
 @payable
@@ -1,9 +1,17 @@
 from vyper.interfaces import ERC20
 
 
+# the cumulative prices at a point in time
+struct Observation:
+    blockTimestamp: timestamp
+    tokenPriceCumulative: uint256
+    ndaoPriceCumulative: uint256
+
+
 # the interface of Factory
 contract Factory:
     def getExchange(token_addr: address) -> address: constant
+    def getToken(exchange: address) -> address: constant
 
 
 # the interface of Exchange
@@ -15,6 +23,33 @@ contract Exchange:
     def ndaoToTokenTransferOutput(
         tokens_bought: uint256, max_ndao: uint256, deadline: timestamp, recipient: address) -> uint256: modifying
 
+    def ndaoToTokenPeerInput(ndao_sold: uint256, min_tokens: uint256, recipient: address) -> uint256: modifying
+    def ndaoToTokenPeerOutput(tokens_bought: uint256, max_ndao: uint256, recipient: address) -> uint256: modifying
+
+
+# the interface of the tokens supporting EIP-2612 permit
+contract ERC2612:
+    def allowance(_owner: address, _spender: address) -> uint256: constant
+    def permit(_owner: address, _spender: address, _value: uint256, _deadline: timestamp,
+               _v: uint256, _r: bytes32, _s: bytes32) -> bool: modifying
+
+
+# directions of the price functions, no enum
+NDAO_TO_TOKEN_INPUT: constant(uint256) = 0
+NDAO_TO_TOKEN_OUTPUT: constant(uint256) = 1
+TOKEN_TO_NDAO_INPUT: constant(uint256) = 2
+TOKEN_TO_NDAO_OUTPUT: constant(uint256) = 3
+# Vyper does not allow for dynamic arrays, we have limited the number of quotes
+MAX_QUOTES: constant(int128) = 32
+# and the number of recipients of one ndaoToTokenTransferInputMany
+MAX_RECIPIENTS: constant(int128) = 16
+# the cumulative prices are scaled by PRICE_PRECISION
+PRICE_PRECISION: constant(uint256) = 10 ** 18
+# the cumulative prices are saved at most every OBSERVATION_PERIOD seconds,
+# the last OBSERVATION_COUNT of them are kept, 24 hours in all
+OBSERVATION_PERIOD: constant(uint256) = 600
+OBSERVATION_COUNT: constant(uint256) = 144
+
 
 # event
 TokenPurchase: event({buyer: indexed(address), ndao_sold: indexed(
@@ -23,6 +58,7 @@ NdaoPurchase: event({buyer: indexed(address), tokens_sold: indexed(
     uint256), ndao_bought: indexed(uint256)})
 TokenToTokenPurchase: event({buyer: indexed(
     address), tokenAddress: address, tokens_sold: uint256, token_bought: uint256})
+Sync: event({token_reserve: uint256, ndao_reserve: uint256})
 
 
 # address of the ERC20 token traded on this contract
@@ -33,6 +69,23 @@ ndao: ERC20
 factory: Factory
 # Max amounts of token on this contract
 maxPool: uint256
+# Amount of token accounted to the pool, updated on every swap
+tokenReserve: public(uint256)
+# Amount of NDAO accounted to the pool, updated on every swap
+ndaoReserve: public(uint256)
+# Sum of the price of Token in NDAO times the seconds it lasted, scaled by PRICE_PRECISION
+tokenPriceCumulative: public(uint256)
+# Sum of the price of NDAO in Token times the seconds it lasted, scaled by PRICE_PRECISION
+ndaoPriceCumulative: public(uint256)
+# Time of the last update of the cumulative prices
+blockTimestampLast: public(timestamp)
+# Ring buffer of the cumulative prices, observationIndex is the latest one
+observations: map(uint256, Observation)
+observationIndex: public(uint256)
+# Cache of the exchanges created by the factory, token address => exchange address
+peerExchanges: map(address, address)
+# Cache of the callers checked to be exchanges created by the factory
+peers: map(address, bool)
 
 
 # @dev This function acts as a contract constructor which is not currently supported in contracts deployed
@@ -45,6 +98,10 @@ def setup(token_addr: address, ndao_address: address, token_amount: uint256):
     self.token = ERC20(token_addr)
     self.ndao = ERC20(ndao_address)
     self.maxPool = token_amount * 2
+    self.tokenReserve = self.token.balanceOf(self)
+    self.ndaoReserve = self.ndao.balanceOf(self)
+    self.blockTimestampLast = block.timestamp
+    self.observations[0] = Observation({blockTimestamp: block.timestamp, tokenPriceCumulative: 0, ndaoPriceCumulative: 0})
 
 
 @private
@@ -79,16 +136,159 @@ def getOutputPrice(output_amount: uint256, input_reserve: uint256, output_reserv
     return numerator / denominator + 1
 
 
+@private
+def getPeerExchange(token_addr: address) -> address:
+    """
+    # @dev Exchange of token_addr created by the factory, only queried once per token.
+    """
+    exchange_addr: address = self.peerExchanges[token_addr]
+    if exchange_addr == ZERO_ADDRESS:
+        exchange_addr = self.factory.getExchange(token_addr)
+        assert exchange_addr != ZERO_ADDRESS, 'no exchange of the token'
+        self.peerExchanges[token_addr] = exchange_addr
+    return exchange_addr
+
+
+@private
+def checkPeer(exchange_addr: address):
+    """
+    # @dev Throws if exchange_addr is not an exchange created by the factory, only queried once per exchange.
+    """
+    if not self.peers[exchange_addr]:
+        assert self.factory.getToken(exchange_addr) != ZERO_ADDRESS, 'not an exchange of the factory'
+        self.peers[exchange_addr] = True
+
+
+@private
+def updatePrices(token_reserve: uint256, ndao_reserve: uint256):
+    """
+    # @dev Accumulate the prices of the reserves before the first trade of a block.
+    # @param token_reserve Amount of Tokens in exchange reserves.
+    # @param ndao_reserve Amount of NDAO in exchange reserves.
+    """
+    if block.timestamp == self.blockTimestampLast:
+        return
+    elapsed: uint256 = as_unitless_number(block.timestamp - self.blockTimestampLast)
+    token_cumulative: uint256 = self.tokenPriceCumulative
+    ndao_cumulative: uint256 = self.ndaoPriceCumulative
+    if token_reserve > 0 and ndao_reserve > 0:
+        token_cumulative += ndao_reserve * PRICE_PRECISION / token_reserve * elapsed
+        ndao_cumulative += token_reserve * PRICE_PRECISION / ndao_reserve * elapsed
+        self.tokenPriceCumulative = token_cumulative
+        self.ndaoPriceCumulative = ndao_cumulative
+    self.blockTimestampLast = block.timestamp
+    index: uint256 = self.observationIndex
+    if as_unitless_number(block.timestamp - self.observations[index].blockTimestamp) >= OBSERVATION_PERIOD:
+        index = (index + 1) % OBSERVATION_COUNT
+        self.observations[index] = Observation({blockTimestamp: block.timestamp, tokenPriceCumulative: token_cumulative, ndaoPriceCumulative: ndao_cumulative})
+        self.observationIndex = index
+
+
+@private
+@constant
+def quote(amount: uint256, direction: uint256, token_reserve: uint256, ndao_reserve: uint256) -> uint256:
+    """
+    # @dev Pricing function for any direction which returns 0 instead of throwing, also where
+    #      getInputPrice or getOutputPrice would overflow uint256.
+    # @param amount Amount of NDAO or Tokens sold (input) or bought (output).
+    # @param direction One of NDAO_TO_TOKEN_INPUT, NDAO_TO_TOKEN_OUTPUT, TOKEN_TO_NDAO_INPUT, TOKEN_TO_NDAO_OUTPUT.
+    # @return Amount of NDAO or Tokens bought (input) or sold (output), 0 if it can not be traded.
+    """
+    assert direction <= TOKEN_TO_NDAO_OUTPUT
+    if amount == 0 or token_reserve == 0 or ndao_reserve == 0:
+        return 0
+    if direction == NDAO_TO_TOKEN_INPUT:
+        if amount > MAX_UINT256 / token_reserve or amount > MAX_UINT256 - ndao_reserve:
+            return 0
+        return self.getInputPrice(amount, ndao_reserve, token_reserve)
+    elif direction == NDAO_TO_TOKEN_OUTPUT:
+        if amount >= token_reserve or amount > MAX_UINT256 / ndao_reserve:
+            return 0
+        return self.getOutputPrice(amount, ndao_reserve, token_reserve)
+    elif direction == TOKEN_TO_NDAO_INPUT:
+        if amount > MAX_UINT256 / ndao_reserve or amount > MAX_UINT256 - token_reserve:
+            return 0
+        return self.getInputPrice(amount, token_reserve, ndao_reserve)
+    else:
+        if amount >= ndao_reserve or amount > MAX_UINT256 / token_reserve:
+            return 0
+        return self.getOutputPrice(amount, token_reserve, ndao_reserve)
+
+
+@private
+def usePermit(token_addr: address, owner: address, value: uint256, deadline: timestamp, v: uint256, r: bytes32, s: bytes32):
+    """
+    # @dev Approve value of token_addr from owner to this exchange with an EIP-2612 signature.
+    #      The permit is skipped when the allowance is already enough, e.g. when someone
+    #      submitted the same signature first.
+    """
+    if ERC2612(token_addr).allowance(owner, self) < value:
+        flag: bool = ERC2612(token_addr).permit(owner, self, value, deadline, v, r, s)
+        assert flag, 'permit failed'
+
+
 # buy tokens
+@private
+def ndaoToTokenPrepaid(ndao_sold: uint256, min_tokens: uint256, buyer: address, recipient: address) -> uint256:
+    """
+    # @dev Sell ndao_sold NDAO already transferred to this exchange, 0 sells the NDAO balance above the reserve.
+    """
+    assert recipient != self and recipient != ZERO_ADDRESS
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
+    amount: uint256 = ndao_sold
+    if amount == 0:
+        amount = self.ndao.balanceOf(self) - ndao_reserve
+    assert amount > 0
+    tokens_bought: uint256 = self.getInputPrice(
+        amount, ndao_reserve, token_reserve)
+    assert tokens_bought >= min_tokens, 'little than min_tokens'
+    self.tokenReserve = token_reserve - tokens_bought
+    self.ndaoReserve = ndao_reserve + amount
+    flag: bool = self.token.transfer(recipient, tokens_bought)
+    assert flag, 'transfer token failed'
+    log.TokenPurchase(buyer, amount, tokens_bought)
+    return tokens_bought
+
+
+@private
+def tokenToNdaoPrepaid(tokens_sold: uint256, min_ndao: uint256, buyer: address, recipient: address) -> uint256:
+    """
+    # @dev Sell tokens_sold Tokens already transferred to this exchange, 0 sells the Token balance above the reserve.
+    """
+    assert recipient != self and recipient != ZERO_ADDRESS
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
+    amount: uint256 = tokens_sold
+    if amount == 0:
+        amount = self.token.balanceOf(self) - token_reserve
+    assert amount > 0
+    assert token_reserve + amount <= self.maxPool, 'the pool is full'
+    ndao_bought: uint256 = self.getInputPrice(
+        amount, token_reserve, ndao_reserve)
+    assert ndao_bought >= min_ndao, 'little than min_ndao'
+    self.tokenReserve = token_reserve + amount
+    self.ndaoReserve = ndao_reserve - ndao_bought
+    flag: bool = self.ndao.transfer(recipient, ndao_bought)
+    assert flag, 'transfer ndao failed'
+    log.NdaoPurchase(buyer, amount, ndao_bought)
+    return ndao_bought
+
+
 @private
 def ndaoToTokenInput(ndao_sold: uint256, min_tokens: uint256, deadline: timestamp, buyer: address, recipient: address) -> uint256:
     assert deadline >= block.timestamp and (ndao_sold > 0 and min_tokens > 0)
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
     tokens_bought: uint256 = self.getInputPrice(
         ndao_sold, ndao_reserve, token_reserve)
     # Throws if tokens_bought < min_tokens
     assert tokens_bought >= min_tokens, 'little than min_tokens'
+    self.tokenReserve = token_reserve - tokens_bought
+    self.ndaoReserve = ndao_reserve + ndao_sold
     flag: bool = self.ndao.transferFrom(buyer, self, ndao_sold)
     assert flag, 'transfer ndao failed'
     flag = self.token.transfer(recipient, tokens_bought)
@@ -133,12 +333,15 @@ def ndaoToTokenTransferInput(ndao_sold: uint256, min_tokens: uint256, deadline:
 @private
 def ndaoToTokenOutput(tokens_bought: uint256, max_ndao: uint256, deadline: timestamp, buyer: address, recipient: address) -> uint256:
     assert deadline >= block.timestamp and (tokens_bought > 0 and max_ndao > 0)
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
     ndao_sold: uint256 = self.getOutputPrice(
         tokens_bought, ndao_reserve, token_reserve)
     # Throws if ndao_sold > max_ndao
     assert ndao_sold <= max_ndao, 'beyond max_ndao'
+    self.tokenReserve = token_reserve - tokens_bought
+    self.ndaoReserve = ndao_reserve + ndao_sold
     flag: bool = self.ndao.transferFrom(buyer, self, ndao_sold)
     assert flag, 'transfer ndao failed'
     flag = self.token.transfer(recipient, tokens_bought)
@@ -179,12 +382,15 @@ def ndaoToTokenTransferOutput(tokens_bought: uint256, max_ndao: uint256, deadlin
 @private
 def tokenToNdaoInput(tokens_sold: uint256, min_ndao: uint256, deadline: timestamp, buyer: address, recipient: address) -> uint256:
     assert deadline >= block.timestamp and (tokens_sold > 0 and min_ndao > 0)
-    token_reserve: uint256 = self.token.balanceOf(self)
+    token_reserve: uint256 = self.tokenReserve
     assert token_reserve + tokens_sold <= self.maxPool, 'the pool is full'
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
     ndao_bought: uint256 = self.getInputPrice(
         tokens_sold, token_reserve, ndao_reserve)
     assert ndao_bought >= min_ndao
+    self.tokenReserve = token_reserve + tokens_sold
+    self.ndaoReserve = ndao_reserve - ndao_bought
     flag: bool = self.token.transferFrom(buyer, self, tokens_sold)
     assert flag, 'transfer token failed'
     flag = self.ndao.transfer(recipient, ndao_bought)
@@ -226,12 +432,15 @@ def tokenToNdaoTransferInput(tokens_sold: uint256, min_ndao: uint256, deadline:
 @private
 def tokenToNdaoOutput(ndao_bought: uint256, max_tokens: uint256, deadline: timestamp, buyer: address, recipient: address) -> uint256:
     assert deadline >= block.timestamp and ndao_bought > 0
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
     tokens_sold: uint256 = self.getOutputPrice(
         ndao_bought, token_reserve, ndao_reserve)
     assert token_reserve + tokens_sold <= self.maxPool, 'the pool is full'
     assert max_tokens >= tokens_sold, 'beyond max_tokens'
+    self.tokenReserve = token_reserve + tokens_sold
+    self.ndaoReserve = ndao_reserve - ndao_bought
     flag: bool = self.token.transferFrom(buyer, self, tokens_sold)
     assert flag, 'transfer token failed'
     flag = self.ndao.transfer(recipient, ndao_bought)
@@ -270,18 +479,25 @@ def tokenToNdaoTransferOutput(ndao_bought: uint256, max_tokens: uint256, deadlin
 
 # token => token
 @private
-def tokenToTokenInput(tokens_sold: uint256, min_tokens_bought: uint256, min_ndao_bought: uint256, deadline: timestamp, buyer: address, recipient: address, exchange_addr: address) -> uint256:
+def tokenToTokenInput(tokens_sold: uint256, min_tokens_bought: uint256, min_ndao_bought: uint256, deadline: timestamp, buyer: address, recipient: address, exchange_addr: address, is_peer: bool) -> uint256:
     assert (deadline >= block.timestamp and tokens_sold > 0) and (
         min_tokens_bought > 0 and min_ndao_bought > 0)
     assert exchange_addr != ZERO_ADDRESS
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
-    ndao_bought: uint256 = self.tokenToNdaoInput(
-        tokens_sold, min_ndao_bought, deadline, buyer, self)
-    # need approve
-    self.ndao.approve(exchange_addr, ndao_bought)
-    tokens_bought: uint256 = Exchange(exchange_addr).ndaoToTokenTransferInput(
-        ndao_bought, min_tokens_bought, deadline, recipient)
+    ndao_bought: uint256 = 0
+    tokens_bought: uint256 = 0
+    if is_peer:
+        # hand the NDAO straight to the peer exchange, no need approve
+        ndao_bought = self.tokenToNdaoInput(
+            tokens_sold, min_ndao_bought, deadline, buyer, exchange_addr)
+        tokens_bought = Exchange(exchange_addr).ndaoToTokenPeerInput(
+            ndao_bought, min_tokens_bought, recipient)
+    else:
+        ndao_bought = self.tokenToNdaoInput(
+            tokens_sold, min_ndao_bought, deadline, buyer, self)
+        # need approve
+        self.ndao.approve(exchange_addr, ndao_bought)
+        tokens_bought = Exchange(exchange_addr).ndaoToTokenTransferInput(
+            ndao_bought, min_tokens_bought, deadline, recipient)
     log.TokenToTokenPurchase(buyer, exchange_addr, tokens_sold, tokens_bought)
     return tokens_bought
 
@@ -298,8 +514,8 @@ def tokenToTokenSwapInput(tokens_sold: uint256, min_tokens_bought: uint256, min_
     # @param token_addr The address of the token being purchased.
     # @return Amount of Tokens (token_addr) bought.
     """
-    exchange_addr: address = self.factory.getExchange(token_addr)
-    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, msg.sender, exchange_addr)
+    exchange_addr: address = self.getPeerExchange(token_addr)
+    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, msg.sender, exchange_addr, True)
 
 
 @public
@@ -316,31 +532,43 @@ def tokenToTokenTransferInput(tokens_sold: uint256, min_tokens_bought: uint256,
     # @param token_addr The address of the token being purchased.
     # @return Amount of Tokens (token_addr) bought.
     """
-    exchange_addr: address = self.factory.getExchange(token_addr)
-    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, recipient, exchange_addr)
+    exchange_addr: address = self.getPeerExchange(token_addr)
+    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, recipient, exchange_addr, True)
 
 
 # token => token
 @private
-def tokenToTokenOutput(tokens_bought: uint256, max_tokens_sold: uint256, max_ndao_sold: uint256, deadline: timestamp, buyer: address, recipient: address, exchange_addr: address) -> uint256:
+def tokenToTokenOutput(tokens_bought: uint256, max_tokens_sold: uint256, max_ndao_sold: uint256, deadline: timestamp, buyer: address, recipient: address, exchange_addr: address, is_peer: bool) -> uint256:
     assert deadline >= block.timestamp and (
         tokens_bought > 0 and max_ndao_sold > 0)
     assert exchange_addr != self and exchange_addr != ZERO_ADDRESS
     # cal ndao_transfer
-    ndao_bought: uint256 = Exchange(
-        exchange_addr).getNdaoToTokenOutputPrice(tokens_bought)
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    ndao_bought: uint256 = 0
+    if is_peer:
+        # the peer exchange sends the tokens first and is paid below
+        ndao_bought = Exchange(exchange_addr).ndaoToTokenPeerOutput(
+            tokens_bought, max_ndao_sold, recipient)
+    else:
+        ndao_bought = Exchange(exchange_addr).getNdaoToTokenOutputPrice(tokens_bought)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
     # cal tokens_sold
     tokens_sold: uint256 = self.getOutputPrice(
         ndao_bought, token_reserve, ndao_reserve)
     assert max_tokens_sold >= tokens_sold and max_ndao_sold >= ndao_bought
+    self.tokenReserve = token_reserve + tokens_sold
+    self.ndaoReserve = ndao_reserve - ndao_bought
     flag: bool = self.token.transferFrom(buyer, self, tokens_sold)
     assert flag, 'transfer tokens_sold failed'
-    # need approve
-    self.ndao.approve(exchange_addr, ndao_bought)
-    Exchange(exchange_addr).ndaoToTokenTransferOutput(
-        tokens_bought, max_ndao_sold, deadline, recipient)
+    if is_peer:
+        flag = self.ndao.transfer(exchange_addr, ndao_bought)
+        assert flag, 'transfer ndao failed'
+    else:
+        # need approve
+        self.ndao.approve(exchange_addr, ndao_bought)
+        Exchange(exchange_addr).ndaoToTokenTransferOutput(
+            tokens_bought, max_ndao_sold, deadline, recipient)
     log.TokenToTokenPurchase(buyer, exchange_addr, tokens_sold, tokens_bought)
     return tokens_sold
 
@@ -357,8 +585,8 @@ def tokenToTokenSwapOutput(tokens_bought: uint256, max_tokens_sold: uint256, max
     # @param token_addr The address of the token being purchased.
     # @return Amount of Tokens (self.token) sold.
     """
-    exchange_addr: address = self.factory.getExchange(token_addr)
-    return self.tokenToTokenOutput(tokens_bought, max_tokens_sold, max_ndao_sold, deadline, msg.sender, msg.sender, exchange_addr)
+    exchange_addr: address = self.getPeerExchange(token_addr)
+    return self.tokenToTokenOutput(tokens_bought, max_tokens_sold, max_ndao_sold, deadline, msg.sender, msg.sender, exchange_addr, True)
 
 
 @public
@@ -375,8 +603,8 @@ def tokenToTokenTransferOutput(tokens_bought: uint256, max_tokens_sold: uint256,
     # @param token_addr The address of the token being purchased.
     # @return Amount of Tokens (self.token) sold.
     """
-    exchange_addr: address = self.factory.getExchange(token_addr)
-    return self.tokenToTokenOutput(tokens_bought, max_tokens_sold, max_ndao_sold, deadline, msg.sender, recipient, exchange_addr)
+    exchange_addr: address = self.getPeerExchange(token_addr)
+    return self.tokenToTokenOutput(tokens_bought, max_tokens_sold, max_ndao_sold, deadline, msg.sender, recipient, exchange_addr, True)
 
 
 @public
@@ -392,7 +620,7 @@ def tokenToExchangeSwapInput(tokens_sold: uint256, min_tokens_bought: uint256, m
     # @param exchange_addr The address of the exchange for the token being purchased.
     # @return Amount of Tokens (exchange_addr.token) bought.
     """
-    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, msg.sender, exchange_addr)
+    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, msg.sender, exchange_addr, False)
 
 
 @public
@@ -411,7 +639,7 @@ def tokenToExchangeTransferInput(tokens_sold: uint256, min_tokens_bought: uint25
     # @return Amount of Tokens (exchange_addr.token) bought.
     """
     assert recipient != self
-    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, recipient, exchange_addr)
+    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, recipient, exchange_addr, False)
 
 
 @public
@@ -427,7 +655,7 @@ def tokenToExchangeSwapOutput(tokens_bought: uint256, max_tokens_sold: uint256,
     # @param exchange_addr The address of the exchange for the token being purchased.
     # @return Amount of Tokens (self.token) sold.
     """
-    return self.tokenToTokenOutput(tokens_bought, max_tokens_sold, max_ndao_sold, deadline, msg.sender, msg.sender, exchange_addr)
+    return self.tokenToTokenOutput(tokens_bought, max_tokens_sold, max_ndao_sold, deadline, msg.sender, msg.sender, exchange_addr, False)
 
 
 @public
@@ -446,7 +674,223 @@ def tokenToExchangeTransferOutput(tokens_bought: uint256, max_tokens_sold: uint2
     # @return Amount of Tokens (self.token) sold.
     """
     assert recipient != self
-    return self.tokenToTokenOutput(tokens_bought, max_tokens_sold, max_ndao_sold, deadline, msg.sender, recipient, exchange_addr)
+    return self.tokenToTokenOutput(tokens_bought, max_tokens_sold, max_ndao_sold, deadline, msg.sender, recipient, exchange_addr, False)
+
+
+# swaps approved by an EIP-2612 signature, no need a separate approve transaction
+@public
+def ndaoToTokenSwapInputWithPermit(ndao_sold: uint256, min_tokens: uint256, deadline: timestamp, v: uint256, r: bytes32, s: bytes32) -> uint256:
+    """
+    # @notice Convert NDAO to Tokens, approving the NDAO with a permit signature.
+    # @dev User specifies exact input and minimum output.
+    # @param ndao_sold Amount of NDAO sold, also the value of the permit.
+    # @param min_tokens Minimum Tokens bought.
+    # @param deadline Time after which neither this transaction nor the permit can be executed.
+    # @param v, r, s The permit signature of msg.sender for this exchange.
+    # @return Amount of Tokens bought.
+    """
+    self.usePermit(self.ndao, msg.sender, ndao_sold, deadline, v, r, s)
+    return self.ndaoToTokenInput(ndao_sold, min_tokens, deadline, msg.sender, msg.sender)
+
+
+@public
+def ndaoToTokenSwapOutputWithPermit(tokens_bought: uint256, max_ndao: uint256, deadline: timestamp, v: uint256, r: bytes32, s: bytes32) -> uint256:
+    """
+    # @notice Convert NDAO to Tokens, approving the NDAO with a permit signature.
+    # @dev User specifies maximum input max_ndao and exact output.
+    # @param tokens_bought Amount of tokens bought.
+    # @param max_ndao Maximum NDAO sold, also the value of the permit.
+    # @param deadline Time after which neither this transaction nor the permit can be executed.
+    # @param v, r, s The permit signature of msg.sender for this exchange.
+    # @return Amount of NDAO sold.
+    """
+    self.usePermit(self.ndao, msg.sender, max_ndao, deadline, v, r, s)
+    return self.ndaoToTokenOutput(tokens_bought, max_ndao, deadline, msg.sender, msg.sender)
+
+
+@public
+def tokenToNdaoSwapInputWithPermit(tokens_sold: uint256, min_ndao: uint256, deadline: timestamp, v: uint256, r: bytes32, s: bytes32) -> uint256:
+    """
+    # @notice Convert Tokens to NDAO, approving the Tokens with a permit signature.
+    # @dev User specifies exact input and minimum output.
+    # @param tokens_sold Amount of Tokens sold, also the value of the permit.
+    # @param min_ndao Minimum NDAO purchased.
+    # @param deadline Time after which neither this transaction nor the permit can be executed.
+    # @param v, r, s The permit signature of msg.sender for this exchange.
+    # @return Amount of NDAO bought.
+    """
+    self.usePermit(self.token, msg.sender, tokens_sold, deadline, v, r, s)
+    return self.tokenToNdaoInput(tokens_sold, min_ndao, deadline, msg.sender, msg.sender)
+
+
+@public
+def tokenToNdaoSwapOutputWithPermit(ndao_bought: uint256, max_tokens: uint256, deadline: timestamp, v: uint256, r: bytes32, s: bytes32) -> uint256:
+    """
+    # @notice Convert Tokens to NDAO, approving the Tokens with a permit signature.
+    # @dev User specifies maximum input and exact output.
+    # @param ndao_bought Amount of NDAO purchased.
+    # @param max_tokens Maximum Tokens sold, also the value of the permit.
+    # @param deadline Time after which neither this transaction nor the permit can be executed.
+    # @param v, r, s The permit signature of msg.sender for this exchange.
+    # @return Amount of Tokens sold.
+    """
+    self.usePermit(self.token, msg.sender, max_tokens, deadline, v, r, s)
+    return self.tokenToNdaoOutput(ndao_bought, max_tokens, deadline, msg.sender, msg.sender)
+
+
+@public
+def tokenToTokenSwapInputWithPermit(tokens_sold: uint256, min_tokens_bought: uint256, min_ndao_bought: uint256, deadline: timestamp, token_addr: address, v: uint256, r: bytes32, s: bytes32) -> uint256:
+    """
+    # @notice Convert Tokens (self.token) to Tokens (token_addr), approving the Tokens
+    #         (self.token) with a permit signature.
+    # @dev User specifies exact input and minimum output.
+    # @param tokens_sold Amount of Tokens sold, also the value of the permit.
+    # @param min_tokens_bought Minimum Tokens (token_addr) purchased.
+    # @param min_ndao_bought Minimum NDAO purchased as intermediary.
+    # @param deadline Time after which neither this transaction nor the permit can be executed.
+    # @param token_addr The address of the token being purchased.
+    # @param v, r, s The permit signature of msg.sender for this exchange.
+    # @return Amount of Tokens (token_addr) bought.
+    """
+    self.usePermit(self.token, msg.sender, tokens_sold, deadline, v, r, s)
+    exchange_addr: address = self.getPeerExchange(token_addr)
+    return self.tokenToTokenInput(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, msg.sender, msg.sender, exchange_addr, True)
+
+
+@public
+def ndaoToTokenPeerInput(ndao_sold: uint256, min_tokens: uint256, recipient: address) -> uint256:
+    """
+    # @notice Convert NDAO handed over by another exchange to Tokens and transfers Tokens to recipient.
+    # @notice No need Approve
+    # @dev Only callable by exchanges created by the factory, which transfer ndao_sold
+    #      to this exchange before the call.
+    # @param ndao_sold Amount of NDAO sold.
+    # @param min_tokens Minimum Tokens bought.
+    # @param recipient The address that receives output Tokens.
+    # @return Amount of Tokens bought.
+    """
+    self.checkPeer(msg.sender)
+    return self.ndaoToTokenPrepaid(ndao_sold, min_tokens, msg.sender, recipient)
+
+
+@public
+def ndaoToTokenPeerOutput(tokens_bought: uint256, max_ndao: uint256, recipient: address) -> uint256:
+    """
+    # @notice Convert NDAO of another exchange to Tokens and transfers Tokens to recipient.
+    # @notice No need Approve
+    # @dev Only callable by exchanges created by the factory, which transfer the returned
+    #      amount of NDAO to this exchange before the end of their call.
+    # @param tokens_bought Amount of Tokens bought.
+    # @param max_ndao Maximum NDAO sold.
+    # @param recipient The address that receives output Tokens.
+    # @return Amount of NDAO sold.
+    """
+    assert recipient != self and recipient != ZERO_ADDRESS
+    self.checkPeer(msg.sender)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
+    ndao_sold: uint256 = self.getOutputPrice(
+        tokens_bought, ndao_reserve, token_reserve)
+    assert ndao_sold <= max_ndao, 'beyond max_ndao'
+    self.tokenReserve = token_reserve - tokens_bought
+    self.ndaoReserve = ndao_reserve + ndao_sold
+    flag: bool = self.token.transfer(recipient, tokens_bought)
+    assert flag, 'transfer token failed'
+    log.TokenPurchase(msg.sender, ndao_sold, tokens_bought)
+    return ndao_sold
+
+
+@public
+def ndaoToTokenPrepaidInput(min_tokens: uint256, recipient: address) -> uint256:
+    """
+    # @notice Convert the NDAO already transferred to this exchange to Tokens.
+    # @notice No need Approve
+    # @dev Used by routers which transfer the input to the exchange in the same transaction.
+    # @dev The NDAO sold is the NDAO balance above the reserve.
+    # @param min_tokens Minimum Tokens bought, may be 0 if the caller checks the output itself.
+    # @param recipient The address that receives output Tokens.
+    # @return Amount of Tokens bought.
+    """
+    return self.ndaoToTokenPrepaid(0, min_tokens, msg.sender, recipient)
+
+
+@public
+def tokenToNdaoPrepaidInput(min_ndao: uint256, recipient: address) -> uint256:
+    """
+    # @notice Convert the Tokens already transferred to this exchange to NDAO.
+    # @notice No need Approve
+    # @dev Used by routers which transfer the input to the exchange in the same transaction.
+    # @dev The Tokens sold are the Token balance above the reserve.
+    # @param min_ndao Minimum NDAO purchased, may be 0 if the caller checks the output itself.
+    # @param recipient The address that receives output NDAO.
+    # @return Amount of NDAO bought.
+    """
+    return self.tokenToNdaoPrepaid(0, min_ndao, msg.sender, recipient)
+
+
+@public
+def onTokenTransfer(_from: address, _value: uint256, _data: bytes[128]):
+    """
+    # @notice Sell the Tokens or NDAO sent by transferAndCall (ERC-677), selling is one call.
+    # @notice No need Approve
+    # @dev _data is abi.encode(min_bought, deadline, recipient, exchange_addr): the minimum output,
+    #      the deadline, the receiver of the output (ZERO_ADDRESS for _from) and, for Tokens only,
+    #      the exchange whose Tokens are bought with the NDAO (ZERO_ADDRESS to receive NDAO).
+    #      exchange_addr may be left out, 96 bytes of _data sell to this exchange.
+    # @param _from The address that sent the Tokens or NDAO.
+    # @param _value Amount of Tokens or NDAO sent.
+    # @param _data The swap parameters.
+    """
+    min_bought: uint256 = extract32(_data, 0, type=uint256)
+    assert extract32(_data, 32, type=uint256) >= as_unitless_number(block.timestamp) and (_value > 0 and min_bought > 0)
+    recipient: address = extract32(_data, 64, type=address)
+    exchange_addr: address = ZERO_ADDRESS
+    if len(_data) > 96:
+        exchange_addr = extract32(_data, 96, type=address)
+    if recipient == ZERO_ADDRESS:
+        recipient = _from
+    if msg.sender == self.ndao:
+        assert exchange_addr == ZERO_ADDRESS
+        self.ndaoToTokenPrepaid(_value, min_bought, _from, recipient)
+        return
+    assert msg.sender == self.token
+    if exchange_addr == ZERO_ADDRESS:
+        self.tokenToNdaoPrepaid(_value, min_bought, _from, recipient)
+        return
+    # hand the NDAO straight to the peer exchange like tokenToExchangeTransferInput
+    self.checkPeer(exchange_addr)
+    tokens_bought: uint256 = Exchange(exchange_addr).ndaoToTokenPeerInput(
+        self.tokenToNdaoPrepaid(_value, 1, _from, exchange_addr), min_bought, recipient)
+    log.TokenToTokenPurchase(_from, exchange_addr, _value, tokens_bought)
+
+
+@public
+def sync():
+    """
+    # @notice Force the reserves to match the balances of this exchange.
+    # @dev Accounts Tokens or NDAO sent to the exchange outside of a swap into the pool.
+    """
+    self.updatePrices(self.tokenReserve, self.ndaoReserve)
+    token_reserve: uint256 = self.token.balanceOf(self)
+    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    self.tokenReserve = token_reserve
+    self.ndaoReserve = ndao_reserve
+    log.Sync(token_reserve, ndao_reserve)
+
+
+@public
+def skim(recipient: address):
+    """
+    # @notice Force the balances of this exchange to match the reserves.
+    # @dev Tokens or NDAO sent to the exchange outside of a swap are transferred to recipient.
+    # @param recipient The address that receives the excess Tokens and NDAO.
+    """
+    assert recipient != self and recipient != ZERO_ADDRESS
+    flag: bool = self.token.transfer(recipient, self.token.balanceOf(self) - self.tokenReserve)
+    assert flag, 'transfer token failed'
+    flag = self.ndao.transfer(recipient, self.ndao.balanceOf(self) - self.ndaoReserve)
+    assert flag, 'transfer ndao failed'
 
 
 @public
@@ -458,8 +902,8 @@ def getNdaoToTokenInputPrice(ndao_sold: uint256) -> uint256:
     # @return Amount of Tokens that can be bought with input NDAO.
     """
     assert ndao_sold > 0
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
     return self.getInputPrice(ndao_sold, ndao_reserve, token_reserve)
 
 
@@ -472,8 +916,8 @@ def getNdaoToTokenOutputPrice(tokens_bought: uint256) -> uint256:
     # @return Amount of NDAO needed to buy output Tokens.
     """
     assert tokens_bought > 0
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
     return self.getOutputPrice(tokens_bought, ndao_reserve, token_reserve)
 
 
@@ -486,8 +930,8 @@ def getTokenToNdaoInputPrice(tokens_sold: uint256) -> uint256:
     # @return Amount of NDAO that can be bought with input Tokens.
     """
     assert tokens_sold > 0
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
     return self.getInputPrice(tokens_sold, token_reserve, ndao_reserve)
 
 
@@ -500,11 +944,75 @@ def getTokenToNdaoOutputPrice(ndao_bought: uint256) -> uint256:
     # @return Amount of Tokens needed to buy output NDAO.
     """
     assert ndao_bought > 0
-    token_reserve: uint256 = self.token.balanceOf(self)
-    ndao_reserve: uint256 = self.ndao.balanceOf(self)
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
     return self.getOutputPrice(ndao_bought, token_reserve, ndao_reserve)
 
 
+@public
+@constant
+def getPrice(amount: uint256, direction: uint256) -> uint256:
+    """
+    # @notice Public price function for any direction which returns 0 instead of throwing.
+    # @param amount Amount of NDAO or Tokens sold (input) or bought (output).
+    # @param direction 0: NDAO to Token input, 1: NDAO to Token output,
+    #                  2: Token to NDAO input, 3: Token to NDAO output.
+    # @return Amount of NDAO or Tokens bought (input) or sold (output), 0 if it can not be traded.
+    """
+    return self.quote(amount, direction, self.tokenReserve, self.ndaoReserve)
+
+
+@public
+@constant
+def getPriceCurve(amounts: uint256[MAX_QUOTES], direction: uint256) -> uint256[MAX_QUOTES]:
+    """
+    # @notice Public price function for many amounts in one direction against the same reserves.
+    # @param amounts Amounts of NDAO or Tokens sold (input) or bought (output), padded with 0.
+    # @param direction 0: NDAO to Token input, 1: NDAO to Token output,
+    #                  2: Token to NDAO input, 3: Token to NDAO output.
+    # @return Amounts of NDAO or Tokens bought (input) or sold (output), 0 if it can not be traded.
+    """
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    prices: uint256[MAX_QUOTES] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                                   0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    for i in range(MAX_QUOTES):
+        prices[i] = self.quote(amounts[i], direction, token_reserve, ndao_reserve)
+    return prices
+
+
+@public
+@constant
+def getAveragePrices(window: timedelta) -> (uint256, uint256):
+    """
+    # @notice Time weighted average prices over at least the last window seconds.
+    # @dev The window starts at the latest saved observation old enough, so it is
+    #      up to OBSERVATION_PERIOD seconds longer than asked.
+    # @param window The length of the period to average over, at most 24 hours.
+    # @return Price of Token in NDAO and price of NDAO in Token, both scaled by 10 ** 18.
+    """
+    assert window > 0
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    token_cumulative: uint256 = self.tokenPriceCumulative
+    ndao_cumulative: uint256 = self.ndaoPriceCumulative
+    # the prices since the last update are those of the current reserves
+    elapsed: uint256 = as_unitless_number(block.timestamp - self.blockTimestampLast)
+    if elapsed > 0 and token_reserve > 0 and ndao_reserve > 0:
+        token_cumulative += ndao_reserve * PRICE_PRECISION / token_reserve * elapsed
+        ndao_cumulative += token_reserve * PRICE_PRECISION / ndao_reserve * elapsed
+    index: uint256 = self.observationIndex
+    for i in range(OBSERVATION_COUNT):
+        observation: Observation = self.observations[index]
+        if observation.blockTimestamp == 0:
+            break
+        if block.timestamp - observation.blockTimestamp >= window:
+            elapsed = as_unitless_number(block.timestamp - observation.blockTimestamp)
+            return (token_cumulative - observation.tokenPriceCumulative) / elapsed, (ndao_cumulative - observation.ndaoPriceCumulative) / elapsed
+        index = (index + OBSERVATION_COUNT - 1) % OBSERVATION_COUNT
+    raise 'not enough observations'
+
+
 @public
 @constant
 def tokenAddress() -> address:
@@ -539,3 +1047,61 @@ def getMaxPool() -> uint256:
     # @return maxPool of token on this exchange.
     """
     return self.maxPool
+
+
+@public
+def ndaoToTokenTransferInputMany(ndao_sold: uint256[MAX_RECIPIENTS], min_tokens: uint256[MAX_RECIPIENTS], deadline: timestamp, recipients: address[MAX_RECIPIENTS], sequential: bool) -> uint256:
+    """
+    # @notice Convert NDAO to Tokens for many recipients, pulling the NDAO with one transferFrom.
+    # @notice Need Approve
+    # @dev The entries end at the first ZERO_ADDRESS recipient. By default the total NDAO is priced
+    #      once against the reserves and the Tokens it buys are split pro rata, rounding down;
+    #      sequential prices every entry after the previous ones, like separate ndaoToTokenTransferInput.
+    #      One TokenPurchase logs the totals.
+    # @param ndao_sold Amounts of NDAO sold for each recipient.
+    # @param min_tokens Minimum Tokens bought for each recipient.
+    # @param deadline Time after which this transaction can no longer be executed.
+    # @param recipients The addresses that receive output Tokens.
+    # @param sequential True to price the entries one after the other.
+    # @return Amount of Tokens bought in total.
+    """
+    assert deadline >= block.timestamp
+    total_ndao: uint256 = 0
+    count: int128 = MAX_RECIPIENTS
+    for i in range(MAX_RECIPIENTS):
+        if recipients[i] == ZERO_ADDRESS:
+            count = i
+            break
+        assert recipients[i] != self and (ndao_sold[i] > 0 and min_tokens[i] > 0)
+        total_ndao += ndao_sold[i]
+    assert count > 0
+    token_reserve: uint256 = self.tokenReserve
+    ndao_reserve: uint256 = self.ndaoReserve
+    self.updatePrices(token_reserve, ndao_reserve)
+    total_tokens: uint256 = 0
+    if not sequential:
+        total_tokens = self.getInputPrice(total_ndao, ndao_reserve, token_reserve)
+    tokens_left: uint256 = token_reserve
+    ndao_in: uint256 = ndao_reserve
+    tokens_bought: uint256[MAX_RECIPIENTS] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    for i in range(MAX_RECIPIENTS):
+        if i == count:
+            break
+        if sequential:
+            tokens_bought[i] = self.getInputPrice(ndao_sold[i], ndao_in, tokens_left)
+            ndao_in += ndao_sold[i]
+        else:
+            tokens_bought[i] = total_tokens * ndao_sold[i] / total_ndao
+        assert tokens_bought[i] >= min_tokens[i], 'little than min_tokens'
+        tokens_left -= tokens_bought[i]
+    self.tokenReserve = tokens_left
+    self.ndaoReserve = ndao_reserve + total_ndao
+    flag: bool = self.ndao.transferFrom(msg.sender, self, total_ndao)
+    assert flag, 'transfer ndao failed'
+    for i in range(MAX_RECIPIENTS):
+        if i == count:
+            break
+        flag = self.token.transfer(recipients[i], tokens_bought[i])
+        assert flag, 'transfer token failed'
+    log.TokenPurchase(msg.sender, total_ndao, token_reserve - tokens_left)
+    return token_reserve - tokens_left
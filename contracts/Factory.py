@@ -3,9 +3,14 @@
 from vyper.interfaces import ERC20
 
 
+# Vyper does not allow for dynamic arrays, NDAOToken.mintMany takes MAX_MINTS recipients
+MAX_MINTS: constant(int128) = 2
+
+
 # the contract of NDAO ERC20 token
 contract NDAO:
     def mint(_to: address, _value: uint256): modifying
+    def mintMany(_to: address[MAX_MINTS], _value: uint256[MAX_MINTS]): modifying
     def decimals() -> uint256: constant
 
 
@@ -13,12 +18,15 @@ contract NDAO:
 contract Exchange:
     def setup(token_addr: address, ndao_address: address,
               token_amount: uint256): modifying
+    def tokenReserve() -> uint256: constant
+    def ndaoReserve() -> uint256: constant
 
 
 # the ICO contract
 contract ICO:
     def setup(_name: string[64], _symbol: string[32], _decimals: uint256, _depositGoal: uint256,
-              _deltaOfEnd: timedelta, _deltaOfSubmitssion: timedelta, token_price: uint256, _creater: address): modifying
+              _deltaOfEnd: timedelta, _deltaOfSubmitssion: timedelta, token_price: uint256, _creater: address,
+              _lazyMint: bool): modifying
 
 
 # ETH价格查询合约
@@ -32,6 +40,8 @@ STATUS_STARTED: constant(uint256) = 1  # 1
 STATUS_SUCCESS: constant(uint256) = 2  # 2
 STATUS_FAILED: constant(uint256) = 3  # 3
 MAX_NUMBER: constant(int128) = 128
+# Vyper does not allow for dynamic arrays, the paged views return PAGE_SIZE items
+PAGE_SIZE: constant(int128) = 16
 
 # 定义对应事件
 NewExchange: event(
@@ -40,6 +50,7 @@ ICOCreated: event({_creater: indexed(address), _ico: address})
 ICOUpdate: event({_token: indexed(address), _status: uint256})
 NewSetter: event({_from: indexed(address), _to: indexed(address)})
 NewSubmitDelta: event({_newDelta: timedelta})
+NewPriceWindow: event({_newWindow: timedelta})
 
 exchangeTemplate: public(address)  # 交易模板里面含有代码，可以创建新合约，方法为Exchange的setup方法
 icoTemplate: public(address)  # ICO模板
@@ -56,14 +67,23 @@ allIcoAddressOfUser: public(map(address, address[MAX_NUMBER]))
 # the ico amount of each account
 allIcoCountsOfUser: public(map(address, int128))
 allIcoCreater: public(map(address, address))  # 所有ICO创建者的地址，用来发给它稳定币
+# 按状态分组的ICO集合, 状态 => 序号 => ICO地址, 可以遍历
+icosWithStatus: map(uint256, map(uint256, address))
+icoCountWithStatus: public(map(uint256, uint256))  # 每个状态的ICO数量
+icoIndexInStatus: map(address, uint256)  # ICO在其状态集合中的序号
 submitssionDelta: public(timedelta)  # ICO结束后到最后提交时间间隔，可以设置，暂时定为72小时
 setter: public(address)  # 设定上述时间间隔的地址
+ndaoDecimals: public(uint256)  # 稳定币精度, 初始化时读取一次
+cachedEthPrice: public(uint256)  # 缓存的ETH价格, 0.01$对应的WEI数量
+ethPriceUpdatedAt: public(timestamp)  # 缓存ETH价格的时间
+ethPriceWindow: public(timedelta)  # 缓存ETH价格的有效时长, 超过后重新查询, 可以设置
 
 
 @public
 def __init__():
     self.setter = msg.sender
     self.submitssionDelta = 3 * 24 * 3600
+    self.ethPriceWindow = 10 * 60
 
 
 @public
@@ -82,6 +102,14 @@ def setSubmitssionDelta(_newDelta: timedelta):
     log.NewSubmitDelta(_newDelta)
 
 
+# 为0时每次都重新查询ETH价格
+@public
+def setEthPriceWindow(_newWindow: timedelta):
+    assert msg.sender == self.setter
+    self.ethPriceWindow = _newWindow
+    log.NewPriceWindow(_newWindow)
+
+
 # 设置模板地址和接收ETH地址
 @public
 def initializeFactory(template: address, _beneficiary: address, _ndaoAddress: address, _queryAddress: address, _icoAddress: address):
@@ -96,28 +124,62 @@ def initializeFactory(template: address, _beneficiary: address, _ndaoAddress: ad
     self.ndaoAddress = _ndaoAddress
     self.queryAddress = _queryAddress
     self.icoTemplate = _icoAddress
+    self.ndaoDecimals = NDAO(_ndaoAddress).decimals()
 
 
-@public
-def createICO(_name: string[64], _symbol: string[32], _decimals: uint256, _depositGoal: uint256, _delta: timedelta, _price: uint256):
+# 修改ICO状态, 同时把它从原状态集合移到新状态集合, 都是O(1)
+@private
+def _setIcoStatus(ico: address, status: uint256):
+    old_status: uint256 = self.allIcoStatus[ico]
+    if old_status != STATUS_NONE:
+        # 用集合中最后一个ICO填补移走的位置
+        index: uint256 = self.icoIndexInStatus[ico]
+        last: uint256 = self.icoCountWithStatus[old_status] - 1
+        if index != last:
+            moved: address = self.icosWithStatus[old_status][last]
+            self.icosWithStatus[old_status][index] = moved
+            self.icoIndexInStatus[moved] = index
+        self.icosWithStatus[old_status][last] = ZERO_ADDRESS
+        self.icoCountWithStatus[old_status] = last
+    count: uint256 = self.icoCountWithStatus[status]
+    self.icosWithStatus[status][count] = ico
+    self.icoIndexInStatus[ico] = count
+    self.icoCountWithStatus[status] = count + 1
+    self.allIcoStatus[ico] = status
+    log.ICOUpdate(ico, status)
+
+
+@private
+def _createICO(creater: address, _name: string[64], _symbol: string[32], _decimals: uint256, _depositGoal: uint256, _delta: timedelta, _price: uint256, _lazyMint: bool):
     assert self.icoTemplate != ZERO_ADDRESS
-    assert self.allIcoCountsOfUser[msg.sender] < MAX_NUMBER
+    assert self.allIcoCountsOfUser[creater] < MAX_NUMBER
     ico: address = create_forwarder_to(self.icoTemplate)
     assert self.allIcoStatus[ico] == STATUS_NONE
     ICO(ico).setup(_name, _symbol, _decimals, _depositGoal,
-                   _delta, self.submitssionDelta, _price, msg.sender)
-    index: int128 = self.allIcoCountsOfUser[msg.sender]
-    self.allIcoCountsOfUser[msg.sender] = index + 1
-    self.allIcoAddressOfUser[msg.sender][index] = ico
-    self.allIcoStatus[ico] = STATUS_STARTED
-    self.allIcoCreater[ico] = msg.sender
-    log.ICOCreated(msg.sender, ico)
+                   _delta, self.submitssionDelta, _price, creater, _lazyMint)
+    index: int128 = self.allIcoCountsOfUser[creater]
+    self.allIcoCountsOfUser[creater] = index + 1
+    self.allIcoAddressOfUser[creater][index] = ico
+    self._setIcoStatus(ico, STATUS_STARTED)
+    self.allIcoCreater[ico] = creater
+    log.ICOCreated(creater, ico)
+
+
+@public
+def createICO(_name: string[64], _symbol: string[32], _decimals: uint256, _depositGoal: uint256, _delta: timedelta, _price: uint256):
+    self._createICO(msg.sender, _name, _symbol, _decimals, _depositGoal, _delta, _price, False)
+
+
+# 投资时只记录投资额, ICO成功后投资者再领取代币, 投资更省gas
+@public
+def createLazyICO(_name: string[64], _symbol: string[32], _decimals: uint256, _depositGoal: uint256, _delta: timedelta, _price: uint256):
+    self._createICO(msg.sender, _name, _symbol, _decimals, _depositGoal, _delta, _price, True)
 
 
 @public
 def endIco():
     if self.allIcoStatus[msg.sender] == STATUS_STARTED:
-        self.allIcoStatus[msg.sender] = STATUS_FAILED
+        self._setIcoStatus(msg.sender, STATUS_FAILED)
 
 
 @public
@@ -130,16 +192,42 @@ def getLatestIco() -> address:
         return ZERO_ADDRESS
 
 
-# 计算ETH对应的NDAO数量
+# 查询并缓存ETH价格
 @private
-@constant
-def _calNdaoAmount(eth_amount: wei_value) -> uint256:
+def _refreshEthPrice() -> uint256:
     price: uint256 = QueryEthPrice(self.queryAddress).getEthPrice()
+    assert price > 0
+    self.cachedEthPrice = price
+    self.ethPriceUpdatedAt = block.timestamp
+    return price
+
+
+# 计算ETH对应的NDAO数量, 缓存的价格过期后才重新查询
+@private
+def _calNdaoAmount(eth_amount: wei_value) -> uint256:
+    price: uint256 = self.cachedEthPrice
+    if price == 0 or block.timestamp >= self.ethPriceUpdatedAt + self.ethPriceWindow:
+        price = self._refreshEthPrice()
     result: uint256 = as_unitless_number(
-        eth_amount) * 10**(NDAO(self.ndaoAddress).decimals() - 2) / price
+        eth_amount) * 10**(self.ndaoDecimals - 2) / price
     return result
 
 
+# 任何人都可以在价格变化后立即刷新缓存
+@public
+def refreshEthPrice() -> uint256:
+    return self._refreshEthPrice()
+
+
+# @dev 缓存的ETH价格和它已经缓存的时长
+# @dev 第一次刷新之前ethPriceUpdatedAt为0: 价格为0, 时长就是block.timestamp, 调用方应把价格0当作没有缓存
+# @return 缓存的ETH价格, 距上次刷新的秒数
+@public
+@constant
+def getCachedEthPrice() -> (uint256, timedelta):
+    return self.cachedEthPrice, block.timestamp - self.ethPriceUpdatedAt
+
+
 
 # 直接通过ETH购买NDAO
 # todo 收益人未确定
@@ -170,7 +258,7 @@ def createExchange():
     assert self.token_to_exchange[msg.sender] == ZERO_ADDRESS
     assert self.allIcoStatus[msg.sender] == STATUS_STARTED
     assert self.allIcoCreater[msg.sender] != ZERO_ADDRESS
-    self.allIcoStatus[msg.sender] = STATUS_SUCCESS
+    self._setIcoStatus(msg.sender, STATUS_SUCCESS)
     # 创建交易合约并设置token
     exchange: address = create_forwarder_to(self.exchangeTemplate)
     token_amount: uint256 = ERC20(msg.sender).balanceOf(self)
@@ -179,12 +267,11 @@ def createExchange():
     assert flag
     # 发送ETH到仓库地址
     send(self.beneficiary, msg.value)
-    # 设置交易对合约
-    Exchange(exchange).setup(msg.sender, self.ndaoAddress, token_amount)
     # 增发稳定币,创建得和交易对各1倍
     ndao_amount: uint256 = self._calNdaoAmount(msg.value)
-    NDAO(self.ndaoAddress).mint(exchange, ndao_amount)
-    NDAO(self.ndaoAddress).mint(self.allIcoCreater[msg.sender], ndao_amount)
+    NDAO(self.ndaoAddress).mintMany([exchange, self.allIcoCreater[msg.sender]], [ndao_amount, ndao_amount])
+    # 设置交易对合约,代币和稳定币到账后再调用以记录初始储备
+    Exchange(exchange).setup(msg.sender, self.ndaoAddress, token_amount)
     self._saveExchangeInfo(msg.sender, exchange)
     log.NewExchange(msg.sender, exchange, ndao_amount, token_amount)
 
@@ -208,3 +295,84 @@ def getToken(exchange: address) -> address:
 @constant
 def getTokenWithId(token_id: uint256) -> address:
     return self.id_to_token[token_id]
+
+
+# 分页获取交易对信息: token, 交易对合约, 两种储备, ICO状态, ICO创建者
+# 编号从start_id开始, 不存在的编号返回0
+@public
+@constant
+def getMarketsWithId(start_id: uint256) -> (address[PAGE_SIZE], address[PAGE_SIZE], uint256[PAGE_SIZE], uint256[PAGE_SIZE], uint256[PAGE_SIZE], address[PAGE_SIZE]):
+    assert start_id > 0
+    tokens: address[PAGE_SIZE] = [
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS]
+    exchanges: address[PAGE_SIZE] = [
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS]
+    token_reserves: uint256[PAGE_SIZE] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    ndao_reserves: uint256[PAGE_SIZE] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    status: uint256[PAGE_SIZE] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    creaters: address[PAGE_SIZE] = [
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS]
+    count: uint256 = self.tokenCount
+    for i in range(PAGE_SIZE):
+        token_id: uint256 = start_id + convert(i, uint256)
+        if token_id > count:
+            break
+        token: address = self.id_to_token[token_id]
+        exchange: address = self.token_to_exchange[token]
+        tokens[i] = token
+        exchanges[i] = exchange
+        token_reserves[i] = Exchange(exchange).tokenReserve()
+        ndao_reserves[i] = Exchange(exchange).ndaoReserve()
+        status[i] = self.allIcoStatus[token]
+        creaters[i] = self.allIcoCreater[token]
+    return tokens, exchanges, token_reserves, ndao_reserves, status, creaters
+
+
+# 分页获取某个用户创建的ICO及其状态, 从第start个开始(从0开始), 不存在的返回0
+@public
+@constant
+def getIcosOfUser(user: address, start: int128) -> (address[PAGE_SIZE], uint256[PAGE_SIZE]):
+    assert start >= 0
+    icos: address[PAGE_SIZE] = [
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS]
+    status: uint256[PAGE_SIZE] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    count: int128 = self.allIcoCountsOfUser[user]
+    for i in range(PAGE_SIZE):
+        index: int128 = start + i
+        if index >= count:
+            break
+        ico: address = self.allIcoAddressOfUser[user][index]
+        icos[i] = ico
+        status[i] = self.allIcoStatus[ico]
+    return icos, status
+
+
+# 分页获取某个状态的ICO, 从第start个开始(从0开始), 不存在的返回0
+# 集合移除时会调换顺序, 翻页期间有状态变化时可能漏掉或重复
+@public
+@constant
+def getIcosWithStatus(status: uint256, start: uint256) -> address[PAGE_SIZE]:
+    icos: address[PAGE_SIZE] = [
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS]
+    count: uint256 = self.icoCountWithStatus[status]
+    for i in range(PAGE_SIZE):
+        index: uint256 = start + convert(i, uint256)
+        if index >= count:
+            break
+        icos[i] = self.icosWithStatus[status][index]
+    return icos
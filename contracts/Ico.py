@@ -5,12 +5,28 @@ from vyper.interfaces import ERC20
 implements: ERC20
 
 
+# the receiver of transferAndCall, see ERC-677
+contract TokenReceiver:
+    def onTokenTransfer(_from: address, _value: uint256, _data: bytes[128]): modifying
+
+
 # define the Factory contract
 contract Factory:
     def createExchange(): modifying
     def endIco(): modifying
 
 ETHER_TO_WEI: constant(uint256) = 10 ** 18
+# Vyper does not allow for dynamic arrays, we have limited the number of holders claimed at once
+MAX_CLAIMS: constant(int128) = 32
+# the number of users refunded at once, and listed by getDepositors
+MAX_REFUNDS: constant(int128) = 32
+# EIP-712 type hashes used by permit
+# keccak256("EIP712Domain(string name,string version,uint256 chainId,address verifyingContract)")
+EIP712_DOMAIN_TYPEHASH: constant(bytes32) = 0x8b73c3c69bb8fe3d512ecc4cf759cc79239f7b179b0ffacaa9a75d522b39400f
+# keccak256("Permit(address owner,address spender,uint256 value,uint256 nonce,uint256 deadline)")
+PERMIT_TYPEHASH: constant(bytes32) = 0x6e71edae12b1b97f4d1f60370fef10105fa2faae0126114a169c64845d6126c9
+# keccak256("1")
+VERSION_HASH: constant(bytes32) = 0xc89efdaa54c0f20c7adf612882df0950f5a951637e0307cdcb4c672f298b8bc6
 
 # event of ERC-20
 Transfer: event(
@@ -20,6 +36,8 @@ Approval: event({_owner: indexed(address),
 # event of ICO
 GoalReached: event({_goalTime: timestamp, _depositGoal: wei_value})
 RefundTransfer: event({_owner: indexed(address), _amount: wei_value})
+Claim: event({_owner: indexed(address), _amount: uint256})
+RefundSkipped: event({_owner: indexed(address), _amount: wei_value})
 
 
 # ERC20 state varialbes
@@ -29,26 +47,35 @@ decimals: public(uint256)  # 精度
 balanceOf: public(map(address, uint256))  # 每个账户余额
 allowances: map(address, map(address, uint256))  # 每个账号的授权情况
 total_supply: uint256  # 总发行量
+nonces: public(map(address, uint256))  # EIP-2612 每个账户已使用的签名授权次数
 # ICO state varialbes
-
-depositGoal: public(wei_value)  # ICO募资目标
-depositStart: public(timestamp)  # ICO开始时间
-depositEnd: public(timestamp)  # ICO结束时间
-finalSubmissionTime: public(timestamp)  # ICO最后提交验证截止时间
-isEnd: public(bool)  # ICO是否结束
-goalReached: public(bool)  # ICO是否目标达成
-isFailed: public(bool)  # ICO是否失败
+# ICO的状态, 不使用enum
+STATE_OPEN: constant(uint256) = 0  # 募资中
+STATE_GOAL_REACHED: constant(uint256) = 1  # 募资目标达成, 等待提交
+STATE_SUCCEEDED: constant(uint256) = 2  # ICO已提交并创建交易所
+STATE_FAILED: constant(uint256) = 3  # 目标未达成或未达成前被取消
+STATE_CANCELLED: constant(uint256) = 4  # 目标达成后被取消
+MASK_8: constant(uint256) = 2 ** 8 - 1
+LAZY_MINT_FLAG: constant(uint256) = 2 ** 8  # lifecycle中lazyMint所在位
+MASK_64: constant(uint256) = 2 ** 64 - 1
+MASK_96: constant(uint256) = 2 ** 96 - 1
+# 生命周期字段打包在一个存储槽, 每次投资与提交少读写几个槽:
+# state(8位) | lazyMint(8位) | depositStart(64位) | depositEnd(64位) | finalSubmissionTime(64位)
+lifecycle: uint256
+# 募资字段打包在一个存储槽: depositGoal(96位) | depositAmount(96位) | depositorCount(64位)
+deposits: uint256
 # 发行ICO时token价格，1ETH兑换多少token，暂未考虑发行token价格高于ETH的情况
 tokenPrice: public(uint256)
-depositAmount: public(wei_value)  # 当前已经募资总量
 depositBalanceOfUser: public(map(address, wei_value))  # 记录每个投资者的投资资金
 factory: public(address)  # factory合约地址，用来接受ICO
 creater: public(address)   # ICO申请者,用来提交ICO或者取消ICO
+depositors: map(uint256, address)  # 按首次投资顺序记录的投资者, 用于批量退款
 
 
 @public
 def setup(_name: string[64], _symbol: string[32], _decimals: uint256, _depositGoal: uint256,
-          _deltaOfEnd: timedelta, _deltaOfSubmitssion: timedelta, token_price: uint256, _creater: address):
+          _deltaOfEnd: timedelta, _deltaOfSubmitssion: timedelta, token_price: uint256, _creater: address,
+          _lazyMint: bool):
     """
     @dev init the contract.
     @notice the method is called once right after the contract is deployed
@@ -59,15 +86,22 @@ def setup(_name: string[64], _symbol: string[32], _decimals: uint256, _depositGo
     @param _deltaOfEnd the duration of ICO (second)
     @param _deltaOfSubmitssion the duration between depositEnd and finalSubmissionTime
     @param token_price the amount of token that one ether can exchange
+    @param _creater the address that can submit or cancel the ICO
+    @param _lazyMint only record the deposits, the tokens are claimed after the ICO succeeded
     """
     assert self.factory == ZERO_ADDRESS and _creater != ZERO_ADDRESS
     self.name = _name
     self.symbol = _symbol
     self.decimals = _decimals
-    self.depositGoal = as_wei_value(_depositGoal, 'wei')
-    self.depositStart = block.timestamp
-    self.depositEnd = self.depositStart + _deltaOfEnd
-    self.finalSubmissionTime = self.depositEnd + _deltaOfSubmitssion
+    _start: uint256 = as_unitless_number(block.timestamp)
+    _end: uint256 = _start + as_unitless_number(_deltaOfEnd)
+    _final: uint256 = _end + as_unitless_number(_deltaOfSubmitssion)
+    assert _final <= MASK_64 and _depositGoal <= MASK_96
+    _lifecycle: uint256 = shift(_start, 16) + shift(_end, 80) + shift(_final, 144)
+    if _lazyMint:
+        _lifecycle += LAZY_MINT_FLAG
+    self.lifecycle = _lifecycle
+    self.deposits = _depositGoal
     self.tokenPrice = token_price
     self.creater = _creater
     self.factory = msg.sender
@@ -140,6 +174,62 @@ def approve(_spender: address, _value: uint256) -> bool:
     return True
 
 
+@private
+@constant
+def domainSeparator() -> bytes32:
+    # 每次计算而不存储, 避免每个ICO创建时多写一个存储槽
+    return keccak256(concat(
+        EIP712_DOMAIN_TYPEHASH,
+        keccak256(self.name),
+        VERSION_HASH,
+        convert(chain.id, bytes32),
+        convert(self, bytes32)))
+
+
+@public
+@constant
+def DOMAIN_SEPARATOR() -> bytes32:
+    """
+    @dev The EIP-712 domain of the permit signatures.
+    """
+    return self.domainSeparator()
+
+
+@public
+def permit(_owner: address, _spender: address, _value: uint256, _deadline: timestamp,
+           _v: uint256, _r: bytes32, _s: bytes32) -> bool:
+    """
+    @dev Approve by signature, see https://eips.ethereum.org/EIPS/eip-2612
+         `_v` is an uint256 because vyper has no uint8, the selector is
+         the one of permit(address,address,uint256,uint256,uint256,bytes32,bytes32).
+    @param _owner The address which owns the funds and signed the permit.
+    @param _spender The address which will spend the funds.
+    @param _value The amount of tokens to be spent.
+    @param _deadline Time after which the signature can no longer be used.
+    @param _v The recovery id of the signature.
+    @param _r The r value of the signature.
+    @param _s The s value of the signature.
+    """
+    assert _owner != ZERO_ADDRESS
+    assert block.timestamp <= _deadline, 'permit expired'
+    nonce: uint256 = self.nonces[_owner]
+    digest: bytes32 = keccak256(concat(
+        b'\x19\x01',
+        self.domainSeparator(),
+        keccak256(concat(
+            PERMIT_TYPEHASH,
+            convert(_owner, bytes32),
+            convert(_spender, bytes32),
+            convert(_value, bytes32),
+            convert(nonce, bytes32),
+            convert(_deadline, bytes32)))))
+    assert ecrecover(digest, _v, convert(_r, uint256), convert(_s, uint256)) == _owner, 'invalid signature'
+    self.nonces[_owner] = nonce + 1
+    self.allowances[_owner][_spender] = _value
+    log.Approval(_owner, _spender, _value)
+    return True
+
+
 @private
 def mint(_to: address, _value: uint256):
     """
@@ -160,29 +250,38 @@ def mint(_to: address, _value: uint256):
 @private
 def _checkDeposit(sender: address, value: wei_value):
     """
-    @dev Receive the ether and mint proper tokens
+    @dev Receive the ether and mint proper tokens, in lazyMint mode only record the deposit
     @param value The account of the ether.
     @param sender The address that prepare to be minted .
     """
-    assert block.timestamp <= self.depositEnd, 'the ico has timeout'
-    assert not self.goalReached, 'the ico has completed'
-    if self.depositAmount + value >= self.depositGoal:
-        self.goalReached = True
-        _refund: wei_value = self.depositAmount + value - self.depositGoal
-        _deposit_amount: wei_value = self.depositGoal - self.depositAmount
-        self.depositAmount += _deposit_amount
-        self.depositBalanceOfUser[sender] += _deposit_amount
-        _token_amount: uint256 = as_unitless_number(
-            _deposit_amount) * self.tokenPrice / ETHER_TO_WEI
-        self.mint(sender, _token_amount)
-        send(sender, _refund)
-        log.GoalReached(block.timestamp, self.depositGoal)
-    else:
-        self.depositBalanceOfUser[sender] += value
-        self.depositAmount += value
-        _token_amount: uint256 = as_unitless_number(
-            value) * self.tokenPrice / ETHER_TO_WEI
-        self.mint(sender, _token_amount)
+    _lifecycle: uint256 = self.lifecycle
+    assert as_unitless_number(block.timestamp) <= bitwise_and(shift(_lifecycle, -80), MASK_64), 'the ico has timeout'
+    assert bitwise_and(_lifecycle, MASK_8) == STATE_OPEN, 'the ico has completed'
+    # 0 wei 的投资会把投资者重复记入 depositors
+    assert value > 0
+    _deposits: uint256 = self.deposits
+    _goal: uint256 = bitwise_and(_deposits, MASK_96)
+    _amount: uint256 = bitwise_and(shift(_deposits, -96), MASK_96)
+    _count: uint256 = shift(_deposits, -192)
+    _balance: wei_value = self.depositBalanceOfUser[sender]
+    if _balance == 0:
+        self.depositors[_count] = sender
+        _count += 1
+    _deposit_amount: uint256 = as_unitless_number(value)
+    _refund: uint256 = 0
+    _reached: bool = _amount + _deposit_amount >= _goal
+    if _reached:
+        _refund = _amount + _deposit_amount - _goal
+        _deposit_amount = _goal - _amount
+        # 状态位此时为STATE_OPEN(0)
+        self.lifecycle = _lifecycle + STATE_GOAL_REACHED
+    self.deposits = _goal + shift(_amount + _deposit_amount, 96) + shift(_count, 192)
+    self.depositBalanceOfUser[sender] = _balance + as_wei_value(_deposit_amount, 'wei')
+    if bitwise_and(_lifecycle, LAZY_MINT_FLAG) == 0:
+        self.mint(sender, _deposit_amount * self.tokenPrice / ETHER_TO_WEI)
+    if _reached:
+        send(sender, as_wei_value(_refund, 'wei'))
+        log.GoalReached(block.timestamp, as_wei_value(_goal, 'wei'))
 
 
 @public
@@ -208,14 +307,17 @@ def cancelICO():
     """
     @dev  cancel the ICO ,this is called only once by creater  before ended or by anyonde after finalSubmissionTime
     """
-    assert block.timestamp > self.depositEnd and (not self.isFailed)
-    self.isFailed = True
-    self.isEnd = True
-    if block.timestamp <= self.finalSubmissionTime:
-        assert msg.sender == self.creater
-        Factory(self.factory).endIco()
+    _lifecycle: uint256 = self.lifecycle
+    _state: uint256 = bitwise_and(_lifecycle, MASK_8)
+    _now: uint256 = as_unitless_number(block.timestamp)
+    assert _now > bitwise_and(shift(_lifecycle, -80), MASK_64) and _state < STATE_SUCCEEDED
+    if _state == STATE_GOAL_REACHED:
+        self.lifecycle = _lifecycle + (STATE_CANCELLED - STATE_GOAL_REACHED)
     else:
-        Factory(self.factory).endIco()
+        self.lifecycle = _lifecycle + STATE_FAILED
+    if _now <= shift(_lifecycle, -144):
+        assert msg.sender == self.creater
+    Factory(self.factory).endIco()
 
 
 @public
@@ -223,14 +325,22 @@ def submitICO():
     """
     @dev  submit the ICO  only once by creater
     """
-    assert block.timestamp > self.depositEnd and  block.timestamp < self.finalSubmissionTime
-    assert msg.sender == self.creater and (not self.isEnd)
-    self.isEnd = True
-    if self.goalReached:
-        self.mint(self.factory, self.total_supply)
-        Factory(self.factory).createExchange(value=self.depositGoal)
+    _lifecycle: uint256 = self.lifecycle
+    _state: uint256 = bitwise_and(_lifecycle, MASK_8)
+    _now: uint256 = as_unitless_number(block.timestamp)
+    assert _now > bitwise_and(shift(_lifecycle, -80), MASK_64) and _now < shift(_lifecycle, -144)
+    assert msg.sender == self.creater and _state < STATE_SUCCEEDED
+    if _state == STATE_GOAL_REACHED:
+        self.lifecycle = _lifecycle + (STATE_SUCCEEDED - STATE_GOAL_REACHED)
+        _goal: uint256 = bitwise_and(self.deposits, MASK_96)
+        if bitwise_and(_lifecycle, LAZY_MINT_FLAG) != 0:
+            # 投资者的代币还未领取, 按募资总量计算, 目标达成时募资总量等于目标
+            self.mint(self.factory, _goal * self.tokenPrice / ETHER_TO_WEI)
+        else:
+            self.mint(self.factory, self.total_supply)
+        Factory(self.factory).createExchange(value=as_wei_value(_goal, 'wei'))
     else:
-        self.isFailed = True
+        self.lifecycle = _lifecycle + STATE_FAILED
         Factory(self.factory).endIco()
 
 
@@ -240,13 +350,112 @@ def safeWithdrawal():
     @dev when ico is ended and failed,the user withdraws their deposit ethers.
           this function is using the withdrawal pattern.
     """
-    assert self.isEnd and self.isFailed, 'the ico has not ended or the ico is successful'
+    assert bitwise_and(self.lifecycle, MASK_8) >= STATE_FAILED, 'the ico has not ended or the ico is successful'
     amount: wei_value = self.depositBalanceOfUser[msg.sender]
     self.depositBalanceOfUser[msg.sender] = 0
     send(msg.sender, amount)
     log.RefundTransfer(msg.sender, amount)
 
 
+@private
+def _claim(_owner: address):
+    """
+    @dev Mint the tokens of the deposit of _owner, the deposit record is cleared.
+    """
+    _deposit: wei_value = self.depositBalanceOfUser[_owner]
+    if _deposit == 0:
+        return
+    self.depositBalanceOfUser[_owner] = 0
+    _token_amount: uint256 = as_unitless_number(_deposit) * self.tokenPrice / ETHER_TO_WEI
+    self.mint(_owner, _token_amount)
+    log.Claim(_owner, _token_amount)
+
+
+@public
+@constant
+def claimable(_owner: address) -> uint256:
+    """
+    @dev The amount of tokens _owner can claim once the ico succeeded in lazyMint mode.
+    """
+    _lifecycle: uint256 = self.lifecycle
+    if bitwise_and(_lifecycle, LAZY_MINT_FLAG) == 0 or bitwise_and(_lifecycle, MASK_8) >= STATE_FAILED:
+        return 0
+    return as_unitless_number(self.depositBalanceOfUser[_owner]) * self.tokenPrice / ETHER_TO_WEI
+
+
+@public
+def claim():
+    """
+    @dev when ico is ended and successful in lazyMint mode, the user claims the tokens of their deposit.
+    """
+    _lifecycle: uint256 = self.lifecycle
+    assert bitwise_and(_lifecycle, LAZY_MINT_FLAG) != 0, 'the tokens are minted at deposit'
+    assert bitwise_and(_lifecycle, MASK_8) == STATE_SUCCEEDED, 'the ico has not ended or the ico is failed'
+    self._claim(msg.sender)
+
+
+@public
+def claimMany(_owners: address[MAX_CLAIMS]):
+    """
+    @dev claim the tokens of many users at once, anyone can call it.
+    @param _owners the users to claim for, ZERO_ADDRESS entries are skipped.
+    """
+    _lifecycle: uint256 = self.lifecycle
+    assert bitwise_and(_lifecycle, LAZY_MINT_FLAG) != 0, 'the tokens are minted at deposit'
+    assert bitwise_and(_lifecycle, MASK_8) == STATE_SUCCEEDED, 'the ico has not ended or the ico is failed'
+    for _owner in _owners:
+        if _owner != ZERO_ADDRESS:
+            self._claim(_owner)
+
+
+@public
+def refundMany(_owners: address[MAX_REFUNDS]):
+    """
+    @dev when ico is ended and failed, send the deposits back to many users at once, anyone can call it.
+         Contracts are skipped since they may reject the ether, they use safeWithdrawal.
+    @param _owners the users to refund, ZERO_ADDRESS entries and users without deposit are skipped.
+    """
+    assert bitwise_and(self.lifecycle, MASK_8) >= STATE_FAILED, 'the ico has not ended or the ico is successful'
+    for _owner in _owners:
+        if _owner == ZERO_ADDRESS:
+            continue
+        amount: wei_value = self.depositBalanceOfUser[_owner]
+        if amount == 0:
+            continue
+        if _owner.is_contract:
+            log.RefundSkipped(_owner, amount)
+            continue
+        self.depositBalanceOfUser[_owner] = 0
+        send(_owner, amount)
+        log.RefundTransfer(_owner, amount)
+
+
+@public
+@constant
+def getDepositors(_start: uint256) -> (address[MAX_REFUNDS], wei_value[MAX_REFUNDS]):
+    """
+    @dev list the depositors from the _start-th one (from 0) with the deposit they still hold,
+         refunded or claimed ones have 0, missing ones are ZERO_ADDRESS.
+    """
+    owners: address[MAX_REFUNDS] = [
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS,
+        ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS, ZERO_ADDRESS]
+    amounts: wei_value[MAX_REFUNDS] = [
+        0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+        0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    count: uint256 = shift(self.deposits, -192)
+    for i in range(MAX_REFUNDS):
+        index: uint256 = _start + convert(i, uint256)
+        if index >= count:
+            break
+        owner: address = self.depositors[index]
+        owners[i] = owner
+        amounts[i] = self.depositBalanceOfUser[owner]
+    return owners, amounts
+
+
 @private
 def _burn(_to: address, _value: uint256):
     """
@@ -279,3 +488,121 @@ def burnFrom(_to: address, _value: uint256):
     """
     self.allowances[_to][msg.sender] -= _value
     self._burn(_to, _value)
+
+
+@public
+def transferAndCall(_to: address, _value: uint256, _data: bytes[128]) -> bool:
+    """
+    @dev Transfer token to a specified address and call onTokenTransfer on it when it is a contract,
+         see ERC-677. The exchanges sell the tokens received this way without allowance.
+    @param _to The address to transfer to.
+    @param _value The amount to be transferred.
+    @param _data The data passed to onTokenTransfer.
+    """
+    self.balanceOf[msg.sender] -= _value
+    self.balanceOf[_to] += _value
+    log.Transfer(msg.sender, _to, _value)
+    if _to.is_contract:
+        TokenReceiver(_to).onTokenTransfer(msg.sender, _value, _data)
+    return True
+
+
+@public
+@constant
+def state() -> uint256:
+    """
+    @dev The lifecycle state of the ICO, one of the STATE_* values.
+    """
+    return bitwise_and(self.lifecycle, MASK_8)
+
+
+@public
+@constant
+def lazyMint() -> bool:
+    """
+    @dev Only record the deposits, the tokens are claimed after the ICO succeeded.
+    """
+    return bitwise_and(self.lifecycle, LAZY_MINT_FLAG) != 0
+
+
+@public
+@constant
+def depositStart() -> uint256:
+    """
+    @dev The time the ICO started.
+    """
+    return bitwise_and(shift(self.lifecycle, -16), MASK_64)
+
+
+@public
+@constant
+def depositEnd() -> uint256:
+    """
+    @dev The time after which no more deposits are accepted.
+    """
+    return bitwise_and(shift(self.lifecycle, -80), MASK_64)
+
+
+@public
+@constant
+def finalSubmissionTime() -> uint256:
+    """
+    @dev The time before which the creater can submit the ICO.
+    """
+    return shift(self.lifecycle, -144)
+
+
+@public
+@constant
+def isEnd() -> bool:
+    """
+    @dev Whether the ICO was submitted, cancelled or failed.
+    """
+    return bitwise_and(self.lifecycle, MASK_8) >= STATE_SUCCEEDED
+
+
+@public
+@constant
+def goalReached() -> bool:
+    """
+    @dev Whether the deposits reached depositGoal.
+    """
+    _state: uint256 = bitwise_and(self.lifecycle, MASK_8)
+    return _state != STATE_OPEN and _state != STATE_FAILED
+
+
+@public
+@constant
+def isFailed() -> bool:
+    """
+    @dev Whether the ICO failed or was cancelled, the users can withdraw their deposits.
+    """
+    return bitwise_and(self.lifecycle, MASK_8) >= STATE_FAILED
+
+
+@public
+@constant
+def depositGoal() -> uint256:
+    """
+    @dev The amount of ethers (WEI) the ICO raises.
+    """
+    return bitwise_and(self.deposits, MASK_96)
+
+
+@public
+@constant
+def depositAmount() -> uint256:
+    """
+    @dev The amount of ethers (WEI) deposited so far.
+    """
+    return bitwise_and(shift(self.deposits, -96), MASK_96)
+
+
+@public
+@constant
+def depositorCount() -> uint256:
+    """
+    @dev The number of users that deposited.
+    """
+    return shift(self.deposits, -192)
+
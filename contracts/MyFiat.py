@@ -4,16 +4,29 @@
 SetEthPrice: event({_from: uint256, _to: uint256})
 RequestUpdate: event({_id: uint256})
 Donation: event({_from: address})
+NewReporter: event({_reporter: indexed(address), _allowed: bool})
+
+# Vyper does not allow for dynamic arrays, we have limited the number of reports in one submission
+MAX_REPORTS: constant(int128) = 16
+# 报价时间可以比区块时间晚这么多秒, 容忍签名者和出块者的时钟误差
+MAX_CLOCK_DRIFT: constant(uint256) = 15
 
 # 定义状态变量
 price: public(uint256)
+updatedAt: public(timestamp)  # 价格对应的时间
 
 setter: public(address)
+reporters: public(map(address, bool))  # 可以签名报价的地址
+reporterCount: public(uint256)
+minReports: public(int128)  # 一次提交至少需要的报价数量
+maxReportAge: public(timedelta)  # 报价签名后的有效时长
 
 
 @public
 def __init__():
     self.setter = msg.sender
+    self.minReports = 1
+    self.maxReportAge = 3600
 
 
 @public
@@ -35,6 +48,98 @@ def setPrice(_price: uint256):
     assert msg.sender == self.setter
     log.SetEthPrice(self.price, _price)
     self.price = _price
+    self.updatedAt = block.timestamp
+
+
+@public
+def setReporter(_reporter: address, _allowed: bool):
+    """
+    @dev add or remove an address allowed to sign price reports
+    """
+    assert msg.sender == self.setter and _reporter != ZERO_ADDRESS
+    assert self.reporters[_reporter] != _allowed
+    self.reporters[_reporter] = _allowed
+    if _allowed:
+        self.reporterCount += 1
+    else:
+        self.reporterCount -= 1
+    log.NewReporter(_reporter, _allowed)
+
+
+@public
+def setReportRules(_minReports: int128, _maxReportAge: timedelta):
+    """
+    @dev set how many reports a submission needs and how long a report stays valid
+    """
+    assert msg.sender == self.setter
+    assert _minReports > 0 and _minReports <= MAX_REPORTS
+    assert _maxReportAge > 0
+    self.minReports = _minReports
+    self.maxReportAge = _maxReportAge
+
+
+@private
+@constant
+def reportSigner(_price: uint256, _time: timestamp, _v: uint256, _r: bytes32, _s: bytes32) -> address:
+    """
+    @dev the address that signed the report, signed as an eth_sign message of
+         keccak256(this contract, chain id, price, time)
+    """
+    report_hash: bytes32 = keccak256(concat(
+        convert(self, bytes32),
+        convert(chain.id, bytes32),
+        convert(_price, bytes32),
+        convert(_time, bytes32)))
+    digest: bytes32 = keccak256(concat(b'\x19Ethereum Signed Message:\n32', report_hash))
+    return ecrecover(digest, _v, convert(_r, uint256), convert(_s, uint256))
+
+
+@public
+def submitReports(_count: int128, _prices: uint256[MAX_REPORTS], _times: timestamp[MAX_REPORTS],
+                  _v: uint256[MAX_REPORTS], _r: bytes32[MAX_REPORTS], _s: bytes32[MAX_REPORTS]):
+    """
+    @dev set the price to the median of reports signed by the reporters, anyone can submit them
+         the reports must be sorted by signer address, so that each reporter counts once
+         the time of the price is the one of the oldest report, it must be newer than the current one
+    @param _count the number of reports, the rest of the arrays is ignored
+    @param _prices $0.01 worth of ETH in wei of each report
+    @param _times the time of each report
+    @param _v, _r, _s the signature of each report
+    """
+    assert _count >= self.minReports and _count <= MAX_REPORTS
+    sorted_prices: uint256[MAX_REPORTS] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    oldest: timestamp = block.timestamp + MAX_CLOCK_DRIFT
+    last_signer: address = ZERO_ADDRESS
+    for i in range(MAX_REPORTS):
+        if i >= _count:
+            break
+        report_price: uint256 = _prices[i]
+        assert report_price > 0
+        assert _times[i] <= block.timestamp + MAX_CLOCK_DRIFT and _times[i] + self.maxReportAge >= block.timestamp, 'report out of time'
+        signer: address = self.reportSigner(report_price, _times[i], _v[i], _r[i], _s[i])
+        assert self.reporters[signer], 'not a reporter'
+        assert convert(signer, uint256) > convert(last_signer, uint256), 'reports not sorted by signer'
+        last_signer = signer
+        if _times[i] < oldest:
+            oldest = _times[i]
+        # 插入排序
+        j: int128 = i
+        for k in range(MAX_REPORTS):
+            if j == 0:
+                break
+            if sorted_prices[j - 1] <= report_price:
+                break
+            sorted_prices[j] = sorted_prices[j - 1]
+            j -= 1
+        sorted_prices[j] = report_price
+    assert oldest > self.updatedAt, 'reports not newer than the price'
+    half: int128 = _count / 2
+    median: uint256 = sorted_prices[half]
+    if _count % 2 == 0:
+        median = (sorted_prices[half - 1] + median) / 2
+    log.SetEthPrice(self.price, median)
+    self.price = median
+    self.updatedAt = oldest
 
 
 @public
@@ -47,6 +152,15 @@ def USD(id: uint256) -> uint256:
     return self.price
 
 
+@public
+@constant
+def latestPrice() -> (uint256, timestamp):
+    """
+    @returns $0.01 worth of ETH in wei and the time of that price.
+    """
+    return self.price, self.updatedAt
+
+
 @public
 @payable
 def donate():
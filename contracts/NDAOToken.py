@@ -5,22 +5,48 @@ from vyper.interfaces import ERC20
 implements: ERC20
 
 
+# the receiver of transferAndCall, see ERC-677
+contract TokenReceiver:
+    def onTokenTransfer(_from: address, _value: uint256, _data: bytes[128]): modifying
+
+
 Transfer: event({_from: indexed(address), _to: indexed(address), _value: uint256})
 Approval: event({_owner: indexed(address), _spender: indexed(address), _value: uint256})
 
+# EIP-712 type hashes used by permit
+# keccak256("EIP712Domain(string name,string version,uint256 chainId,address verifyingContract)")
+EIP712_DOMAIN_TYPEHASH: constant(bytes32) = 0x8b73c3c69bb8fe3d512ecc4cf759cc79239f7b179b0ffacaa9a75d522b39400f
+# keccak256("Permit(address owner,address spender,uint256 value,uint256 nonce,uint256 deadline)")
+PERMIT_TYPEHASH: constant(bytes32) = 0x6e71edae12b1b97f4d1f60370fef10105fa2faae0126114a169c64845d6126c9
+# keccak256("1")
+VERSION_HASH: constant(bytes32) = 0xc89efdaa54c0f20c7adf612882df0950f5a951637e0307cdcb4c672f298b8bc6
+# Vyper does not allow for dynamic arrays, we have limited the number of recipients of a batch
+MAX_RECIPIENTS: constant(int128) = 32
+# the factory mints to the exchange and the ICO creater at once
+MAX_MINTS: constant(int128) = 2
+MASK_32: constant(uint256) = 2 ** 32 - 1
+MASK_96: constant(uint256) = 2 ** 96 - 1
+MASK_128: constant(uint256) = 2 ** 128 - 1
+
 name: public(string[64])
 symbol: public(string[32])
 decimals: public(uint256)
 
-# NOTE: By declaring `balanceOf` as public, vyper automatically generates a 'balanceOf()' getter
-#       method to allow access to account balances.
-#       The _KeyType will become a required parameter for the getter and it will return _ValueType.
-#       See: https://vyper.readthedocs.io/en/v0.1.0-beta.8/types.html?highlight=getter#mappings
+# NOTE: The balances and the total supply keep the block of their last change and the number of
+#       checkpoints in the same slot: value (96 bits) | block (32 bits) | checkpoint count (64 bits).
+#       When the value changes in a later block the previous value is pushed as a checkpoint,
+#       block (32 bits) | value (96 bits), two checkpoints per slot ordered by block, so that
+#       balanceOfAt and totalSupplyAt find the historical values by binary search.
 
-balanceOf: public(map(address, uint256))
+balances: map(address, uint256)
+balanceCheckpoints: map(address, map(uint256, uint256))
 allowances: map(address, map(address, uint256))
 total_supply: uint256
+supplyCheckpoints: map(uint256, uint256)
 minter:public(address)
+# EIP-2612
+DOMAIN_SEPARATOR: public(bytes32)
+nonces: public(map(address, uint256))
 
 
 @public
@@ -30,6 +56,12 @@ def __init__(_minter:address):
     self.name = 'NaturalDAOCoins'
     self.symbol = 'NDAO'
     self.decimals = 8
+    self.DOMAIN_SEPARATOR = keccak256(concat(
+        EIP712_DOMAIN_TYPEHASH,
+        keccak256('NaturalDAOCoins'),
+        VERSION_HASH,
+        convert(chain.id, bytes32),
+        convert(self, bytes32)))
 
 
 @public
@@ -38,7 +70,7 @@ def totalSupply() -> uint256:
     """
     @dev Total number of tokens in existence.
     """
-    return self.total_supply
+    return bitwise_and(self.total_supply, MASK_96)
 
 
 @public
@@ -53,6 +85,59 @@ def allowance(_owner : address, _spender : address) -> uint256:
     return self.allowances[_owner][_spender]
 
 
+@public
+@constant
+def balanceOf(_owner: address) -> uint256:
+    """
+    @dev Gets the balance of the specified address.
+    @param _owner The address to query the balance of.
+    """
+    return bitwise_and(self.balances[_owner], MASK_96)
+
+
+@private
+def _updateBalance(_account: address, _add: uint256, _sub: uint256):
+    """
+    @dev Add _add and subtract _sub from the balance of _account, the previous balance is
+         pushed as a checkpoint when it was set in an earlier block.
+    """
+    packed: uint256 = self.balances[_account]
+    # NOTE: vyper does not allow underflows
+    #       so the following subtraction would revert on insufficient balance
+    value: uint256 = bitwise_and(packed, MASK_96) + _add - _sub
+    assert value <= MASK_96 and block.number <= MASK_32
+    count: uint256 = shift(packed, -128)
+    last_block: uint256 = bitwise_and(shift(packed, -96), MASK_32)
+    if last_block != block.number and last_block != 0:
+        # 奇数个检查点存放在槽位的高128位
+        checkpoint: uint256 = shift(last_block, 96) + bitwise_and(packed, MASK_96)
+        if count % 2 == 1:
+            checkpoint = shift(checkpoint, 128)
+        self.balanceCheckpoints[_account][count / 2] += checkpoint
+        count += 1
+    self.balances[_account] = shift(count, 128) + shift(block.number, 96) + value
+
+
+@private
+def _updateSupply(_add: uint256, _sub: uint256):
+    """
+    @dev Add _add and subtract _sub from the total supply, the previous total supply is
+         pushed as a checkpoint when it was set in an earlier block.
+    """
+    packed: uint256 = self.total_supply
+    value: uint256 = bitwise_and(packed, MASK_96) + _add - _sub
+    assert value <= MASK_96 and block.number <= MASK_32
+    count: uint256 = shift(packed, -128)
+    last_block: uint256 = bitwise_and(shift(packed, -96), MASK_32)
+    if last_block != block.number and last_block != 0:
+        checkpoint: uint256 = shift(last_block, 96) + bitwise_and(packed, MASK_96)
+        if count % 2 == 1:
+            checkpoint = shift(checkpoint, 128)
+        self.supplyCheckpoints[count / 2] += checkpoint
+        count += 1
+    self.total_supply = shift(count, 128) + shift(block.number, 96) + value
+
+
 @public
 def transfer(_to : address, _value : uint256) -> bool:
     """
@@ -60,10 +145,8 @@ def transfer(_to : address, _value : uint256) -> bool:
     @param _to The address to transfer to.
     @param _value The amount to be transferred.
     """
-    # NOTE: vyper does not allow underflows
-    #       so the following subtraction would revert on insufficient balance
-    self.balanceOf[msg.sender] -= _value
-    self.balanceOf[_to] += _value
+    self._updateBalance(msg.sender, 0, _value)
+    self._updateBalance(_to, _value, 0)
     log.Transfer(msg.sender, _to, _value)
     return True
 
@@ -78,10 +161,8 @@ def transferFrom(_from : address, _to : address, _value : uint256) -> bool:
      @param _to address The address which you want to transfer to
      @param _value uint256 the amount of tokens to be transferred
     """
-    # NOTE: vyper does not allow underflows
-    #       so the following subtraction would revert on insufficient balance
-    self.balanceOf[_from] -= _value
-    self.balanceOf[_to] += _value
+    self._updateBalance(_from, 0, _value)
+    self._updateBalance(_to, _value, 0)
     # NOTE: vyper does not allow underflows
     #      so the following subtraction would revert on insufficient allowance
     self.allowances[_from][msg.sender] -= _value
@@ -105,6 +186,41 @@ def approve(_spender : address, _value : uint256) -> bool:
     return True
 
 
+@public
+def permit(_owner: address, _spender: address, _value: uint256, _deadline: timestamp,
+           _v: uint256, _r: bytes32, _s: bytes32) -> bool:
+    """
+    @dev Approve by signature, see https://eips.ethereum.org/EIPS/eip-2612
+         `_v` is an uint256 because vyper has no uint8, the selector is
+         the one of permit(address,address,uint256,uint256,uint256,bytes32,bytes32).
+    @param _owner The address which owns the funds and signed the permit.
+    @param _spender The address which will spend the funds.
+    @param _value The amount of tokens to be spent.
+    @param _deadline Time after which the signature can no longer be used.
+    @param _v The recovery id of the signature.
+    @param _r The r value of the signature.
+    @param _s The s value of the signature.
+    """
+    assert _owner != ZERO_ADDRESS
+    assert block.timestamp <= _deadline, 'permit expired'
+    nonce: uint256 = self.nonces[_owner]
+    digest: bytes32 = keccak256(concat(
+        b'\x19\x01',
+        self.DOMAIN_SEPARATOR,
+        keccak256(concat(
+            PERMIT_TYPEHASH,
+            convert(_owner, bytes32),
+            convert(_spender, bytes32),
+            convert(_value, bytes32),
+            convert(nonce, bytes32),
+            convert(_deadline, bytes32)))))
+    assert ecrecover(digest, _v, convert(_r, uint256), convert(_s, uint256)) == _owner, 'invalid signature'
+    self.nonces[_owner] = nonce + 1
+    self.allowances[_owner][_spender] = _value
+    log.Approval(_owner, _spender, _value)
+    return True
+
+
 @public
 def mint(_to: address, _value: uint256):
     """
@@ -116,8 +232,8 @@ def mint(_to: address, _value: uint256):
     """
     assert msg.sender == self.minter
     assert _to != ZERO_ADDRESS
-    self.total_supply += _value
-    self.balanceOf[_to] += _value
+    self._updateSupply(_value, 0)
+    self._updateBalance(_to, _value, 0)
     log.Transfer(ZERO_ADDRESS, _to, _value)
 
 
@@ -130,8 +246,8 @@ def _burn(_to: address, _value: uint256):
     @param _value The amount that will be burned.
     """
     assert _to != ZERO_ADDRESS
-    self.total_supply -= _value
-    self.balanceOf[_to] -= _value
+    self._updateSupply(0, _value)
+    self._updateBalance(_to, 0, _value)
     log.Transfer(_to, ZERO_ADDRESS, _value)
 
 
@@ -153,3 +269,123 @@ def burnFrom(_to: address, _value: uint256):
     """
     self.allowances[_to][msg.sender] -= _value
     self._burn(_to, _value)
+
+
+@public
+def mintMany(_to: address[MAX_MINTS], _value: uint256[MAX_MINTS]):
+    """
+    @dev Mint tokens to many accounts at once, total_supply is updated once.
+    @param _to The accounts that will receive the created tokens, the list ends at the first ZERO_ADDRESS.
+    @param _value The amount that will be created for each account.
+    """
+    assert msg.sender == self.minter
+    total: uint256 = 0
+    for i in range(MAX_MINTS):
+        if _to[i] == ZERO_ADDRESS:
+            break
+        total += _value[i]
+        self._updateBalance(_to[i], _value[i], 0)
+        log.Transfer(ZERO_ADDRESS, _to[i], _value[i])
+    self._updateSupply(total, 0)
+
+
+@public
+def transferMany(_to: address[MAX_RECIPIENTS], _value: uint256[MAX_RECIPIENTS]) -> bool:
+    """
+    @dev Transfer tokens to many addresses at once, the balance of msg.sender is debited once.
+    @param _to The addresses to transfer to, the list ends at the first ZERO_ADDRESS.
+    @param _value The amount to be transferred to each address.
+    """
+    total: uint256 = 0
+    for i in range(MAX_RECIPIENTS):
+        if _to[i] == ZERO_ADDRESS:
+            break
+        total += _value[i]
+        self._updateBalance(_to[i], _value[i], 0)
+        log.Transfer(msg.sender, _to[i], _value[i])
+    self._updateBalance(msg.sender, 0, total)
+    return True
+
+
+@private
+@constant
+def _valueAt(_account: address, _supply: bool, _block: uint256) -> uint256:
+    """
+    @dev The balance of _account, or the total supply when _supply is set, at the end of _block.
+    """
+    # 只读取查询的那一组槽位
+    packed: uint256 = 0
+    if _supply:
+        packed = self.total_supply
+    else:
+        packed = self.balances[_account]
+    # 大多数查询的是最近一次变化之后的区块
+    if bitwise_and(shift(packed, -96), MASK_32) <= _block:
+        return bitwise_and(packed, MASK_96)
+    # 二分查找第一个晚于_block的检查点, 检查点数量小于2**64
+    low: uint256 = 0
+    high: uint256 = shift(packed, -128)
+    checkpoint: uint256 = 0
+    for i in range(64):
+        if low >= high:
+            break
+        middle: uint256 = (low + high) / 2
+        if _supply:
+            checkpoint = self.supplyCheckpoints[middle / 2]
+        else:
+            checkpoint = self.balanceCheckpoints[_account][middle / 2]
+        if middle % 2 == 1:
+            checkpoint = shift(checkpoint, -128)
+        if shift(bitwise_and(checkpoint, MASK_128), -96) > _block:
+            high = middle
+        else:
+            low = middle + 1
+    if low == 0:
+        return 0
+    if _supply:
+        checkpoint = self.supplyCheckpoints[(low - 1) / 2]
+    else:
+        checkpoint = self.balanceCheckpoints[_account][(low - 1) / 2]
+    if (low - 1) % 2 == 1:
+        checkpoint = shift(checkpoint, -128)
+    return bitwise_and(checkpoint, MASK_96)
+
+
+@public
+@constant
+def balanceOfAt(_owner: address, _block: uint256) -> uint256:
+    """
+    @dev The balance of _owner at the end of block _block.
+    @param _owner The address to query the balance of.
+    @param _block A block number before the current one.
+    """
+    assert _block < block.number, 'block not yet mined'
+    return self._valueAt(_owner, False, _block)
+
+
+@public
+@constant
+def totalSupplyAt(_block: uint256) -> uint256:
+    """
+    @dev The total supply at the end of block _block.
+    @param _block A block number before the current one.
+    """
+    assert _block < block.number, 'block not yet mined'
+    return self._valueAt(ZERO_ADDRESS, True, _block)
+
+
+@public
+def transferAndCall(_to: address, _value: uint256, _data: bytes[128]) -> bool:
+    """
+    @dev Transfer token to a specified address and call onTokenTransfer on it when it is a contract,
+         see ERC-677. The exchanges sell the tokens received this way without allowance.
+    @param _to The address to transfer to.
+    @param _value The amount to be transferred.
+    @param _data The data passed to onTokenTransfer.
+    """
+    self._updateBalance(msg.sender, 0, _value)
+    self._updateBalance(_to, _value, 0)
+    log.Transfer(msg.sender, _to, _value)
+    if _to.is_contract:
+        TokenReceiver(_to).onTokenTransfer(msg.sender, _value, _data)
+    return True
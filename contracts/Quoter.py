@@ -0,0 +1,50 @@
+# @dev Implementation of batch price queries across the exchanges of a factory
+
+
+# the interface of Factory
+contract Factory:
+    def tokenCount() -> uint256: constant
+    def getTokenWithId(token_id: uint256) -> address: constant
+    def getExchange(token_addr: address) -> address: constant
+
+
+# the interface of Exchange
+contract Exchange:
+    def getPrice(amount: uint256, direction: uint256) -> uint256: constant
+
+
+# Vyper does not allow for dynamic arrays, we have limited the number of exchanges per query
+MAX_EXCHANGES: constant(int128) = 16
+
+# interface for the factory that created the exchanges
+factory: public(Factory)
+
+
+@public
+def __init__(_factory: address):
+    assert _factory != ZERO_ADDRESS
+    self.factory = Factory(_factory)
+
+
+@public
+@constant
+def getPricesWithId(start_id: uint256, amount: uint256, direction: uint256) -> uint256[MAX_EXCHANGES]:
+    """
+    # @notice Price the same amount on the exchanges of the tokens start_id to start_id + MAX_EXCHANGES - 1.
+    # @param start_id The first token id, ids start at 1.
+    # @param amount Amount of NDAO or Tokens sold (input) or bought (output).
+    # @param direction 0: NDAO to Token input, 1: NDAO to Token output,
+    #                  2: Token to NDAO input, 3: Token to NDAO output.
+    # @return Amounts of NDAO or Tokens bought (input) or sold (output),
+    #         0 if it can not be traded or the id does not exist.
+    """
+    assert start_id > 0
+    count: uint256 = self.factory.tokenCount()
+    prices: uint256[MAX_EXCHANGES] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    for i in range(MAX_EXCHANGES):
+        token_id: uint256 = start_id + convert(i, uint256)
+        if token_id > count:
+            break
+        exchange_addr: address = self.factory.getExchange(self.factory.getTokenWithId(token_id))
+        prices[i] = Exchange(exchange_addr).getPrice(amount, direction)
+    return prices
@@ -0,0 +1,116 @@
+# @dev Implementation of multi-hop trades across NDAO exchanges
+from vyper.interfaces import ERC20
+
+
+# the interface of Exchange
+contract Exchange:
+    def tokenAddress() -> address: constant
+    def tokenReserve() -> uint256: constant
+    def ndaoReserve() -> uint256: constant
+    def getNdaoToTokenInputPrice(ndao_sold: uint256) -> uint256: constant
+    def getTokenToNdaoInputPrice(tokens_sold: uint256) -> uint256: constant
+    def ndaoToTokenPrepaidInput(min_tokens: uint256, recipient: address) -> uint256: modifying
+    def tokenToNdaoPrepaidInput(min_ndao: uint256, recipient: address) -> uint256: modifying
+
+
+# Vyper does not allow for dynamic arrays, we have limited the length of a path
+MAX_HOPS: constant(int128) = 6
+
+# address of the NDAO Coin
+ndao: public(address)
+
+
+@public
+def __init__(_ndao: address):
+    assert _ndao != ZERO_ADDRESS
+    self.ndao = _ndao
+
+
+@public
+@constant
+def getPathInputPrice(amount_in: uint256, ndao_in: bool, path: address[MAX_HOPS]) -> uint256:
+    """
+    # @notice Price function for trades along a path with an exact input.
+    # @param amount_in Amount of NDAO or Tokens (path[0].token) sold.
+    # @param ndao_in True if NDAO is sold, False if Tokens (path[0].token) are sold.
+    # @param path The exchanges to trade through, padded with ZERO_ADDRESS.
+    # @return Amount of NDAO or Tokens bought at the end of the path.
+    """
+    assert path[0] != ZERO_ADDRESS
+    is_ndao: bool = ndao_in
+    amount: uint256 = amount_in
+    # NDAO the previous hop paid into path[i] for the Tokens it sells back
+    ndao_paid: uint256 = 0
+    for i in range(MAX_HOPS):
+        if path[i] == ZERO_ADDRESS:
+            break
+        if is_ndao:
+            if i + 1 < MAX_HOPS:
+                if path[i + 1] != ZERO_ADDRESS:
+                    assert path[i + 1] == path[i], 'the next exchange does not trade the token'
+            ndao_paid = amount
+            amount = Exchange(path[i]).getNdaoToTokenInputPrice(amount)
+        elif ndao_paid > 0:
+            # getInputPrice(amount, token_reserve - amount, ndao_reserve + ndao_paid) on the
+            # reserves the previous hop left, the Tokens bought are sold straight back
+            assert amount > 0
+            amount = amount * (Exchange(path[i]).ndaoReserve() + ndao_paid) / Exchange(path[i]).tokenReserve()
+            ndao_paid = 0
+        else:
+            amount = Exchange(path[i]).getTokenToNdaoInputPrice(amount)
+        is_ndao = not is_ndao
+    return amount
+
+
+@public
+def swapPathInput(amount_in: uint256, min_amount_out: uint256, ndao_in: bool, path: address[MAX_HOPS], deadline: timestamp, recipient: address) -> uint256:
+    """
+    # @notice Trade along a path of exchanges and transfers the output to recipient.
+    # @notice need Approve of the input to this contract
+    # @dev User specifies exact input and minimum output.
+    # @dev NDAO and Tokens alternate along the path: an exchange paid in NDAO sells its Tokens,
+    #      an exchange paid in its Tokens sells NDAO. The input is transferred once into path[0]
+    #      and each hop pays straight into the next exchange, so only the output is checked.
+    #      Tokens bought go on to the same exchange, e.g. Tokens of A to Tokens of C through
+    #      Tokens of B is [A, B, B, C]; an exchange can not pay itself, the router forwards them.
+    # @param amount_in Amount of NDAO or Tokens (path[0].token) sold.
+    # @param min_amount_out Minimum NDAO or Tokens bought at the end of the path.
+    # @param ndao_in True if NDAO is sold, False if Tokens (path[0].token) are sold.
+    # @param path The exchanges to trade through, padded with ZERO_ADDRESS.
+    # @param deadline Time after which this transaction can no longer be executed.
+    # @param recipient The address that receives the output.
+    # @return Amount of NDAO or Tokens bought at the end of the path.
+    """
+    assert deadline >= block.timestamp and (amount_in > 0 and min_amount_out > 0)
+    assert recipient != self and recipient != ZERO_ADDRESS
+    assert path[0] != ZERO_ADDRESS
+    token_in: address = self.ndao
+    if not ndao_in:
+        token_in = Exchange(path[0]).tokenAddress()
+    flag: bool = ERC20(token_in).transferFrom(msg.sender, path[0], amount_in)
+    assert flag, 'transfer input failed'
+    is_ndao: bool = ndao_in
+    amount: uint256 = amount_in
+    for i in range(MAX_HOPS):
+        if path[i] == ZERO_ADDRESS:
+            break
+        # the last hop pays the recipient, the others the next exchange
+        receiver: address = recipient
+        if i + 1 < MAX_HOPS:
+            if path[i + 1] != ZERO_ADDRESS:
+                receiver = path[i + 1]
+        if is_ndao:
+            if receiver == path[i]:
+                receiver = self
+            else:
+                assert receiver == recipient, 'the next exchange does not trade the token'
+            amount = Exchange(path[i]).ndaoToTokenPrepaidInput(0, receiver)
+            if receiver == self:
+                flag = ERC20(Exchange(path[i]).tokenAddress()).transfer(path[i], amount)
+                assert flag, 'transfer token failed'
+        else:
+            amount = Exchange(path[i]).tokenToNdaoPrepaidInput(0, receiver)
+        is_ndao = not is_ndao
+    # Throws if amount < min_amount_out
+    assert amount >= min_amount_out, 'little than min_amount_out'
+    return amount
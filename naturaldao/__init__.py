@@ -0,0 +1,8 @@
+"""Off-chain tooling for the NaturalDAO contracts.
+
+The contracts themselves live in ``contracts/`` and are compiled with
+vyper 0.1.x; the modules here simulate, deploy and measure them.
+"""
+from pathlib import Path
+
+CONTRACTS_DIR = Path(__file__).resolve().parent.parent / 'contracts'
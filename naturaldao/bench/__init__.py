@@ -0,0 +1,274 @@
+"""Gas benchmarks of the public entry points of every contract.
+
+Each scenario deploys nothing of its own: :func:`run` builds one local
+chain with :mod:`naturaldao.chain` and walks through the life of the
+system (ICOs, deposits, exchanges, trades) recording ``gasUsed`` of each
+transaction under a ``Contract.function/scenario`` label.  Constant
+functions are recorded with ``eth_estimateGas``.
+
+``python -m naturaldao.bench`` compares a run with ``baseline.json`` next
+to this file; ``--update`` rewrites it.
+"""
+import json
+from pathlib import Path
+
+from naturaldao.chain import ZERO_ADDRESS, LocalChain, create_ico, deploy_system, launch_market, swap_data
+
+BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+MAX_UINT256 = 2 ** 256 - 1
+# fixed so that the calldata, permit signatures included, is the same on every run
+DEADLINE = 2 ** 32 - 1
+# MyFiat.MAX_CLOCK_DRIFT, how far in the future a price report may be dated
+MAX_CLOCK_DRIFT = 15
+
+
+class Recorder:
+    """Send transactions and keep the gas they used by label."""
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.gas = {}
+
+    def tx(self, label, call, sender=None, value=0):
+        receipt = self.chain.transact(call, sender=sender, value=value)
+        if receipt.status != 1:
+            raise RuntimeError('%s reverted' % label)
+        self.gas[label] = receipt.gasUsed
+        return receipt
+
+    def send(self, label, to, sender, value):
+        """Send plain ether, i.e. call the ``__default__`` function of ``to``."""
+        w3 = self.chain.w3
+        receipt = w3.eth.wait_for_transaction_receipt(
+            w3.eth.send_transaction({'from': sender, 'to': to, 'value': value, 'gas': 3000000}))
+        if receipt.status != 1:
+            raise RuntimeError('%s reverted' % label)
+        self.gas[label] = receipt.gasUsed
+        return receipt
+
+    def view(self, label, call):
+        self.gas[label] = call.estimate_gas()
+
+
+def price_reports(chain, fiat, reporters, prices):
+    """Arguments of ``MyFiat.submitReports`` for one report of each reporter.
+
+    The reports are dated to the first second newer than the price of
+    ``fiat`` whose signatures have no zero byte, so that the calldata
+    costs the same on every run; the chain moves on when no second up to
+    the allowed clock drift has one.
+    """
+    updated = fiat.functions.updatedAt().call()
+    signatures = None
+    while signatures is None:
+        now = chain.timestamp
+        for time in range(max(now, updated + 1), now + MAX_CLOCK_DRIFT + 1):
+            signed = [chain.sign_price_report(fiat, r, p, time) for r, p in zip(reporters, prices)]
+            if all(0 not in r + s for _, r, s in signed):
+                signatures = signed
+                break
+        else:
+            chain.time_travel(MAX_CLOCK_DRIFT)
+    pad = 16 - len(prices)
+    return (len(prices), prices + [0] * pad, [time] * len(prices) + [0] * pad,
+            [v for v, _, _ in signatures] + [0] * pad,
+            [r for _, r, _ in signatures] + [bytes(32)] * pad,
+            [s for _, _, s in signatures] + [bytes(32)] * pad)
+
+
+def run(recorder=Recorder):
+    """Run every scenario and return ``{label: gas}``.
+
+    ``recorder`` is called with the chain and must return a :class:`Recorder`.
+    """
+    chain = LocalChain()
+    rec = recorder(chain)
+    accounts = chain.accounts
+    owner, creator, other, alice, bob = accounts[:5]
+    # only ever receives NDAO in the transferFrom scenarios
+    carol = accounts[9]
+    system = deploy_system(chain)
+    factory, ndao = system.factory, system.ndao
+
+    # price feed
+    rec.tx('MyFiat.setPrice', system.fiat.functions.setPrice(5 * 10 ** 12))
+    reporters = sorted(accounts[5:8], key=lambda a: int(a, 16))
+    for reporter in reporters:
+        rec.tx('MyFiat.setReporter', system.fiat.functions.setReporter(reporter, True))
+    rec.tx('MyFiat.setReportRules', system.fiat.functions.setReportRules(3, 600))
+    rec.tx('MyFiat.submitReports/three-reports', system.fiat.functions.submitReports(
+        *price_reports(chain, system.fiat, reporters, [4 * 10 ** 12, 5 * 10 ** 12, 6 * 10 ** 12])), other)
+    rec.view('EthPrice.getEthPrice', system.eth_price.functions.getEthPrice())
+    rec.tx('Factory.setSubmitssionDelta', factory.functions.setSubmitssionDelta(3 * 24 * 3600))
+
+    # ICO lifecycle
+    rec.tx('Factory.createICO/first-of-creator', factory.functions.createICO('Alpha', 'A', 18, 10 ** 18, 3600, 1000 * 10 ** 18), creator)
+    ico = chain.at('Ico', factory.functions.getLatestIco().call({'from': creator}))
+    rec.tx('Factory.createICO/second-of-creator', factory.functions.createICO('Beta', 'B', 18, 10 ** 18, 3600, 1000 * 10 ** 18), creator)
+    failing = chain.at('Ico', factory.functions.getLatestIco().call({'from': creator}))
+    cancelled = create_ico(chain, system, other, 'Gamma', 10 ** 18)
+    rec.tx('Ico.deposit/first-deposit', ico.functions.deposit(), alice, 10 ** 17)
+    rec.tx('Ico.deposit/repeat-deposit', ico.functions.deposit(), alice, 10 ** 17)
+    rec.send('Ico.__default__/first-deposit', ico.address, bob, 10 ** 17)
+    rec.tx('Ico.deposit/goal-reaching-with-refund', ico.functions.deposit(), creator, 10 ** 18)
+    rec.tx('Ico.deposit/failing-ico', failing.functions.deposit(), alice, 10 ** 17)
+    for holder in (bob, other):
+        chain.transact(failing.functions.deposit(), sender=holder, value=10 ** 17)
+    rec.tx('Ico.deposit/cancelled-ico', cancelled.functions.deposit(), bob, 10 ** 17)
+    rec.tx('Ico.transfer', ico.functions.transfer(bob, 10 ** 18), alice)
+    rec.tx('Ico.approve', ico.functions.approve(bob, 10 ** 18), alice)
+    rec.tx('Ico.transferFrom', ico.functions.transferFrom(alice, other, 10 ** 18), bob)
+    rec.tx('Factory.createLazyICO', factory.functions.createLazyICO('Lazy', 'L', 18, 10 ** 18, 3600, 1000 * 10 ** 18), other)
+    lazy = chain.at('Ico', factory.functions.getLatestIco().call({'from': other}))
+    rec.tx('Ico.deposit/lazy-first-deposit', lazy.functions.deposit(), alice, 10 ** 17)
+    rec.tx('Ico.deposit/lazy-repeat-deposit', lazy.functions.deposit(), alice, 10 ** 17)
+    chain.transact(lazy.functions.deposit(), sender=bob, value=10 ** 17)
+    rec.tx('Ico.deposit/lazy-goal-reaching-with-refund', lazy.functions.deposit(), other, 10 ** 18)
+    chain.time_travel(3601)
+    rec.tx('Ico.submitICO/success-creates-exchange', ico.functions.submitICO(), creator)
+    rec.tx('Ico.submitICO/goal-missed', failing.functions.submitICO(), creator)
+    rec.tx('Ico.cancelICO/by-creator', cancelled.functions.cancelICO(), other)
+    rec.tx('Ico.safeWithdrawal', failing.functions.safeWithdrawal(), alice)
+    rec.view('Ico.getDepositors', failing.functions.getDepositors(0))
+    rec.tx('Ico.refundMany/two-holders', failing.functions.refundMany([bob, other] + [ZERO_ADDRESS] * 30), creator)
+    rec.tx('Ico.submitICO/lazy-success-creates-exchange', lazy.functions.submitICO(), other)
+    rec.tx('Ico.claim', lazy.functions.claim(), alice)
+    rec.tx('Ico.claimMany/two-holders', lazy.functions.claimMany([bob, other] + [ZERO_ADDRESS] * 30), alice)
+    exchange = chain.at('Exchange', factory.functions.getExchange(ico.address).call())
+
+    # NDAO token
+    chain.transact(factory.functions.buyNdao(), alice, 10 ** 18)
+    rec.tx('Factory.buyNdao/cached-price', factory.functions.buyNdao(), alice, 10 ** 18)
+    # every mint pushes a checkpoint of the supply and of the balance, which opens a new slot
+    # every other time; one more mint puts the next scenario on the same side of that
+    chain.transact(factory.functions.buyNdao(), alice, 10 ** 18)
+    rec.tx('Factory.setEthPriceWindow', factory.functions.setEthPriceWindow(0))
+    rec.tx('Factory.buyNdao/refreshed-price', factory.functions.buyNdao(), alice, 10 ** 18)
+    # and one to leave the checkpoints of alice and of the supply as the scenarios below expect
+    chain.transact(factory.functions.buyNdao(), alice, 10 ** 18)
+    chain.transact(factory.functions.setEthPriceWindow(600))
+    rec.tx('Factory.refreshEthPrice', factory.functions.refreshEthPrice(), bob)
+    rec.view('Factory.getCachedEthPrice', factory.functions.getCachedEthPrice())
+    rec.tx('NDAOToken.transfer/new-recipient', ndao.functions.transfer(bob, 10 ** 10), alice)
+    rec.tx('NDAOToken.transfer/existing-recipient', ndao.functions.transfer(bob, 10 ** 10), alice)
+    rec.tx('NDAOToken.approve/new-allowance', ndao.functions.approve(bob, 10 ** 12), alice)
+    rec.tx('NDAOToken.approve/existing-allowance', ndao.functions.approve(bob, 10 ** 11), alice)
+    rec.tx('NDAOToken.transferFrom/new-recipient', ndao.functions.transferFrom(alice, carol, 10 ** 9), bob)
+    rec.tx('NDAOToken.transferFrom/existing-recipient', ndao.functions.transferFrom(alice, carol, 10 ** 9), bob)
+    rec.tx('NDAOToken.burn', ndao.functions.burn(10 ** 8), carol)
+    rec.tx('NDAOToken.transferMany/four-existing-recipients', ndao.functions.transferMany(
+        [bob, carol, other, creator] + [ZERO_ADDRESS] * 28, [10 ** 8] * 4 + [0] * 28), alice)
+
+    # trades on one exchange
+    deadline = DEADLINE
+    for holder in (alice, bob):
+        chain.transact(ndao.functions.approve(exchange.address, MAX_UINT256), sender=holder)
+        chain.transact(ico.functions.approve(exchange.address, MAX_UINT256), sender=holder)
+    chain.transact(ico.functions.transfer(alice, 10 ** 20), sender=creator)
+    rec.tx('Exchange.ndaoToTokenSwapInput/first-buy-of-trader', exchange.functions.ndaoToTokenSwapInput(10 ** 9, 1, deadline), alice)
+    rec.tx('Exchange.ndaoToTokenSwapInput/repeat', exchange.functions.ndaoToTokenSwapInput(10 ** 9, 1, deadline), alice)
+    rec.tx('Exchange.ndaoToTokenTransferInput', exchange.functions.ndaoToTokenTransferInput(10 ** 9, 1, deadline, bob), alice)
+    rec.tx('Exchange.ndaoToTokenSwapOutput', exchange.functions.ndaoToTokenSwapOutput(10 ** 18, MAX_UINT256, deadline), alice)
+    rec.tx('Exchange.ndaoToTokenTransferOutput', exchange.functions.ndaoToTokenTransferOutput(10 ** 18, MAX_UINT256, deadline, bob), alice)
+    rec.tx('Exchange.tokenToNdaoSwapInput', exchange.functions.tokenToNdaoSwapInput(10 ** 18, 1, deadline), alice)
+    rec.tx('Exchange.tokenToNdaoTransferInput', exchange.functions.tokenToNdaoTransferInput(10 ** 18, 1, deadline, bob), alice)
+    rec.tx('Exchange.tokenToNdaoSwapOutput', exchange.functions.tokenToNdaoSwapOutput(10 ** 8, MAX_UINT256, deadline), alice)
+    rec.tx('Exchange.tokenToNdaoTransferOutput', exchange.functions.tokenToNdaoTransferOutput(10 ** 8, MAX_UINT256, deadline, bob), alice)
+    rec.view('Exchange.getNdaoToTokenInputPrice', exchange.functions.getNdaoToTokenInputPrice(10 ** 9))
+    rec.view('Exchange.getTokenToNdaoOutputPrice', exchange.functions.getTokenToNdaoOutputPrice(10 ** 8))
+    rec.view('Exchange.getPriceCurve', exchange.functions.getPriceCurve([10 ** 8 * i for i in range(32)], 0))
+    chain.transact(ndao.functions.transfer(exchange.address, 10 ** 8), sender=alice)
+    rec.tx('Exchange.skim', exchange.functions.skim(alice), bob)
+    chain.transact(ndao.functions.transfer(exchange.address, 10 ** 8), sender=alice)
+    rec.tx('Exchange.sync', exchange.functions.sync(), bob)
+
+    # trades approved by permit
+    rec.tx('NDAOToken.permit', ndao.functions.permit(
+        alice, bob, 10 ** 9, deadline, *chain.sign_permit(ndao, alice, bob, 10 ** 9, deadline)), bob)
+    rec.tx('Ico.permit', ico.functions.permit(
+        alice, bob, 10 ** 9, deadline, *chain.sign_permit(ico, alice, bob, 10 ** 9, deadline)), bob)
+    for holder in (alice, bob):
+        chain.transact(ndao.functions.approve(exchange.address, 0), sender=holder)
+        chain.transact(ico.functions.approve(exchange.address, 0), sender=holder)
+    rec.tx('Exchange.ndaoToTokenSwapInputWithPermit', exchange.functions.ndaoToTokenSwapInputWithPermit(
+        10 ** 9, 1, deadline, *chain.sign_permit(ndao, alice, exchange.address, 10 ** 9, deadline)), alice)
+    rec.tx('Exchange.ndaoToTokenSwapOutputWithPermit', exchange.functions.ndaoToTokenSwapOutputWithPermit(
+        10 ** 18, 10 ** 9, deadline, *chain.sign_permit(ndao, alice, exchange.address, 10 ** 9, deadline)), alice)
+    rec.tx('Exchange.tokenToNdaoSwapInputWithPermit', exchange.functions.tokenToNdaoSwapInputWithPermit(
+        10 ** 18, 1, deadline, *chain.sign_permit(ico, alice, exchange.address, 10 ** 18, deadline)), alice)
+    rec.tx('Exchange.tokenToNdaoSwapOutputWithPermit', exchange.functions.tokenToNdaoSwapOutputWithPermit(
+        10 ** 8, 10 ** 18, deadline, *chain.sign_permit(ico, alice, exchange.address, 10 ** 18, deadline)), alice)
+    for holder in (alice, bob):
+        chain.transact(ndao.functions.approve(exchange.address, MAX_UINT256), sender=holder)
+        chain.transact(ico.functions.approve(exchange.address, MAX_UINT256), sender=holder)
+
+    # a pool filled up to maxPool
+    chain.transact(ico.functions.transfer(alice, ico.functions.balanceOf(creator).call()), sender=creator)
+    room = exchange.functions.getMaxPool().call() - exchange.functions.tokenReserve().call()
+    amount = min(room, ico.functions.balanceOf(alice).call() - 10 ** 20)
+    rec.tx('Exchange.tokenToNdaoSwapInput/toward-max-pool', exchange.functions.tokenToNdaoSwapInput(amount, 1, deadline), alice)
+    chain.transact(exchange.functions.ndaoToTokenSwapOutput(amount // 2, MAX_UINT256, deadline), sender=alice)
+
+    # trades between exchanges
+    ico_b, exchange_b = launch_market(chain, system, other, 'Delta')
+    deadline = DEADLINE
+    rec.tx('Exchange.tokenToTokenSwapInput/first-of-pair', exchange.functions.tokenToTokenSwapInput(10 ** 18, 1, 1, deadline, ico_b.address), alice)
+    rec.tx('Exchange.tokenToTokenSwapInput/repeat', exchange.functions.tokenToTokenSwapInput(10 ** 18, 1, 1, deadline, ico_b.address), alice)
+    rec.tx('Exchange.tokenToTokenTransferInput', exchange.functions.tokenToTokenTransferInput(10 ** 18, 1, 1, deadline, bob, ico_b.address), alice)
+    rec.tx('Exchange.tokenToTokenSwapOutput', exchange.functions.tokenToTokenSwapOutput(10 ** 18, MAX_UINT256, MAX_UINT256, deadline, ico_b.address), alice)
+    rec.tx('Exchange.tokenToTokenTransferOutput', exchange.functions.tokenToTokenTransferOutput(10 ** 18, MAX_UINT256, MAX_UINT256, deadline, bob, ico_b.address), alice)
+    chain.transact(ico.functions.approve(exchange.address, 0), sender=alice)
+    rec.tx('Exchange.tokenToTokenSwapInputWithPermit', exchange.functions.tokenToTokenSwapInputWithPermit(
+        10 ** 18, 1, 1, deadline, ico_b.address, *chain.sign_permit(ico, alice, exchange.address, 10 ** 18, deadline)), alice)
+    chain.transact(ico.functions.approve(exchange.address, MAX_UINT256), sender=alice)
+    rec.tx('Exchange.tokenToExchangeSwapInput', exchange.functions.tokenToExchangeSwapInput(10 ** 18, 1, 1, deadline, exchange_b.address), alice)
+    rec.tx('Exchange.tokenToExchangeTransferOutput', exchange.functions.tokenToExchangeTransferOutput(10 ** 18, MAX_UINT256, MAX_UINT256, deadline, bob, exchange_b.address), alice)
+
+    # selling by transferAndCall, no allowance
+    rec.tx('Ico.transferAndCall/sell-to-exchange', ico.functions.transferAndCall(
+        exchange.address, 10 ** 18, swap_data(1, deadline)), alice)
+    rec.tx('NDAOToken.transferAndCall/buy-from-exchange', ndao.functions.transferAndCall(
+        exchange.address, 10 ** 9, swap_data(1, deadline)), alice)
+    rec.tx('Ico.transferAndCall/token-to-exchange', ico.functions.transferAndCall(
+        exchange.address, 10 ** 18, swap_data(1, deadline, bob, exchange_b.address)), alice)
+
+    # router and quoter
+    router = chain.deploy('Router', ndao.address)
+    quoter = chain.deploy('Quoter', factory.address)
+    chain.transact(ico.functions.approve(router.address, MAX_UINT256), sender=alice)
+    path = [exchange.address, exchange_b.address] + [ZERO_ADDRESS] * 4
+    rec.tx('Router.swapPathInput/two-hops', router.functions.swapPathInput(10 ** 18, 1, False, path, deadline, bob), alice)
+    rec.view('Exchange.getAveragePrices', exchange.functions.getAveragePrices(600))
+    rec.view('Quoter.getPricesWithId', quoter.functions.getPricesWithId(1, 10 ** 18, 2))
+    rec.view('Factory.getMarketsWithId', factory.functions.getMarketsWithId(1))
+    rec.view('Factory.getIcosOfUser', factory.functions.getIcosOfUser(creator, 0))
+    rec.view('Factory.getIcosWithStatus', factory.functions.getIcosWithStatus(2, 0))
+
+    # one purchase for many recipients
+    recipients = [bob, alice, other, creator] + [ZERO_ADDRESS] * 12
+    amounts = [10 ** 9] * 4 + [0] * 12
+    rec.tx('Exchange.ndaoToTokenTransferInputMany/four-recipients', exchange.functions.ndaoToTokenTransferInputMany(
+        amounts, [1] * 4 + [0] * 12, deadline, recipients, False), alice)
+    rec.tx('Exchange.ndaoToTokenTransferInputMany/four-recipients-sequential', exchange.functions.ndaoToTokenTransferInputMany(
+        amounts, [1] * 4 + [0] * 12, deadline, recipients, True), alice)
+
+    # a path through three exchanges, the tokens of the middle one are sold straight back
+    ico_c, exchange_c = launch_market(chain, system, carol, 'Sigma')
+    path = [exchange.address, exchange_b.address, exchange_b.address, exchange_c.address, ZERO_ADDRESS, ZERO_ADDRESS]
+    rec.tx('Router.swapPathInput/three-exchanges', router.functions.swapPathInput(10 ** 18, 1, False, path, deadline, bob), alice)
+    return rec.gas
+
+
+def compare(current, baseline):
+    """Yield ``(label, baseline, current)`` for every label of either run."""
+    for label in sorted(set(current) | set(baseline)):
+        yield label, baseline.get(label), current.get(label)
+
+
+def load_baseline(path=BASELINE):
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save_baseline(gas, path=BASELINE):
+    Path(path).write_text(json.dumps(gas, indent=2, sort_keys=True) + '\n')
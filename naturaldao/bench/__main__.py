@@ -0,0 +1,38 @@
+"""Usage: ``python -m naturaldao.bench [--update] [--baseline PATH] [--tolerance PCT]``"""
+import argparse
+import sys
+
+from naturaldao.bench import BASELINE, compare, load_baseline, run, save_baseline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Gas used by the public entry points of the contracts.')
+    parser.add_argument('--baseline', default=str(BASELINE))
+    parser.add_argument('--update', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='percentage of extra gas allowed before a result counts as a regression')
+    args = parser.parse_args(argv)
+
+    current = run()
+    baseline = load_baseline(args.baseline)
+    regressions = 0
+    print('%-58s %10s %10s %10s' % ('scenario', 'baseline', 'gas', 'delta'))
+    for label, before, after in compare(current, baseline):
+        if before is None or after is None:
+            print('%-58s %10s %10s %10s' % (label, before or '-', after or '-', 'new' if before is None else 'gone'))
+            continue
+        delta = after - before
+        pct = 100.0 * delta / before
+        print('%-58s %10d %10d %+10d %+.2f%%' % (label, before, after, delta, pct))
+        if pct > args.tolerance:
+            regressions += 1
+    if args.update:
+        save_baseline(current, args.baseline)
+        print('baseline written to %s' % args.baseline)
+        return 0
+    print('%d regressions' % regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
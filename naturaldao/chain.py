@@ -0,0 +1,163 @@
+"""Deploy the NaturalDAO contracts on an in-process EVM.
+
+Needs the ``vyper`` 0.1.x compiler (on ``PATH`` or named by ``$VYPER``)
+and ``web3`` with ``eth-tester[py-evm]``.  Nothing here talks to a real
+network: every :class:`LocalChain` is a fresh py-evm instance.
+"""
+import json
+import os
+import subprocess
+from collections import namedtuple
+from functools import lru_cache
+
+from naturaldao import CONTRACTS_DIR
+
+ZERO_ADDRESS = '0x' + '00' * 20
+# $0.01 worth of ETH in wei, i.e. ETH at $2000
+DEFAULT_ETH_PRICE = 5 * 10 ** 12
+
+PERMIT_TYPE = 'Permit(address owner,address spender,uint256 value,uint256 nonce,uint256 deadline)'
+
+System = namedtuple('System', 'factory ndao fiat eth_price exchange_template ico_template')
+
+
+@lru_cache(maxsize=None)
+def compile_contract(name, formats=('abi', 'bytecode')):
+    """Compile ``contracts/<name>.py`` and return ``{format: output}``.
+
+    ``abi`` and ``source_map`` outputs are decoded from JSON, the others
+    are returned as the compiler prints them.
+    """
+    vyper = os.environ.get('VYPER', 'vyper')
+    path = str(CONTRACTS_DIR / (name + '.py'))
+    output = subprocess.check_output([vyper, '-f', ','.join(formats), path])
+    result = {}
+    for fmt, line in zip(formats, output.decode().strip().split('\n')):
+        result[fmt] = json.loads(line) if fmt in ('abi', 'source_map') else line
+    return result
+
+
+class LocalChain:
+    """A py-evm chain with funded accounts and helpers to deploy contracts."""
+
+    def __init__(self, vm_configuration=None):
+        """``vm_configuration`` is passed to ``PyEVMBackend``, the default is the latest fork."""
+        from eth_tester import EthereumTester, PyEVMBackend
+        from web3 import Web3, EthereumTesterProvider
+
+        self.tester = EthereumTester(PyEVMBackend(vm_configuration=vm_configuration))
+        self.w3 = Web3(EthereumTesterProvider(self.tester))
+        self.accounts = self.w3.eth.accounts
+        self.w3.eth.default_account = self.accounts[0]
+
+    def deploy(self, name, *args, sender=None):
+        compiled = compile_contract(name)
+        factory = self.w3.eth.contract(abi=compiled['abi'], bytecode=compiled['bytecode'])
+        tx_hash = factory.constructor(*args).transact(
+            {'from': sender or self.accounts[0], 'gas': 6000000})
+        receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+        return self.at(name, receipt.contractAddress)
+
+    def at(self, name, address):
+        return self.w3.eth.contract(address=address, abi=compile_contract(name)['abi'])
+
+    def transact(self, call, sender=None, value=0, gas=3000000):
+        """Send ``call`` (a bound contract function) and return its receipt."""
+        tx_hash = call.transact({'from': sender or self.accounts[0], 'value': value, 'gas': gas})
+        return self.w3.eth.wait_for_transaction_receipt(tx_hash)
+
+    @property
+    def timestamp(self):
+        return self.w3.eth.get_block('latest').timestamp
+
+    def time_travel(self, seconds):
+        self.tester.time_travel(self.timestamp + seconds)
+        self.tester.mine_blocks()
+
+    def sign_permit(self, token, owner, spender, value, deadline):
+        """Sign an EIP-2612 permit of ``token`` with the key of ``owner``.
+
+        Returns ``(v, r, s)`` as the contracts take them.  The domain uses
+        the chain id the EVM sees, eth-tester reports another one over RPC.
+        """
+        from eth_abi import encode_abi
+        from eth_account import Account
+        from eth_utils import keccak
+
+        struct_hash = keccak(encode_abi(
+            ['bytes32', 'address', 'address', 'uint256', 'uint256', 'uint256'],
+            [keccak(text=PERMIT_TYPE), owner, spender, value,
+             token.functions.nonces(owner).call(), deadline]))
+        digest = keccak(b'\x19\x01' + token.functions.DOMAIN_SEPARATOR().call() + struct_hash)
+        signed = Account._sign_hash(digest, self.private_key(owner))
+        return signed.v, signed.r.to_bytes(32, 'big'), signed.s.to_bytes(32, 'big')
+
+    def sign_price_report(self, fiat, reporter, price, time):
+        """Sign a price report for ``MyFiat.submitReports`` with the key of ``reporter``."""
+        from eth_abi import encode_abi
+        from eth_account import Account
+        from eth_account.messages import encode_defunct
+        from eth_utils import keccak
+
+        report_hash = keccak(encode_abi(
+            ['address', 'uint256', 'uint256', 'uint256'],
+            [fiat.address, self.tester.backend.chain.chain_id, price, time]))
+        signed = Account.sign_message(encode_defunct(primitive=report_hash), self.private_key(reporter))
+        return signed.v, signed.r.to_bytes(32, 'big'), signed.s.to_bytes(32, 'big')
+
+    def private_key(self, account):
+        from eth_utils import to_canonical_address
+
+        return self.tester.backend._key_lookup[to_canonical_address(account)]
+
+
+def deploy_system(chain, eth_price=DEFAULT_ETH_PRICE, beneficiary=None):
+    """Deploy and wire the six contracts the way the factory expects them."""
+    owner = chain.accounts[0]
+    factory = chain.deploy('Factory')
+    ndao = chain.deploy('NDAOToken', factory.address)
+    fiat = chain.deploy('MyFiat')
+    chain.transact(fiat.functions.setPrice(eth_price))
+    query = chain.deploy('EthPrice')
+    chain.transact(query.functions.setFiator(fiat.address))
+    exchange_template = chain.deploy('Exchange')
+    ico_template = chain.deploy('Ico')
+    chain.transact(factory.functions.initializeFactory(
+        exchange_template.address, beneficiary or owner, ndao.address, query.address, ico_template.address))
+    return System(factory, ndao, fiat, query, exchange_template, ico_template)
+
+
+def swap_data(min_bought, deadline, recipient=ZERO_ADDRESS, exchange=ZERO_ADDRESS):
+    """Encode the ``_data`` of ``transferAndCall`` that sells to an exchange.
+
+    ``recipient`` defaults to the seller.  ``exchange``, for token sales
+    only, is the exchange whose tokens are bought with the NDAO.
+    """
+    from eth_abi import encode_abi
+
+    return encode_abi(['uint256', 'uint256', 'address', 'address'],
+                      [min_bought, deadline, recipient, exchange])
+
+
+def create_ico(chain, system, creator, name='Token', deposit_goal=10 ** 18,
+               token_price=1000 * 10 ** 18, duration=3600, decimals=18, lazy=False):
+    """Create an ICO through the factory and return it.
+
+    ``lazy`` creates it with ``createLazyICO``: deposits are only recorded
+    and the tokens are claimed after it succeeded.
+    """
+    create = system.factory.functions.createLazyICO if lazy else system.factory.functions.createICO
+    chain.transact(create(name, name[:32], decimals, deposit_goal, duration, token_price), sender=creator)
+    address = system.factory.functions.getLatestIco().call({'from': creator})
+    return chain.at('Ico', address)
+
+
+def launch_market(chain, system, creator, name='Token', deposit_goal=10 ** 18,
+                  token_price=1000 * 10 ** 18, duration=3600):
+    """Run an ICO to its goal and submit it, returning ``(ico, exchange)``."""
+    ico = create_ico(chain, system, creator, name, deposit_goal, token_price, duration)
+    chain.transact(ico.functions.deposit(), sender=creator, value=deposit_goal)
+    chain.time_travel(duration + 1)
+    chain.transact(ico.functions.submitICO(), sender=creator)
+    exchange = system.factory.functions.getExchange(ico.address).call()
+    return ico, chain.at('Exchange', exchange)
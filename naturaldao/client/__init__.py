@@ -0,0 +1,414 @@
+"""Asyncio JSON-RPC client for the factory, the exchanges and the tokens.
+
+:class:`Client` coalesces the requests issued in the same turn of the
+event loop into one JSON-RPC batch, so ``asyncio.gather`` over a hundred
+``getExchange`` or ``balanceOf`` reads is one HTTP round trip::
+
+    client = Client(HTTPTransport(url))
+    factory = client.contract('Factory', factory_address)
+    exchanges = await asyncio.gather(*[factory.getExchange(t) for t in tokens])
+
+:meth:`Client.contract` builds a class per contract from its ABI, with one
+coroutine per constant function returning the decoded result; the
+state-changing functions are sent with :meth:`Contract.transact`.  The
+swap functions traders send the most have hand-written encoders
+(:func:`encode_ndao_to_token_swap_input` and friends) that skip the
+generic ABI encoder.
+
+:class:`HTTPTransport` keeps a pool of connections with ``aiohttp``;
+:class:`LocalTransport` answers in-process with the provider of a
+:class:`~naturaldao.chain.LocalChain`, for tests.  The ABIs are compiled
+from ``contracts/`` unless given, which needs ``vyper`` like
+:mod:`naturaldao.chain`.
+"""
+import asyncio
+import inspect
+import itertools
+from functools import lru_cache
+
+from eth_abi import decode_abi, encode_abi
+from eth_utils import function_abi_to_4byte_selector, keccak, to_checksum_address
+
+# requests per JSON-RPC batch, most nodes refuse larger ones
+MAX_BATCH = 100
+
+PYTHON_TYPES = {'address': str, 'bool': bool, 'string': str}
+
+
+class RPCError(Exception):
+    """The node answered a request with an error object."""
+
+    def __init__(self, method, code, message, data=None):
+        super().__init__('%s: %s (%s)' % (method, message, code))
+        self.method = method
+        self.code = code
+        self.data = data
+
+
+# ---- transports ----
+
+
+class HTTPTransport:
+    """POST JSON-RPC payloads to ``url`` over at most ``connections`` pooled connections."""
+
+    def __init__(self, url, connections=8, timeout=30):
+        self.url = url
+        self.connections = connections
+        self.timeout = timeout
+        self.session = None
+
+    async def send(self, payload):
+        import aiohttp
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self.session.post(self.url, json=payload) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class LocalTransport:
+    """Answer JSON-RPC payloads with a web3 provider in this process, e.g. ``LocalChain().w3.provider``.
+
+    The tester refuses what a node fills in itself: ``eth_call`` and
+    ``eth_estimateGas`` without a ``from`` are sent from ``default_sender``
+    and ``eth_sendTransaction`` without a ``gas`` gets the estimate.
+    """
+
+    def __init__(self, provider, w3=None, default_sender=None):
+        from web3 import Web3
+
+        w3 = w3 or Web3(provider)
+        self.request = provider.request_func(w3, ())
+        self.default_sender = default_sender or w3.eth.accounts[0]
+
+    async def send(self, payload):
+        if isinstance(payload, dict):
+            return self.answer(payload)
+        return [self.answer(request) for request in payload]
+
+    def answer(self, request):
+        method, params = request['method'], list(request['params'])
+        if method in ('eth_call', 'eth_estimateGas') and 'from' not in params[0]:
+            params[0] = dict(params[0], **{'from': self.default_sender})
+        try:
+            if method == 'eth_sendTransaction' and 'gas' not in params[0]:
+                params[0] = dict(params[0], gas=self.request('eth_estimateGas', params[:1])['result'])
+            response = self.request(method, params)
+        except Exception as e:
+            # the tester raises where a node answers with an error object
+            response = {'error': {'code': -32000, 'message': str(e)}}
+        response = dict(response, id=request['id'], jsonrpc='2.0')
+        if isinstance(response.get('error'), str):
+            response['error'] = {'code': -32601, 'message': response['error']}
+        return response
+
+    async def close(self):
+        pass
+
+
+# ---- client ----
+
+
+class Client:
+    """Send JSON-RPC requests through ``transport``, batching the concurrent ones."""
+
+    def __init__(self, transport, max_batch=MAX_BATCH):
+        self.transport = transport
+        self.max_batch = max_batch
+        self.ids = itertools.count(1)
+        self.pending = []
+        self.flush_scheduled = False
+        self.requests = 0
+        self.batches = 0
+
+    async def request(self, method, *params):
+        """Send one request and return its ``result``; raise :class:`RPCError` on an error."""
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append(({'jsonrpc': '2.0', 'id': next(self.ids), 'method': method,
+                              'params': list(params)}, future))
+        if not self.flush_scheduled:
+            # everything requested until the loop comes back here goes out together
+            self.flush_scheduled = True
+            asyncio.get_event_loop().call_soon(self.flush)
+        return await future
+
+    def flush(self):
+        self.flush_scheduled = False
+        pending, self.pending = self.pending, []
+        for i in range(0, len(pending), self.max_batch):
+            asyncio.ensure_future(self.send_batch(pending[i:i + self.max_batch]))
+
+    async def send_batch(self, batch):
+        self.requests += len(batch)
+        self.batches += 1
+        try:
+            responses = await self.transport.send([payload for payload, _ in batch])
+            if isinstance(responses, dict):
+                # a node that fails the whole batch answers with a single error
+                raise RPCError('batch', responses.get('error', {}).get('code'),
+                               responses.get('error', {}).get('message'))
+            by_id = {response.get('id'): response for response in responses}
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for payload, future in batch:
+            if future.done():
+                continue  # cancelled by the caller
+            response = by_id.get(payload['id'])
+            if response is None:
+                future.set_exception(RPCError(payload['method'], None, 'no response in the batch'))
+            elif response.get('error') is not None:
+                error = response['error']
+                future.set_exception(RPCError(
+                    payload['method'], error.get('code'), error.get('message'), error.get('data')))
+            else:
+                future.set_result(response.get('result'))
+
+    async def close(self):
+        await self.transport.close()
+
+    # ---- eth ----
+
+    async def call(self, to, data, sender=None, block='latest'):
+        """``eth_call`` and return the output as bytes."""
+        tx = {'to': to, 'data': hex_data(data)}
+        if sender is not None:
+            tx['from'] = sender
+        return bytes.fromhex(strip_hex(await self.request('eth_call', tx, block_id(block))))
+
+    async def block_number(self):
+        return to_int(await self.request('eth_blockNumber'))
+
+    async def transaction_count(self, account, block='pending'):
+        return to_int(await self.request('eth_getTransactionCount', account, block_id(block)))
+
+    async def send_transaction(self, tx):
+        """``eth_sendTransaction`` for an account the node holds the key of; returns the hash."""
+        return await self.request('eth_sendTransaction', rpc_transaction(tx))
+
+    async def send_signed(self, tx, private_key):
+        """Fill in the nonce, gas price and chain id, sign ``tx`` and send it; returns the hash.
+
+        The three lookups missing from ``tx`` go out in one batch.
+        """
+        from eth_account import Account
+
+        tx = dict(tx)
+        sender = Account.from_key(private_key).address
+        lookups = {}
+        if 'nonce' not in tx:
+            lookups['nonce'] = self.transaction_count(sender)
+        if 'gasPrice' not in tx:
+            lookups['gasPrice'] = self.request('eth_gasPrice')
+        if 'chainId' not in tx:
+            lookups['chainId'] = self.request('eth_chainId')
+        for key, value in zip(lookups, await asyncio.gather(*lookups.values())):
+            tx[key] = to_int(value)
+        tx.setdefault('value', 0)
+        tx['data'] = hex_data(tx.get('data', b''))
+        signed = Account.sign_transaction(tx, private_key)
+        return await self.request('eth_sendRawTransaction', signed.rawTransaction.hex())
+
+    async def receipt(self, tx_hash, poll_interval=0.1):
+        """Wait for the receipt of ``tx_hash`` and return it as the node sent it."""
+        while True:
+            receipt = await self.request('eth_getTransactionReceipt', tx_hash)
+            if receipt is not None:
+                return receipt
+            await asyncio.sleep(poll_interval)
+
+    def contract(self, name, address, abi=None):
+        """Return an instance of the client class of ``contracts/<name>.py`` at ``address``."""
+        cls = contract_class(name) if abi is None else build_contract_class(name, abi)
+        return cls(self, address)
+
+
+def to_int(value):
+    # the tester answers some quantities as ints, nodes as hex strings
+    return value if isinstance(value, int) else int(value, 16)
+
+
+def strip_hex(value):
+    return value[2:] if value.startswith('0x') else value
+
+
+def hex_data(data):
+    return data if isinstance(data, str) else '0x' + bytes(data).hex()
+
+
+def block_id(block):
+    return hex(block) if isinstance(block, int) else block
+
+
+def rpc_transaction(tx):
+    out = {}
+    for key, value in tx.items():
+        if key == 'data':
+            out[key] = hex_data(value)
+        elif isinstance(value, int):
+            out[key] = hex(value)
+        else:
+            out[key] = value
+    return out
+
+
+# ---- contracts ----
+
+
+def abi_type(param):
+    if param['type'].startswith('tuple'):
+        return '(%s)%s' % (','.join(abi_type(c) for c in param['components']), param['type'][5:])
+    return param['type']
+
+
+def python_type(abi):
+    if abi.endswith(']'):
+        return list
+    if abi.startswith('('):
+        return tuple
+    if abi.startswith('bytes'):
+        return bytes
+    return PYTHON_TYPES.get(abi, int)
+
+
+class ContractFunction:
+    """One function of an ABI: its selector, encoder and decoder."""
+
+    def __init__(self, abi):
+        self.name = abi['name']
+        self.inputs = [abi_type(i) for i in abi['inputs']]
+        self.outputs = [abi_type(o) for o in abi.get('outputs', ())]
+        self.constant = abi.get('constant') or abi.get('stateMutability') in ('view', 'pure')
+        self.selector = function_abi_to_4byte_selector(abi)
+        self.signature = inspect.Signature(
+            [inspect.Parameter(i['name'] or 'arg%d' % n, inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                               annotation=python_type(t))
+             for n, (i, t) in enumerate(zip(abi['inputs'], self.inputs))],
+            return_annotation=python_type(self.outputs[0]) if len(self.outputs) == 1 else tuple)
+
+    def encode(self, *args):
+        return self.selector + encode_abi(self.inputs, args)
+
+    def decode(self, data):
+        values = [to_checksum_address(v) if t == 'address' else v
+                  for t, v in zip(self.outputs, decode_abi(self.outputs, data))]
+        return values[0] if len(values) == 1 else tuple(values)
+
+
+class Contract:
+    """A contract at ``address`` seen through ``client``.
+
+    The subclasses :meth:`Client.contract` builds have a coroutine per
+    constant function; the other functions are in :attr:`functions` for
+    :meth:`encode` and :meth:`transact`.
+    """
+
+    functions = {}
+
+    def __init__(self, client, address):
+        self.client = client
+        self.address = to_checksum_address(address)
+
+    def encode(self, name, *args):
+        """Return the calldata of ``name(*args)``."""
+        return self.functions[name].encode(*args)
+
+    async def call(self, name, *args, sender=None, block='latest'):
+        """Run ``name(*args)`` with ``eth_call`` and decode what it returns, constant or not."""
+        function = self.functions[name]
+        return function.decode(await self.client.call(
+            self.address, function.encode(*args), sender=sender, block=block))
+
+    async def transact(self, name, *args, sender, value=0, gas=None, private_key=None):
+        """Send ``name(*args)`` and return the transaction hash.
+
+        With ``private_key`` the transaction is signed here and sent raw,
+        ``sender`` must then be its address.
+        """
+        tx = {'from': sender, 'to': self.address, 'value': value, 'data': self.encode(name, *args)}
+        if gas is not None:
+            tx['gas'] = gas
+        if private_key is not None:
+            del tx['from']
+            tx.setdefault('gas', 3000000)
+            return await self.client.send_signed(tx, private_key)
+        return await self.client.send_transaction(tx)
+
+
+def _constant_method(function):
+    async def method(self, *args, block='latest'):
+        return await self.call(function.name, *args, block=block)
+
+    method.__name__ = method.__qualname__ = function.name
+    method.__signature__ = function.signature
+    method.__doc__ = '``eth_call`` of ``%s(%s)``.' % (function.name, ','.join(function.inputs))
+    return method
+
+
+def build_contract_class(name, abi):
+    """Return a :class:`Contract` subclass with a coroutine per constant function of ``abi``."""
+    # vyper 0.1 ABIs repeat a function name for its default arguments, the longest one wins
+    functions = {}
+    for item in abi:
+        if item.get('type') == 'function':
+            function = ContractFunction(item)
+            if len(function.inputs) >= len(functions.get(function.name, function).inputs):
+                functions[function.name] = function
+    namespace = {'functions': functions, '__doc__': 'Client of %s built from its ABI.' % name}
+    for function in functions.values():
+        if function.constant and not hasattr(Contract, function.name):
+            namespace[function.name] = _constant_method(function)
+    return type(name, (Contract,), namespace)
+
+
+@lru_cache(maxsize=None)
+def contract_class(name):
+    from naturaldao.chain import compile_contract
+
+    return build_contract_class(name, compile_contract(name, ('abi',))['abi'])
+
+
+# ---- hot swaps ----
+
+
+def _selector(signature):
+    return keccak(text=signature)[:4]
+
+
+NDAO_TO_TOKEN_SWAP_INPUT = _selector('ndaoToTokenSwapInput(uint256,uint256,uint256)')
+TOKEN_TO_NDAO_SWAP_INPUT = _selector('tokenToNdaoSwapInput(uint256,uint256,uint256)')
+TOKEN_TO_TOKEN_SWAP_INPUT = _selector('tokenToTokenSwapInput(uint256,uint256,uint256,uint256,address)')
+
+
+def _word(value):
+    return value.to_bytes(32, 'big')
+
+
+def _address_word(address):
+    return bytes(12) + bytes.fromhex(strip_hex(address))
+
+
+def encode_ndao_to_token_swap_input(ndao_sold, min_tokens, deadline):
+    """Calldata of ``Exchange.ndaoToTokenSwapInput``."""
+    return NDAO_TO_TOKEN_SWAP_INPUT + _word(ndao_sold) + _word(min_tokens) + _word(deadline)
+
+
+def encode_token_to_ndao_swap_input(tokens_sold, min_ndao, deadline):
+    """Calldata of ``Exchange.tokenToNdaoSwapInput``."""
+    return TOKEN_TO_NDAO_SWAP_INPUT + _word(tokens_sold) + _word(min_ndao) + _word(deadline)
+
+
+def encode_token_to_token_swap_input(tokens_sold, min_tokens_bought, min_ndao_bought, deadline, token_addr):
+    """Calldata of ``Exchange.tokenToTokenSwapInput``."""
+    return (TOKEN_TO_TOKEN_SWAP_INPUT + _word(tokens_sold) + _word(min_tokens_bought)
+            + _word(min_ndao_bought) + _word(deadline) + _address_word(token_addr))
@@ -0,0 +1,310 @@
+"""Index the factory and exchange events into a SQLite database.
+
+:class:`Indexer` walks the chain in block ranges with ``eth_getLogs``:
+``NewExchange`` logs of the factory register exchanges and their initial
+reserves, then ``TokenPurchase``, ``NdaoPurchase``, ``TokenToTokenPurchase``
+and ``Sync`` logs of every known exchange move the reserves.  Each change
+is stored as a row of ``reserves`` keyed by ``(exchange, block_number,
+log_index)``, so the reserves of an exchange at any block are one index
+lookup away (:meth:`Indexer.reserves_at`).
+
+Only blocks ``confirmations`` behind the head are indexed.  The hash of
+the last block of every range is kept; when it no longer matches the
+chain the indexer rolls back to the newest block whose hash still does
+and indexes again from there.
+
+The exchanges keep their reserves in storage, so the events are enough
+to follow them: a token to token trade that buys an exact output logs no
+``NdaoPurchase`` on the exchange it sells into, the NDAO it pays is read
+from the ``TokenPurchase`` the other exchange logs in the same
+transaction.  ``Sync`` sets the reserves outright.
+
+Needs ``web3`` 5.x.  ``python -m naturaldao.indexer`` runs it against a
+JSON-RPC endpoint.
+"""
+import sqlite3
+import time
+from collections import namedtuple
+
+from eth_utils import encode_hex, event_abi_to_log_topic, to_checksum_address
+from web3._utils.events import get_event_data
+from web3.exceptions import BlockNotFound
+
+Reserves = namedtuple('Reserves', 'block_number log_index token_reserve ndao_reserve')
+Trade = namedtuple('Trade', 'block_number log_index tx_hash kind buyer amount_in amount_out')
+
+# number of range checkpoints kept to find where a reorg forked
+KEEP_CHECKPOINTS = 256
+# exchanges per eth_getLogs request
+ADDRESS_CHUNK = 500
+
+
+def _event(name, *inputs):
+    return {
+        'type': 'event', 'name': name, 'anonymous': False,
+        'inputs': [{'name': n, 'type': t, 'indexed': i} for n, t, i in inputs],
+    }
+
+
+NEW_EXCHANGE = _event(
+    'NewExchange', ('_token', 'address', True), ('_exchange', 'address', True),
+    ('_amount', 'uint256', False), ('_tokenAmount', 'uint256', False))
+TOKEN_PURCHASE = _event(
+    'TokenPurchase', ('buyer', 'address', True), ('ndao_sold', 'uint256', True),
+    ('tokens_bought', 'uint256', True))
+NDAO_PURCHASE = _event(
+    'NdaoPurchase', ('buyer', 'address', True), ('tokens_sold', 'uint256', True),
+    ('ndao_bought', 'uint256', True))
+TOKEN_TO_TOKEN_PURCHASE = _event(
+    'TokenToTokenPurchase', ('buyer', 'address', True), ('tokenAddress', 'address', False),
+    ('tokens_sold', 'uint256', False), ('token_bought', 'uint256', False))
+SYNC = _event('Sync', ('token_reserve', 'uint256', False), ('ndao_reserve', 'uint256', False))
+
+EXCHANGE_EVENTS = {encode_hex(event_abi_to_log_topic(e)): e for e in (
+    TOKEN_PURCHASE, NDAO_PURCHASE, TOKEN_TO_TOKEN_PURCHASE, SYNC)}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS checkpoints (
+    block_number INTEGER PRIMARY KEY,
+    block_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS exchanges (
+    address TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    block_number INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS exchanges_block ON exchanges (block_number);
+CREATE TABLE IF NOT EXISTS reserves (
+    exchange TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    token_reserve TEXT NOT NULL,
+    ndao_reserve TEXT NOT NULL,
+    PRIMARY KEY (exchange, block_number, log_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS reserves_block ON reserves (block_number);
+CREATE TABLE IF NOT EXISTS trades (
+    exchange TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    buyer TEXT NOT NULL,
+    amount_in TEXT NOT NULL,
+    amount_out TEXT NOT NULL,
+    PRIMARY KEY (exchange, block_number, log_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trades_block ON trades (block_number);
+'''
+
+
+class Indexer:
+    """Follow the exchanges of ``factory`` into the SQLite database ``db``.
+
+    ``db`` is a path or an open :class:`sqlite3.Connection`.  Indexing
+    starts at ``start_block`` (the block the factory was deployed in is
+    enough) and resumes from the last checkpoint on later runs.
+    """
+
+    def __init__(self, w3, factory, db, start_block=0, confirmations=12, batch_size=1000):
+        self.w3 = w3
+        self.factory = to_checksum_address(factory)
+        self.conn = db if isinstance(db, sqlite3.Connection) else sqlite3.connect(db)
+        self.conn.executescript(SCHEMA)
+        self.start_block = start_block
+        self.confirmations = confirmations
+        self.batch_size = batch_size
+        self.new_exchange_topic = encode_hex(event_abi_to_log_topic(NEW_EXCHANGE))
+
+    # ---- progress ----
+
+    @property
+    def last_block(self):
+        """Last block indexed, ``start_block - 1`` before the first range."""
+        row = self.conn.execute('SELECT MAX(block_number) FROM checkpoints').fetchone()
+        return self.start_block - 1 if row[0] is None else row[0]
+
+    def safe_head(self):
+        return self.w3.eth.block_number - self.confirmations
+
+    def sync(self):
+        """Index up to the safe head and return the last block indexed."""
+        self.handle_reorg()
+        head = self.safe_head()
+        while self.last_block < head:
+            from_block = self.last_block + 1
+            self.index_range(from_block, min(head, from_block + self.batch_size - 1))
+        return self.last_block
+
+    def follow(self, poll_interval=2.0, on_progress=None):
+        """Call :meth:`sync` forever, sleeping ``poll_interval`` seconds in between."""
+        while True:
+            last = self.sync()
+            if on_progress is not None:
+                on_progress(last)
+            time.sleep(poll_interval)
+
+    # ---- reorgs ----
+
+    def handle_reorg(self):
+        """Roll back past any checkpoint whose block is no longer on the chain.
+
+        Returns the block rolled back to, or ``None`` when nothing changed.
+        """
+        checkpoints = self.conn.execute(
+            'SELECT block_number, block_hash FROM checkpoints ORDER BY block_number DESC').fetchall()
+        for i, (number, block_hash) in enumerate(checkpoints):
+            try:
+                on_chain = self.w3.eth.get_block(number).hash.hex()
+            except BlockNotFound:
+                on_chain = None
+            if on_chain == block_hash:
+                if i == 0:
+                    return None
+                self.rollback(number)
+                return number
+        if not checkpoints:
+            return None
+        # forked below every checkpoint kept, start over
+        self.rollback(self.start_block - 1)
+        return self.start_block - 1
+
+    def rollback(self, block_number):
+        """Forget everything indexed after ``block_number``."""
+        with self.conn:
+            for table in ('checkpoints', 'exchanges', 'reserves', 'trades'):
+                self.conn.execute('DELETE FROM %s WHERE block_number > ?' % table, (block_number,))
+
+    # ---- indexing ----
+
+    def get_logs(self, from_block, to_block, address, topics):
+        return self.w3.eth.get_logs({
+            'fromBlock': from_block, 'toBlock': to_block, 'address': address, 'topics': topics})
+
+    def index_range(self, from_block, to_block):
+        """Index the logs of blocks ``from_block..to_block`` in one transaction."""
+        # hash first: if the range reorgs while its logs are fetched, the
+        # next sync sees the checkpoint gone and indexes it again
+        block_hash = self.w3.eth.get_block(to_block).hash.hex()
+        codec = self.w3.codec
+        logs = [(log, NEW_EXCHANGE) for log in self.get_logs(
+            from_block, to_block, self.factory, [self.new_exchange_topic])]
+        new_exchanges = [get_event_data(codec, NEW_EXCHANGE, log) for log, _ in logs]
+        exchanges = [row[0] for row in self.conn.execute('SELECT address FROM exchanges')]
+        exchanges += [e.args._exchange for e in new_exchanges]
+        topics = [list(EXCHANGE_EVENTS)]
+        for i in range(0, len(exchanges), ADDRESS_CHUNK):
+            for log in self.get_logs(from_block, to_block, exchanges[i:i + ADDRESS_CHUNK], topics):
+                logs.append((log, EXCHANGE_EVENTS[encode_hex(log.topics[0])]))
+        events = [get_event_data(codec, abi, log) for log, abi in logs]
+        events.sort(key=lambda e: (e.blockNumber, e.logIndex))
+
+        with self.conn:
+            current = {}
+            for event in events:
+                self.apply(event, events, current)
+            self.conn.execute('INSERT INTO checkpoints VALUES (?, ?)', (to_block, block_hash))
+            self.conn.execute(
+                'DELETE FROM checkpoints WHERE block_number <= ('
+                'SELECT block_number FROM checkpoints ORDER BY block_number DESC LIMIT 1 OFFSET ?)',
+                (KEEP_CHECKPOINTS,))
+
+    def apply(self, event, events, current):
+        """Move the reserves of the exchange that logged ``event``."""
+        exchange = event.address
+        args = event.args
+        if event.event == 'NewExchange':
+            self.conn.execute('INSERT INTO exchanges VALUES (?, ?, ?)',
+                              (args._exchange, args._token, event.blockNumber))
+            reserves = (args._tokenAmount, args._amount)
+            exchange = args._exchange
+        else:
+            if exchange not in current:
+                last = self.reserves_at(exchange, event.blockNumber)
+                current[exchange] = (last.token_reserve, last.ndao_reserve)
+            token_reserve, ndao_reserve = current[exchange]
+            if event.event == 'TokenPurchase':
+                reserves = (token_reserve - args.tokens_bought, ndao_reserve + args.ndao_sold)
+                self.add_trade(event, 'ndao_to_token', args.ndao_sold, args.tokens_bought)
+            elif event.event == 'NdaoPurchase':
+                reserves = (token_reserve + args.tokens_sold, ndao_reserve - args.ndao_bought)
+                self.add_trade(event, 'token_to_ndao', args.tokens_sold, args.ndao_bought)
+            elif event.event == 'Sync':
+                reserves = (args.token_reserve, args.ndao_reserve)
+            else:
+                self.add_trade(event, 'token_to_token', args.tokens_sold, args.token_bought)
+                ndao_bought = self.output_leg(event, events)
+                if ndao_bought is None:
+                    return
+                reserves = (token_reserve + args.tokens_sold, ndao_reserve - ndao_bought)
+        current[exchange] = reserves
+        self.conn.execute('INSERT INTO reserves VALUES (?, ?, ?, ?, ?)', (
+            exchange, event.blockNumber, event.logIndex, str(reserves[0]), str(reserves[1])))
+
+    @staticmethod
+    def output_leg(event, events):
+        """NDAO paid out by a token to token trade that logged no ``NdaoPurchase``.
+
+        Returns ``None`` when the trade sold an exact input: its
+        ``NdaoPurchase`` came first and already moved the reserves.
+        """
+        exchange, peer = event.address, event.args.tokenAddress
+        same_tx = [e for e in events if e.transactionHash == event.transactionHash
+                   and e.logIndex < event.logIndex]
+        bought = [e for e in same_tx if e.address == peer and e.event == 'TokenPurchase'
+                  and e.args.buyer == exchange]
+        if not bought:
+            raise ValueError('no TokenPurchase of %s for %s' % (peer, event.transactionHash.hex()))
+        leg = bought[-1]
+        own = [e for e in same_tx if e.address == exchange and e.logIndex < leg.logIndex]
+        if own and own[-1].event == 'NdaoPurchase' and (
+                own[-1].args.tokens_sold == event.args.tokens_sold
+                and own[-1].args.ndao_bought == leg.args.ndao_sold):
+            return None
+        return leg.args.ndao_sold
+
+    def add_trade(self, event, kind, amount_in, amount_out):
+        self.conn.execute('INSERT INTO trades VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+            event.address, event.blockNumber, event.logIndex, event.transactionHash.hex(),
+            kind, event.args.buyer, str(amount_in), str(amount_out)))
+
+    # ---- queries ----
+
+    def exchanges(self):
+        """``{exchange: token}`` of every exchange indexed so far."""
+        return dict(self.conn.execute('SELECT address, token FROM exchanges'))
+
+    def reserves_at(self, exchange, block_number=None):
+        """Reserves of ``exchange`` at the end of ``block_number`` (default: latest)."""
+        if block_number is None:
+            block_number = self.last_block
+        row = self.conn.execute(
+            'SELECT block_number, log_index, token_reserve, ndao_reserve FROM reserves '
+            'WHERE exchange = ? AND block_number <= ? '
+            'ORDER BY block_number DESC, log_index DESC LIMIT 1',
+            (to_checksum_address(exchange), block_number)).fetchone()
+        if row is None:
+            return None
+        return Reserves(row[0], row[1], int(row[2]), int(row[3]))
+
+    def reserve_history(self, exchange, from_block=0, to_block=None):
+        """Every reserve change of ``exchange`` between two blocks, oldest first."""
+        if to_block is None:
+            to_block = self.last_block
+        rows = self.conn.execute(
+            'SELECT block_number, log_index, token_reserve, ndao_reserve FROM reserves '
+            'WHERE exchange = ? AND block_number BETWEEN ? AND ? '
+            'ORDER BY block_number, log_index',
+            (to_checksum_address(exchange), from_block, to_block))
+        return [Reserves(b, i, int(t), int(n)) for b, i, t, n in rows]
+
+    def trades(self, exchange, from_block=0, to_block=None):
+        """Trades logged by ``exchange`` between two blocks, oldest first."""
+        if to_block is None:
+            to_block = self.last_block
+        rows = self.conn.execute(
+            'SELECT block_number, log_index, tx_hash, kind, buyer, amount_in, amount_out FROM trades '
+            'WHERE exchange = ? AND block_number BETWEEN ? AND ? '
+            'ORDER BY block_number, log_index',
+            (to_checksum_address(exchange), from_block, to_block))
+        return [Trade(b, i, h, k, buyer, int(a), int(o)) for b, i, h, k, buyer, a, o in rows]
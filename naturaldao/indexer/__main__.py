@@ -0,0 +1,38 @@
+"""Usage: ``python -m naturaldao.indexer --rpc URL --factory ADDRESS [--db PATH] [--follow]``"""
+import argparse
+import sys
+
+from naturaldao.indexer import Indexer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index the exchange reserves into a SQLite database.')
+    parser.add_argument('--rpc', required=True, help='HTTP JSON-RPC endpoint')
+    parser.add_argument('--factory', required=True, help='address of the factory')
+    parser.add_argument('--db', default='naturaldao.sqlite')
+    parser.add_argument('--start-block', type=int, default=0, help='block the factory was deployed in')
+    parser.add_argument('--confirmations', type=int, default=12)
+    parser.add_argument('--batch-size', type=int, default=1000, help='blocks per eth_getLogs range')
+    parser.add_argument('--follow', action='store_true', help='keep polling for new blocks')
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    from web3 import Web3
+    w3 = Web3(Web3.HTTPProvider(args.rpc))
+    indexer = Indexer(w3, args.factory, args.db, start_block=args.start_block,
+                      confirmations=args.confirmations, batch_size=args.batch_size)
+
+    def report(block):
+        print('indexed up to block %d, %d exchanges' % (block, len(indexer.exchanges())), flush=True)
+
+    if args.follow:
+        try:
+            indexer.follow(args.poll_interval, on_progress=report)
+        except KeyboardInterrupt:
+            return 0
+    report(indexer.sync())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""Per-line gas profile of transactions on a :class:`~naturaldao.chain.LocalChain`.
+
+:func:`tracing` replaces the opcode loop of py-evm while it is active and
+charges the gas of every opcode to the source line the vyper source map
+gives for its program counter.  Code is recognised by its runtime
+bytecode, so the exchanges and ICOs created through forwarders are
+profiled as ``Exchange`` and ``Ico``; the forwarders themselves show up
+as ``<forwarder>``, one line per function they forward to, and the code
+run by ``CREATE`` as ``<create>``.  The
+selector dispatch and argument checks of a function, which the source map
+leaves out, are charged to line ``-``.
+
+The gas of a ``CALL``-like opcode is split in two: what the opcode
+itself costs stays on the calling line (``self``), what the callee used
+is added to the line ``inclusive`` and to :attr:`Profile.calls`.  The
+folded stacks of :meth:`Profile.folded` can be fed to ``flamegraph.pl``
+or speedscope as they are.
+
+``python -m naturaldao.profile LABEL`` profiles the scenarios of
+:mod:`naturaldao.bench` whose label starts with ``LABEL``.
+"""
+import collections
+import contextlib
+from functools import lru_cache
+
+from naturaldao import CONTRACTS_DIR
+from naturaldao.bench import Recorder
+from naturaldao.chain import compile_contract
+
+CALL_OPCODES = frozenset(['CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL', 'CREATE', 'CREATE2'])
+CREATE = '<create>'
+FORWARDER = '<forwarder>'
+UNKNOWN = '<unknown>'
+
+Line = collections.namedtuple('Line', 'contract lineno')
+Call = collections.namedtuple('Call', 'line opcode callee gas')
+
+
+class LineStats:
+    """Gas and storage/call counts of one source line."""
+
+    __slots__ = ('gas', 'inclusive', 'sload', 'sstore', 'calls', 'steps')
+
+    def __init__(self):
+        self.gas = self.inclusive = self.sload = self.sstore = self.calls = self.steps = 0
+
+
+@lru_cache(maxsize=None)
+def known_code():
+    """Return ``{runtime bytecode: (name, {pc: lineno}, {selector: function})}`` of ``contracts/*.py``."""
+    code = {}
+    for path in sorted(CONTRACTS_DIR.glob('*.py')):
+        compiled = compile_contract(path.stem, ('bytecode_runtime', 'source_map', 'abi'))
+        lines = {int(pc): pos[0] for pc, pos in compiled['source_map']['pc_pos_map'].items()}
+        selectors = {}
+        for item in compiled['abi']:
+            if item.get('type') == 'function':
+                selectors[function_selector(item)] = item['name']
+        code[bytes.fromhex(compiled['bytecode_runtime'][2:])] = (path.stem, lines, selectors)
+    return code
+
+
+def function_selector(item):
+    from eth_utils import function_abi_to_4byte_selector
+
+    return function_abi_to_4byte_selector(item)
+
+
+@lru_cache(maxsize=None)
+def source_lines(name):
+    return (CONTRACTS_DIR / (name + '.py')).read_text().split('\n')
+
+
+class StorageStats:
+    """Storage accesses of one function over every traced call of it.
+
+    An access is warm when the transaction already touched the slot of
+    that account, i.e. when it would cost the warm price of EIP-2929.
+    """
+
+    __slots__ = ('runs', 'sload', 'sload_warm', 'sstore', 'sstore_warm')
+
+    def __init__(self):
+        self.runs = self.sload = self.sload_warm = self.sstore = self.sstore_warm = 0
+
+
+class Frame:
+    """One message call being executed: which code, which function, and who called it."""
+
+    def __init__(self, message, parent=None):
+        known = None if message.is_create else known_code().get(bytes(message.code))
+        if known is not None:
+            self.contract, self.lines, selectors = known
+            self.function = selectors.get(bytes(message.data[:4]), '__default__')
+            self.label = '%s.%s' % (self.contract, self.function)
+        else:
+            if message.is_create:
+                self.contract = CREATE
+            else:
+                self.contract = FORWARDER if is_forwarder(message.code) else UNKNOWN
+            self.lines = {}
+            self.label = self.contract
+        # the code between two mapped program counters belongs to the line before it, the
+        # dispatcher and argument checks before the first mapped line to no line at all
+        self.line = Line(self.contract, None)
+        self.stack = (parent.here() if parent else ()) + (self.label,)
+        self.target = None
+        if parent is not None and parent.contract == FORWARDER:
+            parent.target = self
+            # a forwarder has no source lines, its row is keyed by the code it runs so that
+            # nested forwarders do not add up each other's inclusive gas
+            parent.line = Line(FORWARDER, self.label)
+
+    def step(self, pc):
+        lineno = self.lines.get(pc)
+        if lineno is not None and lineno != self.line.lineno:
+            self.line = Line(self.contract, lineno)
+        return self.line
+
+    def here(self):
+        return self.stack + (format_line(self.line),) if self.lines else self.stack
+
+    @property
+    def callee(self):
+        """The label external calls to this frame are listed under, forwarders resolved."""
+        if self.target is not None:
+            return '%s via %s' % (self.target.label, FORWARDER)
+        return self.label
+
+
+def is_forwarder(code):
+    # create_forwarder_to deploys an EIP-1167 style proxy ending in DELEGATECALL ... RETURN
+    return len(code) < 64 and b'\xf4' in bytes(code)
+
+
+class Profile:
+    """The gas of the traced message calls by source line, by external call and by stack."""
+
+    def __init__(self):
+        self.lines = collections.defaultdict(LineStats)
+        self.calls = []
+        self.stacks = collections.Counter()
+        self.storage = collections.defaultdict(StorageStats)
+        self.gas = 0
+
+    def report(self, limit=30):
+        """Return the ``limit`` most expensive lines and every external call as text."""
+        out = ['%8s %9s %6s %6s %5s  %-24s %s' % ('self', 'inclusive', 'SLOAD', 'SSTORE', 'CALL', 'line', 'source')]
+        ranked = sorted(self.lines.items(), key=lambda item: -item[1].gas)
+        for line, stats in ranked[:limit]:
+            out.append('%8d %9d %6d %6d %5d  %-24s %s' % (
+                stats.gas, stats.inclusive, stats.sload, stats.sstore, stats.calls,
+                format_line(line), source_of(line)))
+        out.append('')
+        out.append('%8s  %-24s %-14s %s' % ('gas', 'from', 'opcode', 'to'))
+        for call in self.calls:
+            out.append('%8d  %-24s %-14s %s' % (call.gas, format_line(call.line), call.opcode, call.callee))
+        out.append('')
+        out.append('%8d  execution gas, intrinsic gas excluded' % self.gas)
+        return '\n'.join(out)
+
+    def folded(self):
+        """Return the stacks in the folded format of ``flamegraph.pl``, one ``a;b;c gas`` per line."""
+        return '\n'.join('%s %d' % (';'.join(stack), gas) for stack, gas in sorted(self.stacks.items()))
+
+
+def format_line(line):
+    if line.contract == FORWARDER and line.lineno is not None:
+        return '%s via %s' % (line.lineno, FORWARDER)
+    if line.contract in (CREATE, FORWARDER, UNKNOWN):
+        return line.contract
+    if line.lineno is None:
+        return '%s.py:-' % line.contract
+    return '%s.py:%d' % (line.contract, line.lineno)
+
+
+def source_of(line):
+    if line.lineno is None or line.contract in (CREATE, FORWARDER, UNKNOWN):
+        return ''
+    return source_lines(line.contract)[line.lineno - 1].strip()
+
+
+@contextlib.contextmanager
+def tracing(profile):
+    """Profile every message call py-evm executes inside the ``with`` block into ``profile``."""
+    from eth.exceptions import Halt
+    from eth.vm.computation import BaseComputation
+    from eth.vm.logic.invalid import InvalidOpcode
+
+    original = BaseComputation.__dict__['apply_computation']
+    frames = []
+    frame_of = {}
+    touched = set()
+
+    def apply_computation(cls, state, message, transaction_context):
+        with cls(state, message, transaction_context) as computation:
+            precompile = computation.precompiles.get(message.code_address)
+            if precompile is not None:
+                precompile(computation)
+                return computation
+            if not frames:
+                touched.clear()
+            frame = frame_of[id(computation)] = Frame(message, frames[-1] if frames else None)
+            profile.storage[frame.label].runs += 1
+            frames.append(frame)
+            try:
+                run_opcodes(computation, frame)
+            finally:
+                frames.pop()
+            if not frames:
+                profile.gas += computation.get_gas_used()
+        return computation
+
+    def run_opcodes(computation, frame):
+        opcode_lookup = computation.opcodes
+        code = computation.code
+        for opcode in code:
+            opcode_fn = opcode_lookup.get(opcode) or InvalidOpcode(opcode)
+            frame.step(code.program_counter - 1)
+            mnemonic = opcode_fn.mnemonic
+            if mnemonic == 'SLOAD' or mnemonic == 'SSTORE':
+                count_storage(computation, profile.storage[frame.label], mnemonic)
+            children = len(computation.children)
+            before = computation.get_gas_remaining()
+            try:
+                opcode_fn(computation=computation)
+            except Halt:
+                break
+            finally:
+                used = before - computation.get_gas_remaining()
+                # read after the opcode, a DELEGATECALL gives the line of a forwarder its target
+                line = frame.line
+                stats = profile.lines[line]
+                stats.steps += 1
+                if mnemonic == 'SLOAD':
+                    stats.sload += 1
+                elif mnemonic == 'SSTORE':
+                    stats.sstore += 1
+                elif mnemonic in CALL_OPCODES:
+                    stats.calls += 1
+                    for child in computation.children[children:]:
+                        child_gas = child.get_gas_used()
+                        used -= child_gas
+                        stats.inclusive += child_gas
+                        callee = frame_of.get(id(child))
+                        # what a forwarder delegates is listed as part of the call to the forwarder
+                        if frame.contract != FORWARDER:
+                            label = callee.callee if callee is not None else UNKNOWN
+                            profile.calls.append(Call(line, mnemonic, label, child_gas))
+                stats.gas += used
+                stats.inclusive += used
+                profile.stacks[frame.here()] += used
+
+    def count_storage(computation, storage, mnemonic):
+        if not computation._stack.values:
+            return  # the opcode underflows the stack and fails
+        slot = computation._stack.values[-1][1]
+        if isinstance(slot, bytes):
+            slot = int.from_bytes(slot, 'big')
+        key = (computation.msg.storage_address, slot)
+        warm = key in touched
+        touched.add(key)
+        if mnemonic == 'SLOAD':
+            storage.sload += 1
+            storage.sload_warm += warm
+        else:
+            storage.sstore += 1
+            storage.sstore_warm += warm
+
+    BaseComputation.apply_computation = classmethod(apply_computation)
+    try:
+        yield profile
+    finally:
+        BaseComputation.apply_computation = original
+
+
+def profile_transaction(chain, call, sender=None, value=0):
+    """Send ``call`` like :meth:`LocalChain.transact` and return ``(receipt, Profile)``."""
+    profile = Profile()
+    with tracing(profile):
+        receipt = chain.transact(call, sender=sender, value=value)
+    return receipt, profile
+
+
+def profile_call(call):
+    """Run the constant ``call`` with ``eth_call`` and return ``(result, Profile)``."""
+    profile = Profile()
+    with tracing(profile):
+        result = call.call()
+    return result, profile
+
+
+class ProfilingRecorder(Recorder):
+    """A bench :class:`~naturaldao.bench.Recorder` that also profiles the labels starting with ``prefixes``."""
+
+    def __init__(self, chain, prefixes):
+        super().__init__(chain)
+        self.prefixes = tuple(prefixes)
+        self.profiles = {}
+
+    def wanted(self, label):
+        return label.startswith(self.prefixes)
+
+    def tx(self, label, call, sender=None, value=0):
+        if not self.wanted(label):
+            return super().tx(label, call, sender=sender, value=value)
+        profile = self.profiles[label] = Profile()
+        with tracing(profile):
+            return super().tx(label, call, sender=sender, value=value)
+
+    def send(self, label, to, sender, value):
+        if not self.wanted(label):
+            return super().send(label, to, sender, value)
+        profile = self.profiles[label] = Profile()
+        with tracing(profile):
+            return super().send(label, to, sender, value)
+
+    def view(self, label, call):
+        super().view(label, call)
+        if self.wanted(label):
+            # eth_estimateGas runs the call several times, profile one eth_call instead
+            self.profiles[label] = profile_call(call)[1]
@@ -0,0 +1,42 @@
+"""Usage: ``python -m naturaldao.profile [--limit N] [--folded PATH] LABEL...``"""
+import argparse
+import sys
+
+from naturaldao.bench import run
+from naturaldao.profile import ProfilingRecorder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Gas used by each source line in the bench scenarios.')
+    parser.add_argument('labels', nargs='+', metavar='LABEL',
+                        help='profile the scenarios whose label starts with LABEL')
+    parser.add_argument('--limit', type=int, default=30, help='number of lines shown per scenario')
+    parser.add_argument('--folded', help='write the stacks of every scenario to PATH for flamegraph.pl')
+    args = parser.parse_args(argv)
+
+    recorders = []
+
+    def recorder(chain):
+        recorders.append(ProfilingRecorder(chain, args.labels))
+        return recorders[-1]
+
+    gas = run(recorder)
+    profiles = recorders[0].profiles
+    if not profiles:
+        print('no scenario starts with %s' % ' or '.join(args.labels))
+        return 1
+    for label, profile in profiles.items():
+        print('== %s: %d gas' % (label, gas[label]))
+        print(profile.report(args.limit))
+        print()
+    if args.folded:
+        with open(args.folded, 'w') as f:
+            for label, profile in profiles.items():
+                for line in profile.folded().split('\n'):
+                    f.write('%s;%s\n' % (label, line))
+        print('folded stacks written to %s' % args.folded)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Storage reads, writes and external calls of every public function.
+
+Usage: ``python -m naturaldao.profile.storage [--json PATH] [CONTRACT...]``
+
+The static part reads the vyper sources with :mod:`ast`: for each public
+function it counts the ``self.<variable>`` expressions it reads and
+assigns, and lists the external calls with their target, the private
+functions it calls included.  A variable read three times is three
+``SLOAD`` of the same slot unless the compiler keeps it on the stack,
+which vyper 0.1 never does.
+
+The dynamic part traces every scenario of :mod:`naturaldao.bench` with
+:func:`naturaldao.profile.tracing` and adds the ``SLOAD``/``SSTORE`` the
+function really executed, per call, split into cold and warm accesses
+(the first access of a slot in the transaction and the later ones).
+``--json`` writes both so the counts can be compared from one commit to
+the next.
+"""
+import argparse
+import ast
+import collections
+import json
+import re
+import sys
+
+from naturaldao import CONTRACTS_DIR
+
+# the contract interfaces and structs are the only vyper syntax python cannot parse
+VYPER_CLASSES = re.compile(r'^(contract|struct) ', re.M)
+NOT_STORAGE = ('constant', 'event')
+EXTERNAL_BUILTINS = ('send', 'raw_call', 'create_forwarder_to')
+
+
+class Access:
+    """What one function reads, writes and calls, counted per occurrence in the source."""
+
+    def __init__(self):
+        self.reads = collections.Counter()
+        self.writes = collections.Counter()
+        self.calls = collections.Counter()
+        self.private = []
+
+    def add(self, other):
+        self.reads.update(other.reads)
+        self.writes.update(other.writes)
+        self.calls.update(other.calls)
+
+    def as_dict(self):
+        return {'reads': dict(self.reads), 'writes': dict(self.writes), 'calls': dict(self.calls)}
+
+
+def parse_contract(name):
+    return ast.parse(VYPER_CLASSES.sub('class ', (CONTRACTS_DIR / (name + '.py')).read_text()))
+
+
+def storage_variables(module):
+    variables = set()
+    for node in module.body:
+        if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            annotation = node.annotation
+            if isinstance(annotation, ast.Call) and getattr(annotation.func, 'id', None) in NOT_STORAGE:
+                continue
+            variables.add(node.target.id)
+    return variables
+
+
+def is_public(function):
+    return any(getattr(d, 'id', None) == 'public' for d in function.decorator_list)
+
+
+def render(node):
+    """Source text of the callee expressions, ``ast.unparse`` is python 3.9+."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return '%s.%s' % (render(node.value), node.attr)
+    if isinstance(node, ast.Subscript):
+        index = node.slice.value if isinstance(node.slice, ast.Index) else node.slice
+        return '%s[%s]' % (render(node.value), render(index))
+    if isinstance(node, ast.Call):
+        return '%s(%s)' % (render(node.func), ', '.join(render(arg) for arg in node.args))
+    return '...'
+
+
+def self_attribute(node):
+    """The ``self.x`` a target like ``self.x[a].field`` assigns, or None."""
+    while isinstance(node, (ast.Subscript, ast.Attribute)):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'self':
+            return node
+        node = node.value
+    return None
+
+
+def function_access(function, variables, functions):
+    access = Access()
+    written = {}
+    for node in ast.walk(function):
+        targets = ()
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        elif isinstance(node, (ast.AugAssign, ast.AnnAssign)):
+            targets = (node.target,)
+        for target in targets:
+            attribute = self_attribute(target)
+            if attribute is not None:
+                written[id(attribute)] = not isinstance(node, ast.AugAssign)
+    for node in ast.walk(function):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'self':
+            if node.attr in variables:
+                if id(node) in written:
+                    access.writes[node.attr] += 1
+                if not written.get(id(node)):
+                    # x += y reads x too
+                    access.reads[node.attr] += 1
+        elif isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Name) and func.id in EXTERNAL_BUILTINS:
+                access.calls['%s(%s)' % (func.id, render(node.args[0]) if node.args else '')] += 1
+            elif isinstance(func, ast.Attribute):
+                if isinstance(func.value, ast.Name) and func.value.id == 'self':
+                    if func.attr in functions:
+                        access.private.append(func.attr)
+                elif is_external(func.value, variables):
+                    access.calls[render(func)] += 1
+    return access
+
+
+def is_external(node, variables):
+    # Interface(address).fn() or self.interface_variable.fn()
+    if isinstance(node, ast.Call):
+        return isinstance(node.func, ast.Name) and node.func.id[:1].isupper()
+    return (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)
+            and node.value.id == 'self' and node.attr in variables)
+
+
+def static_access(name):
+    """Return ``{public function: Access}`` of contract ``name``, private callees included."""
+    module = parse_contract(name)
+    variables = storage_variables(module)
+    functions = {node.name: node for node in module.body if isinstance(node, ast.FunctionDef)}
+    own = {fn: function_access(node, variables, functions) for fn, node in functions.items()}
+
+    def total(fn, seen):
+        access = Access()
+        access.add(own[fn])
+        for callee in own[fn].private:
+            if callee not in seen:
+                access.add(total(callee, seen | {callee}))
+        return access
+
+    return {fn: total(fn, {fn}) for fn, node in functions.items() if is_public(node)}
+
+
+def traced_storage():
+    """Run the bench scenarios traced and return ``{'Contract.function': StorageStats}``."""
+    from naturaldao.bench import run
+    from naturaldao.profile import Profile, tracing
+
+    profile = Profile()
+    with tracing(profile):
+        run()
+    return profile.storage
+
+
+def report(contracts, static, traced):
+    out = []
+    for contract in contracts:
+        out.append('== %s' % contract)
+        for fn, access in sorted(static[contract].items()):
+            stats = traced.get('%s.%s' % (contract, fn))
+            if stats is None or not stats.runs:
+                measured = 'not run by the bench'
+            else:
+                measured = '%d runs, per run SLOAD %.1f (%.1f warm) SSTORE %.1f (%.1f warm)' % (
+                    stats.runs, stats.sload / stats.runs, stats.sload_warm / stats.runs,
+                    stats.sstore / stats.runs, stats.sstore_warm / stats.runs)
+            out.append('%s  [%s]' % (fn, measured))
+            for kind, counter in (('reads', access.reads), ('writes', access.writes), ('calls', access.calls)):
+                if counter:
+                    out.append('    %-7s %s' % (kind, ', '.join(
+                        '%s x%d' % (item, n) if n > 1 else item for item, n in sorted(counter.items()))))
+        out.append('')
+    return '\n'.join(out)
+
+
+def as_json(contracts, static, traced):
+    result = {}
+    for contract in contracts:
+        for fn, access in static[contract].items():
+            label = '%s.%s' % (contract, fn)
+            entry = result[label] = access.as_dict()
+            stats = traced.get(label)
+            if stats is not None and stats.runs:
+                entry['traced'] = {
+                    'runs': stats.runs, 'sload': stats.sload, 'sload_warm': stats.sload_warm,
+                    'sstore': stats.sstore, 'sstore_warm': stats.sstore_warm}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Storage accesses and external calls of the public functions.')
+    parser.add_argument('contracts', nargs='*', metavar='CONTRACT',
+                        help='contract names, all of contracts/ by default')
+    parser.add_argument('--static', action='store_true', help='only read the sources, trace nothing')
+    parser.add_argument('--json', help='also write the report to PATH as JSON')
+    args = parser.parse_args(argv)
+
+    contracts = args.contracts or sorted(path.stem for path in CONTRACTS_DIR.glob('*.py'))
+    static = {contract: static_access(contract) for contract in contracts}
+    traced = {} if args.static else traced_storage()
+    print(report(contracts, static, traced))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(as_json(contracts, static, traced), f, indent=1, sort_keys=True)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
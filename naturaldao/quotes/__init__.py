@@ -0,0 +1,304 @@
+"""Quotes of every factory exchange from reserves cached in process.
+
+:class:`QuoteService` finds the exchanges in the ``NewExchange`` logs of
+the factory and prices trades with :mod:`naturaldao.sim.pricing`, the
+formulas of ``Exchange.getInputPrice``/``getOutputPrice``, so a quote
+costs no RPC request at all once the reserves of its exchange are
+cached.  The reserves are read with ``eth_call`` the first time an
+exchange is quoted and dropped when :meth:`QuoteService.sync` sees a
+``TokenPurchase``, ``NdaoPurchase``, ``TokenToTokenPurchase`` or ``Sync``
+log of that exchange in a later block; every function that moves the
+reserves logs one of them.
+
+Reserves are always read at the last block synced, never at ``latest``:
+a log newer than that block is then exactly the one that makes the entry
+stale, whatever happened between the read and the next sync.  Quotes are
+as old as the last sync, :meth:`QuoteService.follow` keeps it recent.
+
+On a reorg the service rewinds to the last synced head still on the
+chain, like :meth:`naturaldao.indexer.Indexer.handle_reorg`: the
+exchanges registered and the reserves read after it are dropped and the
+logs are processed again from there.
+
+:attr:`QuoteService.metrics` counts the hits and misses, the entries
+dropped and the quotes served from reserves a later sync found changed.
+Talks to the node through :class:`naturaldao.client.Client`, so the
+reads of several exchanges missing at once go out as one batch.
+``python -m naturaldao.quotes`` follows a node and prints the metrics.
+"""
+import asyncio
+import collections
+
+from eth_utils import encode_hex, event_abi_to_log_topic, keccak, to_checksum_address
+
+from naturaldao.client import to_int
+from naturaldao.indexer import ADDRESS_CHUNK, EXCHANGE_EVENTS, NEW_EXCHANGE
+from naturaldao.sim.pricing import Revert, get_input_price, get_output_price
+
+# the directions of Exchange.getPrice
+NDAO_TO_TOKEN_INPUT = 0
+NDAO_TO_TOKEN_OUTPUT = 1
+TOKEN_TO_NDAO_INPUT = 2
+TOKEN_TO_NDAO_OUTPUT = 3
+
+TOKEN_RESERVE = keccak(text='tokenReserve()')[:4]
+NDAO_RESERVE = keccak(text='ndaoReserve()')[:4]
+GET_MAX_POOL = keccak(text='getMaxPool()')[:4]
+
+# number of synced heads kept to find where a reorg forked
+KEEP_HEADS = 64
+
+
+class Reserves:
+    """Cached state of one exchange, ``block`` is the block it was read at (None: not cached).
+
+    ``created`` is the block of the ``NewExchange`` log that registered it.
+    """
+
+    __slots__ = ('token', 'created', 'token_reserve', 'ndao_reserve', 'max_pool', 'block', 'loading')
+
+    def __init__(self, token, created):
+        self.token = token
+        self.created = created
+        self.token_reserve = self.ndao_reserve = self.max_pool = 0
+        self.block = None
+        self.loading = None
+
+
+class Metrics:
+    """Counters of a :class:`QuoteService`."""
+
+    __slots__ = ('hits', 'misses', 'invalidations', 'stale_quotes', 'reorgs', 'syncs', 'lag_blocks')
+
+    def __init__(self):
+        self.hits = self.misses = self.invalidations = self.stale_quotes = 0
+        self.reorgs = self.syncs = 0
+        # blocks the chain moved between the last two syncs, i.e. how old quotes could get
+        self.lag_blocks = 0
+
+    @property
+    def hit_rate(self):
+        quotes = self.hits + self.misses
+        return self.hits / quotes if quotes else 0.0
+
+    def as_dict(self):
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result['hit_rate'] = self.hit_rate
+        return result
+
+
+class QuoteService:
+    """Quote the exchanges of ``factory`` through ``client``, from block ``start_block`` on."""
+
+    def __init__(self, client, factory, start_block=0):
+        self.client = client
+        self.factory = to_checksum_address(factory)
+        self.start_block = start_block
+        self.head = None
+        self.head_hash = None
+        # (number, hash) of the last synced heads, oldest first
+        self.heads = collections.deque(maxlen=KEEP_HEADS)
+        self.exchanges = {}
+        self.exchange_of = {}
+        # quotes served per exchange since the last sync, stale if the sync drops the exchange
+        self.served = collections.Counter()
+        self.metrics = Metrics()
+        self.new_exchange_topic = encode_hex(event_abi_to_log_topic(NEW_EXCHANGE))
+
+    # ---- following the chain ----
+
+    async def sync(self):
+        """Process the logs up to the current block and return it."""
+        head = await self.client.block_number()
+        # hash first: if the head reorgs while its logs are fetched, the next sync rewinds past it
+        block = await self.client.request('eth_getBlockByNumber', hex(head), False)
+        if self.heads:
+            await self.handle_reorg()
+        from_block = self.start_block if self.head is None else self.head + 1
+        if head >= from_block:
+            await self.process_logs(from_block, head)
+        self.metrics.syncs += 1
+        self.metrics.lag_blocks = 0 if self.head is None else head - self.head
+        self.head, self.head_hash = head, block['hash']
+        self.heads.append((head, block['hash']))
+        self.served.clear()
+        return head
+
+    async def follow(self, poll_interval=2.0, on_sync=None):
+        """Call :meth:`sync` forever, sleeping ``poll_interval`` seconds in between."""
+        while True:
+            head = await self.sync()
+            if on_sync is not None:
+                on_sync(head)
+            await asyncio.sleep(poll_interval)
+
+    # ---- reorgs ----
+
+    async def handle_reorg(self):
+        """Rewind past any synced head whose block is no longer on the chain.
+
+        Returns the block rewound to, or ``None`` when nothing changed.
+        """
+        for i, (number, block_hash) in enumerate(reversed(self.heads)):
+            block = await self.client.request('eth_getBlockByNumber', hex(number), False)
+            if block is not None and block['hash'] == block_hash:
+                if i == 0:
+                    return None
+                self.rewind(number, block_hash)
+                return number
+        # forked below every head kept, start over
+        self.rewind(self.start_block - 1, None)
+        return self.start_block - 1
+
+    def rewind(self, block_number, block_hash):
+        """Forget the exchanges registered and the reserves read after ``block_number``."""
+        self.metrics.reorgs += 1
+        while self.heads and self.heads[-1][0] > block_number:
+            self.heads.pop()
+        self.invalidate([exchange for exchange, reserves in self.exchanges.items()
+                         if reserves.created > block_number or (reserves.block or 0) > block_number])
+        for exchange, reserves in list(self.exchanges.items()):
+            if reserves.created > block_number:
+                del self.exchanges[exchange]
+                if self.exchange_of.get(reserves.token) == exchange:
+                    del self.exchange_of[reserves.token]
+        self.head, self.head_hash = block_number, block_hash
+
+    # ---- logs ----
+
+    async def process_logs(self, from_block, to_block):
+        new = await self.get_logs(from_block, to_block, self.factory, [self.new_exchange_topic])
+        for log in new:
+            token, exchange = (topic_address(t) for t in log['topics'][1:3])
+            self.exchanges[exchange] = Reserves(token, to_int(log['blockNumber']))
+            self.exchange_of[token] = exchange
+        exchanges = list(self.exchanges)
+        topics = [list(EXCHANGE_EVENTS)]
+        requests = [self.get_logs(from_block, to_block, exchanges[i:i + ADDRESS_CHUNK], topics)
+                    for i in range(0, len(exchanges), ADDRESS_CHUNK)]
+        changed = set()
+        for logs in await asyncio.gather(*requests):
+            for log in logs:
+                exchange = to_checksum_address(log['address'])
+                cached = self.exchanges[exchange].block
+                # a read at or after the block of the log already includes it
+                if cached is not None and to_int(log['blockNumber']) > cached:
+                    changed.add(exchange)
+        self.invalidate(changed)
+
+    async def get_logs(self, from_block, to_block, address, topics):
+        return await self.client.request('eth_getLogs', {
+            'fromBlock': hex(from_block), 'toBlock': hex(to_block), 'address': address, 'topics': topics})
+
+    def invalidate(self, exchanges):
+        for exchange in exchanges:
+            reserves = self.exchanges[exchange]
+            if reserves.block is not None:
+                reserves.block = None
+                self.metrics.invalidations += 1
+                self.metrics.stale_quotes += self.served[exchange]
+
+    # ---- reserves ----
+
+    async def reserves(self, exchange):
+        """Return the :class:`Reserves` of ``exchange`` as of the last sync, reading them if needed."""
+        if self.head is None:
+            await self.sync()
+        exchange = to_checksum_address(exchange)
+        reserves = self.exchanges.get(exchange)
+        if reserves is None:
+            raise KeyError('%s is not an exchange of the factory' % exchange)
+        if reserves.block is not None:
+            self.metrics.hits += 1
+        else:
+            self.metrics.misses += 1
+            if reserves.loading is None:
+                reserves.loading = asyncio.ensure_future(self.load(exchange, reserves))
+            await asyncio.shield(reserves.loading)
+        self.served[exchange] += 1
+        return reserves
+
+    async def load(self, exchange, reserves):
+        block, block_hash = self.head, self.head_hash
+        try:
+            calls = [self.client.call(exchange, TOKEN_RESERVE, block=block),
+                     self.client.call(exchange, NDAO_RESERVE, block=block)]
+            if not reserves.max_pool:
+                # set once by Exchange.setup
+                calls.append(self.client.call(exchange, GET_MAX_POOL, block=block))
+            # the forwarders return 4096 bytes whatever the function returns
+            values = [int.from_bytes(v[:32], 'big') for v in await asyncio.gather(*calls)]
+            reserves.token_reserve, reserves.ndao_reserve = values[:2]
+            if len(values) == 3:
+                reserves.max_pool = values[2]
+            if self.head_hash == block_hash:
+                reserves.block = block
+            # else a sync ran meanwhile and its logs were not checked against this read
+        finally:
+            reserves.loading = None
+
+    def exchange(self, token):
+        """The exchange of ``token``, as registered with the factory."""
+        return self.exchange_of[to_checksum_address(token)]
+
+    # ---- quotes ----
+
+    async def ndao_to_token_input(self, exchange, ndao_sold):
+        """``Exchange.getNdaoToTokenInputPrice``."""
+        r = await self.reserves(exchange)
+        require(ndao_sold > 0)
+        return get_input_price(ndao_sold, r.ndao_reserve, r.token_reserve)
+
+    async def ndao_to_token_output(self, exchange, tokens_bought):
+        """``Exchange.getNdaoToTokenOutputPrice``."""
+        r = await self.reserves(exchange)
+        require(tokens_bought > 0)
+        return get_output_price(tokens_bought, r.ndao_reserve, r.token_reserve)
+
+    async def token_to_ndao_input(self, exchange, tokens_sold):
+        """``Exchange.getTokenToNdaoInputPrice``; like it, ignores ``maxPool``."""
+        r = await self.reserves(exchange)
+        require(tokens_sold > 0)
+        return get_input_price(tokens_sold, r.token_reserve, r.ndao_reserve)
+
+    async def token_to_ndao_output(self, exchange, ndao_bought):
+        """``Exchange.getTokenToNdaoOutputPrice``."""
+        r = await self.reserves(exchange)
+        require(ndao_bought > 0)
+        return get_output_price(ndao_bought, r.token_reserve, r.ndao_reserve)
+
+    async def quote(self, exchange, amount, direction):
+        """``Exchange.getPrice``: 0 instead of :class:`Revert` where the trade can not happen or overflows."""
+        require(direction <= TOKEN_TO_NDAO_OUTPUT)
+        r = await self.reserves(exchange)
+        if amount == 0 or r.token_reserve == 0 or r.ndao_reserve == 0:
+            return 0
+        try:
+            if direction == NDAO_TO_TOKEN_INPUT:
+                return get_input_price(amount, r.ndao_reserve, r.token_reserve)
+            if direction == NDAO_TO_TOKEN_OUTPUT:
+                return get_output_price(amount, r.ndao_reserve, r.token_reserve)
+            if direction == TOKEN_TO_NDAO_INPUT:
+                return get_input_price(amount, r.token_reserve, r.ndao_reserve)
+            return get_output_price(amount, r.token_reserve, r.ndao_reserve)
+        except Revert:
+            # an amount beyond the reserve or a uint256 overflow
+            return 0
+
+    async def token_to_token_input(self, src, dst, tokens_sold):
+        """Tokens of exchange ``dst`` that ``tokenToExchangeSwapInput`` on ``src`` buys, ``maxPool`` included."""
+        source, target = await asyncio.gather(self.reserves(src), self.reserves(dst))
+        require(tokens_sold > 0, 'nothing sold')
+        require(source.token_reserve + tokens_sold <= source.max_pool, 'the pool is full')
+        ndao_bought = get_input_price(tokens_sold, source.token_reserve, source.ndao_reserve)
+        require(ndao_bought > 0, 'nothing bought')
+        return get_input_price(ndao_bought, target.ndao_reserve, target.token_reserve)
+
+
+def require(condition, reason='assert failed'):
+    if not condition:
+        raise Revert(reason)
+
+
+def topic_address(topic):
+    return to_checksum_address('0x' + topic[-40:])
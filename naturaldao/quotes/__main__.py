@@ -0,0 +1,37 @@
+"""Usage: ``python -m naturaldao.quotes --rpc URL --factory ADDRESS [--poll-interval SECONDS]``"""
+import argparse
+import asyncio
+import json
+import sys
+
+from naturaldao.client import Client, HTTPTransport
+from naturaldao.quotes import QuoteService
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Follow the exchanges of a factory and print the quote cache metrics.')
+    parser.add_argument('--rpc', required=True, help='HTTP JSON-RPC endpoint')
+    parser.add_argument('--factory', required=True, help='address of the factory')
+    parser.add_argument('--start-block', type=int, default=0, help='block the factory was deployed in')
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    client = Client(HTTPTransport(args.rpc))
+    service = QuoteService(client, args.factory, start_block=args.start_block)
+
+    def report(block):
+        print(json.dumps(dict(service.metrics.as_dict(), block=block, exchanges=len(service.exchanges))),
+              flush=True)
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(service.follow(args.poll_interval, on_sync=report))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(client.close())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
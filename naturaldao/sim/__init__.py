@@ -0,0 +1,21 @@
+"""Integer-exact simulator of the Exchange/Factory contracts.
+
+Pricing, asserts and reserve updates follow ``contracts/Exchange.py`` and
+``contracts/Factory.py`` wei for wei, vectorized over many exchanges with
+numpy.  ``python -m naturaldao.sim.crosscheck`` replays random trades on
+both the simulator and the compiled contracts and compares them.
+
+Example::
+
+    from naturaldao.sim import Pools
+    pools = Pools([10 ** 21] * 1000, [2 * 10 ** 11] * 1000, [2 * 10 ** 21] * 1000)
+    tokens_bought, ok = pools.ndao_to_token_input(10 ** 8)
+"""
+from naturaldao.sim.pools import Pools
+from naturaldao.sim.pricing import MAX_NDAO, MAX_UINT256, Revert, get_input_price, get_output_price, input_prices, output_prices
+from naturaldao.sim.universe import Universe
+
+__all__ = [
+    'MAX_NDAO', 'MAX_UINT256', 'Pools', 'Revert', 'Universe',
+    'get_input_price', 'get_output_price', 'input_prices', 'output_prices',
+]
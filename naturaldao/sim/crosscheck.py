@@ -0,0 +1,168 @@
+"""Replay random trades on the simulator and on the compiled contracts.
+
+Usage: ``python -m naturaldao.sim.crosscheck [--markets N] [--steps N] [--seed N]``
+
+Every step picks a trade, runs it through :class:`~naturaldao.sim.Universe`
+and through the deployed exchanges, and compares whether it reverted, the
+amount returned and the reserves of every exchange afterwards.  The
+simulator has no balances, so amounts are cut down to what the trader
+can pay; after a mismatch its reserves are reloaded from the contracts,
+so that one divergence is reported once.  Needs the same toolchain as
+:mod:`naturaldao.chain`.
+"""
+import argparse
+import random
+import sys
+
+from naturaldao.chain import LocalChain, deploy_system, launch_market
+from naturaldao.sim.pricing import Revert, get_output_price
+from naturaldao.sim.universe import Universe
+
+TRADES = (
+    'ndaoToTokenSwapInput', 'ndaoToTokenSwapOutput', 'tokenToNdaoSwapInput',
+    'tokenToNdaoSwapOutput', 'tokenToTokenSwapInput', 'tokenToTokenSwapOutput',
+)
+
+
+def random_amount(rng, reserve):
+    """Log-uniform amount between 1 and about the reserve."""
+    return max(1, int(reserve * 10 ** rng.uniform(-9, 0.05)))
+
+
+def random_bound(rng, expected, is_min):
+    """A bound that is usually loose and sometimes just too tight."""
+    if rng.random() < 0.8:
+        return 1 if is_min else expected * 2 + 1
+    return expected + 1 if is_min else max(expected - 1, 1)
+
+
+def affordable(amount, cost, balance):
+    """Halve ``amount`` until ``cost(amount)``, what buying it sells, fits in ``balance``, 0 if nothing does."""
+    while amount > 0:
+        try:
+            if cost(amount) <= balance:
+                break
+        except Revert:
+            break  # reverts whatever the balance, keep it as it is
+        amount //= 2
+    return amount
+
+
+def run(markets=3, steps=200, seed=0, out=sys.stdout):
+    rng = random.Random(seed)
+    chain = LocalChain()
+    system = deploy_system(chain)
+    trader = chain.accounts[9]
+    universe = Universe()
+    icos, exchanges = [], []
+    for i in range(markets):
+        creator = chain.accounts[1 + i]
+        ico, exchange = launch_market(chain, system, creator, name='T%d' % i)
+        universe.create_exchange(ico.address, ico.functions.totalSupply().call() - ico.functions.balanceOf(creator).call(),
+                                 ico.functions.depositGoal().call())
+        chain.transact(ico.functions.transfer(trader, ico.functions.balanceOf(creator).call()), sender=creator)
+        chain.transact(system.ndao.functions.transfer(trader, system.ndao.functions.balanceOf(creator).call()), sender=creator)
+        chain.transact(ico.functions.approve(exchange.address, 2 ** 256 - 1), sender=trader)
+        chain.transact(system.ndao.functions.approve(exchange.address, 2 ** 256 - 1), sender=trader)
+        icos.append(ico)
+        exchanges.append(exchange)
+
+    mismatches = 0
+    for step in range(steps):
+        mismatches += compare_reserves(step, universe, exchanges, out)
+        name = rng.choice(TRADES)
+        src = rng.randrange(markets)
+        dst = rng.choice([i for i in range(markets) if i != src] or [src])
+        pools = universe.pools
+        token_reserve, ndao_reserve = pools.token_reserve, pools.ndao_reserve
+        deadline = chain.timestamp + 3600
+        ndao_balance = system.ndao.functions.balanceOf(trader).call()
+        token_balance = icos[src].functions.balanceOf(trader).call()
+        if name == 'ndaoToTokenSwapInput':
+            amount = min(random_amount(rng, pools.ndao_reserve[src]), ndao_balance)
+            quote = exchanges[src].functions.getPrice(amount, 0).call()
+            bound = random_bound(rng, quote, True)
+            args = (amount, bound, deadline)
+            expected, ok = pools.ndao_to_token_input(amount, bound, index=src)
+        elif name == 'ndaoToTokenSwapOutput':
+            amount = affordable(random_amount(rng, pools.token_reserve[src]), lambda a: get_output_price(
+                a, ndao_reserve[src], token_reserve[src]), ndao_balance)
+            quote = exchanges[src].functions.getPrice(amount, 1).call()
+            bound = random_bound(rng, quote, False)
+            args = (amount, bound, deadline)
+            expected, ok = pools.ndao_to_token_output(amount, bound, index=src)
+        elif name == 'tokenToNdaoSwapInput':
+            amount = min(random_amount(rng, pools.token_reserve[src]), token_balance)
+            quote = exchanges[src].functions.getPrice(amount, 2).call()
+            bound = random_bound(rng, quote, True)
+            args = (amount, bound, deadline)
+            expected, ok = pools.token_to_ndao_input(amount, bound, index=src)
+        elif name == 'tokenToNdaoSwapOutput':
+            amount = affordable(random_amount(rng, pools.ndao_reserve[src]), lambda a: get_output_price(
+                a, token_reserve[src], ndao_reserve[src]), token_balance)
+            quote = exchanges[src].functions.getPrice(amount, 3).call()
+            bound = random_bound(rng, quote, False)
+            args = (amount, bound, deadline)
+            expected, ok = pools.token_to_ndao_output(amount, bound, index=src)
+        elif name == 'tokenToTokenSwapInput':
+            amount = min(random_amount(rng, pools.token_reserve[src]), token_balance)
+            args = (amount, 1, 1, deadline, icos[dst].address)
+            expected, ok = universe.token_to_token_input(src + 1, dst + 1, amount, 1, 1)
+        else:
+            amount = affordable(random_amount(rng, pools.token_reserve[dst]), lambda a: get_output_price(
+                get_output_price(a, ndao_reserve[dst], token_reserve[dst]), token_reserve[src], ndao_reserve[src]),
+                token_balance)
+            args = (amount, 2 ** 255, 2 ** 255, deadline, icos[dst].address)
+            expected, ok = universe.token_to_token_output(src + 1, dst + 1, amount, 2 ** 255, 2 ** 255)
+        call = getattr(exchanges[src].functions, name)(*args)
+        try:
+            result = call.call({'from': trader})
+            chain.transact(call, sender=trader)
+            reverted = False
+        except Exception:
+            result, reverted = 0, True
+        if reverted == bool(ok[0]) or result != expected[0]:
+            mismatches += 1
+            print('step %d %s%r: contract %s, simulator %s' % (
+                step, name, args, 'reverted' if reverted else result, expected[0] if ok[0] else 'reverted'), file=out)
+            load_reserves(universe, contract_reserves(exchanges))
+    mismatches += compare_reserves(steps, universe, exchanges, out)
+    print('%d steps on %d exchanges, %d mismatches' % (steps, markets, mismatches), file=out)
+    return mismatches
+
+
+def contract_reserves(exchanges):
+    return [(e.functions.tokenReserve().call(), e.functions.ndaoReserve().call()) for e in exchanges]
+
+
+def load_reserves(universe, reserves):
+    """Set the reserves of the simulator to ``reserves``, one ``(token, ndao)`` per exchange."""
+    for i, (token_reserve, ndao_reserve) in enumerate(reserves):
+        universe.pools.token_reserve[i] = token_reserve
+        universe.pools.ndao_reserve[i] = ndao_reserve
+
+
+def compare_reserves(step, universe, exchanges, out):
+    mismatches = 0
+    reserves = contract_reserves(exchanges)
+    for i, actual in enumerate(reserves):
+        simulated = (universe.pools.token_reserve[i], universe.pools.ndao_reserve[i])
+        if actual != simulated:
+            mismatches += 1
+            print('step %d exchange %d: contract reserves %r, simulator %r' % (step, i, actual, simulated), file=out)
+    if mismatches:
+        load_reserves(universe, reserves)
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--markets', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    return 1 if run(args.markets, args.steps, args.seed) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
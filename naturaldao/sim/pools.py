@@ -0,0 +1,113 @@
+"""Reserves of many exchanges, traded in vectorized batches.
+
+Each swap function mirrors the private swap of the same name in
+``contracts/Exchange.py``: the same asserts, the same pricing and the
+same reserve updates.  The pure ``swap_*`` functions return the new
+reserves without storing them so that two-pool trades can be composed;
+:class:`Pools` applies them to the rows whose trade did not revert.
+
+The NDAO an exchange receives must keep its NDAO balance within
+:data:`~naturaldao.sim.pricing.MAX_NDAO`; the reserve stands in for that
+balance, which is exact until someone transfers NDAO to the exchange
+outside a trade.  The balances of the traders, and so the same limit on
+the NDAO they receive, are not modelled.
+"""
+import numpy as np
+
+from naturaldao.sim.pricing import MAX_NDAO, MAX_UINT256, input_prices, output_prices, uint256_array
+
+
+def swap_ndao_to_token_input(token_reserve, ndao_reserve, ndao_sold, min_tokens):
+    """``ndaoToTokenInput``: returns ``(tokens_bought, token_reserve, ndao_reserve, ok)``."""
+    tokens_bought, ok = input_prices(ndao_sold, ndao_reserve, token_reserve)
+    ok &= (ndao_sold > 0) & (min_tokens > 0) & (tokens_bought >= min_tokens)
+    new_ndao = ndao_reserve + ndao_sold
+    ok &= new_ndao <= MAX_NDAO
+    return tokens_bought, token_reserve - tokens_bought, new_ndao, ok
+
+
+def swap_ndao_to_token_output(token_reserve, ndao_reserve, tokens_bought, max_ndao):
+    """``ndaoToTokenOutput``: returns ``(ndao_sold, token_reserve, ndao_reserve, ok)``."""
+    ndao_sold, ok = output_prices(tokens_bought, ndao_reserve, token_reserve)
+    ok &= (tokens_bought > 0) & (max_ndao > 0) & (ndao_sold <= max_ndao)
+    new_ndao = ndao_reserve + ndao_sold
+    ok &= new_ndao <= MAX_NDAO
+    return ndao_sold, np.where(ok, token_reserve - tokens_bought, token_reserve), new_ndao, ok
+
+
+def swap_token_to_ndao_input(token_reserve, ndao_reserve, max_pool, tokens_sold, min_ndao):
+    """``tokenToNdaoInput``: returns ``(ndao_bought, token_reserve, ndao_reserve, ok)``."""
+    new_token = token_reserve + tokens_sold
+    ok = (tokens_sold > 0) & (min_ndao > 0) & (new_token <= max_pool)
+    ndao_bought, priced = input_prices(tokens_sold, token_reserve, ndao_reserve)
+    ok &= priced & (ndao_bought >= min_ndao)
+    return ndao_bought, new_token, ndao_reserve - ndao_bought, ok
+
+
+def swap_token_to_ndao_output(token_reserve, ndao_reserve, max_pool, ndao_bought, max_tokens):
+    """``tokenToNdaoOutput``: returns ``(tokens_sold, token_reserve, ndao_reserve, ok)``."""
+    tokens_sold, ok = output_prices(ndao_bought, token_reserve, ndao_reserve)
+    new_token = token_reserve + tokens_sold
+    ok &= (ndao_bought > 0) & (new_token <= max_pool) & (max_tokens >= tokens_sold)
+    return tokens_sold, new_token, np.where(ok, ndao_reserve - ndao_bought, ndao_reserve), ok
+
+
+class Pools:
+    """Token and NDAO reserves plus ``maxPool`` of a set of exchanges.
+
+    Every trade method takes ``index``, the rows to trade on (all rows by
+    default, each at most once per batch), and amounts broadcast against
+    it.  It returns ``(amounts, ok)``; rows where ``ok`` is False would
+    have reverted and are left untouched.
+    """
+
+    def __init__(self, token_reserve=(), ndao_reserve=(), max_pool=()):
+        self.token_reserve = uint256_array(token_reserve)
+        self.ndao_reserve = uint256_array(ndao_reserve)
+        self.max_pool = uint256_array(max_pool)
+        if not len(self.token_reserve) == len(self.ndao_reserve) == len(self.max_pool):
+            raise ValueError('reserves and max_pool must have the same length')
+
+    def __len__(self):
+        return len(self.token_reserve)
+
+    def add(self, token_reserve, ndao_reserve, max_pool):
+        """Append one exchange and return its row."""
+        self.token_reserve = np.append(self.token_reserve, uint256_array(token_reserve))
+        self.ndao_reserve = np.append(self.ndao_reserve, uint256_array(ndao_reserve))
+        self.max_pool = np.append(self.max_pool, uint256_array(max_pool))
+        return len(self) - 1
+
+    def rows(self, index=None):
+        if index is None:
+            return np.arange(len(self))
+        index = np.array(index, dtype=np.int64, ndmin=1)
+        if len(np.unique(index)) != len(index):
+            raise ValueError('an exchange can only trade once per batch')
+        return index
+
+    def commit(self, index, token_reserve, ndao_reserve, ok):
+        self.token_reserve[index] = np.where(ok, token_reserve, self.token_reserve[index])
+        self.ndao_reserve[index] = np.where(ok, ndao_reserve, self.ndao_reserve[index])
+
+    def _trade(self, swap, index, *args, with_max_pool=False):
+        index = self.rows(index)
+        reserves = [self.token_reserve[index], self.ndao_reserve[index]]
+        if with_max_pool:
+            reserves.append(self.max_pool[index])
+        args = [np.broadcast_to(uint256_array(arg), index.shape) for arg in args]
+        amount, token_reserve, ndao_reserve, ok = swap(*reserves, *args)
+        self.commit(index, token_reserve, ndao_reserve, ok)
+        return np.where(ok, amount, 0), ok
+
+    def ndao_to_token_input(self, ndao_sold, min_tokens=1, index=None):
+        return self._trade(swap_ndao_to_token_input, index, ndao_sold, min_tokens)
+
+    def ndao_to_token_output(self, tokens_bought, max_ndao=MAX_UINT256, index=None):
+        return self._trade(swap_ndao_to_token_output, index, tokens_bought, max_ndao)
+
+    def token_to_ndao_input(self, tokens_sold, min_ndao=1, index=None):
+        return self._trade(swap_token_to_ndao_input, index, tokens_sold, min_ndao, with_max_pool=True)
+
+    def token_to_ndao_output(self, ndao_bought, max_tokens=MAX_UINT256, index=None):
+        return self._trade(swap_token_to_ndao_output, index, ndao_bought, max_tokens, with_max_pool=True)
@@ -0,0 +1,73 @@
+"""Exact constant-product pricing, as in ``Exchange.getInputPrice``/``getOutputPrice``.
+
+Amounts are arbitrary precision integers held in numpy ``object`` arrays,
+so every result matches the contract to the last wei.  Where the contract
+would revert (an ``assert`` or a uint256 overflow) the scalar functions
+raise :class:`Revert` and the vector functions clear the returned ``ok``
+mask and report 0.
+
+``NDAOToken`` keeps balances and the total supply in 96 bits and reverts
+above :data:`MAX_NDAO`; the swaps of :mod:`naturaldao.sim.pools` check
+the NDAO reserve they grow against it.
+"""
+import numpy as np
+
+MAX_UINT256 = 2 ** 256 - 1
+# NDAOToken.MASK_96
+MAX_NDAO = 2 ** 96 - 1
+
+
+class Revert(Exception):
+    """The contract call would revert."""
+
+
+def uint256_array(values):
+    """Return ``values`` as a 1-d numpy array of Python ints."""
+    array = np.array(values, dtype=object, ndmin=1)
+    if array.ndim != 1:
+        raise ValueError('expected a 1-d sequence of amounts')
+    return array
+
+
+def get_input_price(input_amount, input_reserve, output_reserve):
+    """Scalar ``Exchange.getInputPrice``."""
+    if not (input_reserve > 0 and output_reserve > 0):
+        raise Revert('empty reserve')
+    numerator = input_amount * output_reserve
+    denominator = input_reserve + input_amount
+    if numerator > MAX_UINT256 or denominator > MAX_UINT256:
+        raise Revert('uint256 overflow')
+    return numerator // denominator
+
+
+def get_output_price(output_amount, input_reserve, output_reserve):
+    """Scalar ``Exchange.getOutputPrice``, including its ``+ 1`` rounding."""
+    if not (input_reserve > 0 and output_reserve > 0 and output_reserve > output_amount):
+        raise Revert('empty reserve or output beyond reserve')
+    numerator = input_reserve * output_amount
+    if numerator > MAX_UINT256:
+        raise Revert('uint256 overflow')
+    return numerator // (output_reserve - output_amount) + 1
+
+
+def input_prices(input_amount, input_reserve, output_reserve):
+    """Vector ``getInputPrice`` over broadcast arrays, returns ``(price, ok)``."""
+    input_amount, input_reserve, output_reserve = np.broadcast_arrays(
+        uint256_array(input_amount), uint256_array(input_reserve), uint256_array(output_reserve))
+    ok = (input_reserve > 0) & (output_reserve > 0)
+    numerator = input_amount * output_reserve
+    denominator = input_reserve + input_amount
+    ok &= (numerator <= MAX_UINT256) & (denominator <= MAX_UINT256)
+    price = numerator // np.where(ok, denominator, 1)
+    return np.where(ok, price, 0), ok
+
+
+def output_prices(output_amount, input_reserve, output_reserve):
+    """Vector ``getOutputPrice`` over broadcast arrays, returns ``(price, ok)``."""
+    output_amount, input_reserve, output_reserve = np.broadcast_arrays(
+        uint256_array(output_amount), uint256_array(input_reserve), uint256_array(output_reserve))
+    ok = (input_reserve > 0) & (output_reserve > output_amount)
+    numerator = input_reserve * output_amount
+    ok &= numerator <= MAX_UINT256
+    price = numerator // np.where(ok, output_reserve - output_amount, 1) + 1
+    return np.where(ok, price, 0), ok
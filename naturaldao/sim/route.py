@@ -0,0 +1,194 @@
+"""Split a large order over the routes between two tokens of the NDAO hub.
+
+Every exchange pairs one token with NDAO, so a route is the list of
+tokens an order passes through, ``NDAO`` included where it starts or
+ends there: ``[A, B]`` is one ``tokenToExchangeSwapInput`` on the
+exchange of A, ``[A, C, B]`` adds a detour through the exchange of C.
+:func:`solve` hands the order out in ``chunks`` pieces, each to the
+route that buys the most with it given what the earlier pieces did to
+the reserves, then merges the pieces of each route into one call per hop
+and prices the merged plan again from the original reserves.
+
+The exchanges charge no fee, so a detour sells back through C the NDAO
+it bought there, less rounding, and never beats the direct route; the
+solver prices the detours anyway and the plan shows they lost.  What the
+split does decide is how much to sell now: ``maxPool`` caps what the
+exchange of the token sold takes, and what no route can take is returned
+as :attr:`Plan.unfilled`, for a later slice once the pool has room.
+
+Example::
+
+    markets = {exchange_a: (token_reserve, ndao_reserve, max_pool), ...}
+    plan = solve(markets, exchange_a, exchange_b, 10 ** 24, deadline=deadline)
+    for call in plan.calls:
+        client.contract('Exchange', call.exchange).transact(call.function, *call.args, sender=trader)
+"""
+from collections import ChainMap, namedtuple
+
+from naturaldao.sim.pricing import Revert, get_input_price
+
+NDAO = 'NDAO'
+BPS = 10000
+
+# amount_out is the least the calls accept, what they buy when slippage_bps is 0
+Call = namedtuple('Call', 'exchange function args amount_in amount_out')
+Plan = namedtuple('Plan', 'calls amount_in amount_out unfilled')
+
+
+def hop(reserves, src, dst, amount):
+    """Sell ``amount`` of ``src`` for ``dst`` with the asserts of the exchanges, updating ``reserves``."""
+    if amount <= 0:
+        raise Revert('nothing sold')
+    ndao = amount
+    if src != NDAO:
+        token_reserve, ndao_reserve, max_pool = reserves[src]
+        # tokenToNdaoInput
+        if token_reserve + amount > max_pool:
+            raise Revert('the pool is full')
+        ndao = get_input_price(amount, token_reserve, ndao_reserve)
+        if ndao == 0:
+            raise Revert('little than min_ndao')
+        reserves[src] = (token_reserve + amount, ndao_reserve - ndao, max_pool)
+    if dst == NDAO:
+        return ndao, ndao
+    # ndaoToTokenInput
+    token_reserve, ndao_reserve, max_pool = reserves[dst]
+    bought = get_input_price(ndao, ndao_reserve, token_reserve)
+    if bought == 0:
+        raise Revert('little than min_tokens')
+    reserves[dst] = (token_reserve - bought, ndao_reserve + ndao, max_pool)
+    return bought, ndao
+
+
+def walk(reserves, route, amount):
+    """Trade ``amount`` along ``route`` and return what it buys, updating ``reserves``."""
+    for src, dst in zip(route, route[1:]):
+        amount = hop(reserves, src, dst, amount)[0]
+    return amount
+
+
+def room(reserves, route):
+    """Most the first hop of ``route`` can sell before ``maxPool`` reverts it."""
+    if route[0] == NDAO:
+        return None
+    token_reserve, _, max_pool = reserves[route[0]]
+    return max(0, max_pool - token_reserve)
+
+
+def routes(markets, sell, buy, via=None):
+    """The direct route and the detours through one token of ``via`` (every other exchange by default)."""
+    if sell == buy:
+        raise ValueError('nothing to route from a token to itself')
+    for token in (sell, buy):
+        if token != NDAO and token not in markets:
+            raise KeyError('%s is not an exchange' % token)
+    via = [t for t in (markets if via is None else via) if t not in (sell, buy)]
+    return [(sell, buy)] + [(sell, token, buy) for token in via]
+
+
+def allocate(markets, candidates, amount, chunks):
+    """Hand out ``amount`` in ``chunks`` pieces, each to the route buying the most with it.
+
+    A piece too small to buy anything on a route is tried there again as
+    everything left, and a remainder no route takes on its own goes to the
+    last route used, where it only adds to a larger sale.  Returns
+    ``({route: amount}, unfilled)``, the routes in the order they were
+    first used.
+    """
+    reserves = dict(markets)
+    allocated = {}
+    left = amount
+    piece = max(1, amount // chunks)
+    last = None
+    while left > 0:
+        best = None
+        for route in candidates:
+            space = room(reserves, route)
+            for size in ((piece, left) if left > piece else (left,)):
+                if space is not None:
+                    size = min(size, space)
+                if size <= 0:
+                    break
+                # only the two or three exchanges of the route change, keep them apart
+                trial = ChainMap({}, reserves)
+                try:
+                    bought = walk(trial, route, size)
+                except Revert:
+                    continue
+                # most bought per unit sold, so a route squeezed by maxPool competes fairly
+                if best is None or bought * best[1] > best[2] * size:
+                    best = (route, size, bought, trial)
+                break
+        if best is None:
+            space = None if last is None else room(reserves, last)
+            if last is not None and left < piece and (space is None or left <= space):
+                allocated[last] += left
+                left = 0
+            break
+        route, size, _, trial = best
+        reserves.update(trial.maps[0])
+        allocated[route] = allocated.get(route, 0) + size
+        left -= size
+        last = route
+    return allocated, left
+
+
+def plan_calls(markets, allocated, deadline, slippage_bps, recipient=None):
+    """Price the merged routes from ``markets`` and write the calls that trade them."""
+    reserves = dict(markets)
+    calls = []
+    amount_in = amount_out = 0
+    for route, amount in allocated.items():
+        sold = amount
+        for src, dst in zip(route, route[1:]):
+            bought, ndao = hop(reserves, src, dst, sold)
+            min_bought = at_least(bought, slippage_bps)
+            to = recipient if dst == route[-1] else None
+            calls.append(call(src, dst, sold, min_bought, at_least(ndao, slippage_bps), deadline, to))
+            # the next hop sells what this one is sure to buy, the rest stays with the trader
+            sold = min_bought
+        amount_in += amount
+        amount_out += sold
+    return calls, amount_in, amount_out
+
+
+def at_least(amount, slippage_bps):
+    return max(1, amount * (BPS - slippage_bps) // BPS)
+
+
+def call(src, dst, sold, min_bought, min_ndao, deadline, recipient):
+    if src == NDAO:
+        if recipient is None:
+            return Call(dst, 'ndaoToTokenSwapInput', (sold, min_bought, deadline), sold, min_bought)
+        return Call(dst, 'ndaoToTokenTransferInput', (sold, min_bought, deadline, recipient), sold, min_bought)
+    if dst == NDAO:
+        if recipient is None:
+            return Call(src, 'tokenToNdaoSwapInput', (sold, min_bought, deadline), sold, min_bought)
+        return Call(src, 'tokenToNdaoTransferInput', (sold, min_bought, deadline, recipient), sold, min_bought)
+    if recipient is None:
+        return Call(src, 'tokenToExchangeSwapInput', (sold, min_bought, min_ndao, deadline, dst), sold, min_bought)
+    return Call(src, 'tokenToExchangeTransferInput',
+                (sold, min_bought, min_ndao, deadline, recipient, dst), sold, min_bought)
+
+
+def solve(markets, sell, buy, amount, deadline, chunks=64, via=None, slippage_bps=0, recipient=None):
+    """Return the :class:`Plan` that buys the most ``buy`` with ``amount`` of ``sell``.
+
+    ``markets`` maps each exchange to its ``(token_reserve, ndao_reserve,
+    max_pool)``, ``sell`` and ``buy`` are exchanges or :data:`NDAO`.  The
+    minimum outputs of the calls leave ``slippage_bps`` of room.  With
+    ``recipient`` the last hop of each route is a ``Transfer`` call that
+    delivers to it.
+    """
+    if amount <= 0:
+        raise ValueError('amount must be positive')
+    candidates = routes(markets, sell, buy, via)
+    best = None
+    for option in ([candidates[0]], candidates):
+        allocated, unfilled = allocate(markets, option, amount, chunks)
+        calls, amount_in, amount_out = plan_calls(markets, allocated, deadline, slippage_bps, recipient)
+        plan = Plan(calls, amount_in, amount_out, unfilled)
+        # the direct route alone wins ties, it takes the fewest calls
+        if best is None or (plan.amount_out, -plan.unfilled) > (best.amount_out, -best.unfilled):
+            best = plan
+    return best
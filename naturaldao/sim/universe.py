@@ -0,0 +1,106 @@
+"""A Factory and the exchanges it created.
+
+Token ids follow ``Factory._saveExchangeInfo`` (the first token is id 1)
+and the initial reserves follow ``Factory.createExchange``: the exchange
+receives every ICO token, ``maxPool`` is twice that amount and the NDAO
+minted to it is ``Factory._calNdaoAmount`` of the ETH raised.
+"""
+import numpy as np
+
+from naturaldao.sim.pools import Pools, swap_ndao_to_token_input, swap_token_to_ndao_input
+from naturaldao.sim.pricing import MAX_NDAO, MAX_UINT256, Revert, output_prices, uint256_array
+
+NDAO_DECIMALS = 8
+# $0.01 worth of ETH in wei, as returned by EthPrice.getEthPrice
+DEFAULT_ETH_PRICE = 5 * 10 ** 12
+
+
+class Universe:
+    """Exchanges of one factory, with the token to token trades between them."""
+
+    def __init__(self, eth_price=DEFAULT_ETH_PRICE, ndao_decimals=NDAO_DECIMALS):
+        self.eth_price = eth_price
+        self.ndao_decimals = ndao_decimals
+        self.pools = Pools()
+        self.tokens = []
+        self.exchange_of = {}
+
+    def ndao_amount(self, eth_value):
+        """``Factory._calNdaoAmount``: NDAO minted for ``eth_value`` wei."""
+        if self.eth_price == 0:
+            raise Revert('division by zero')
+        return eth_value * 10 ** (self.ndao_decimals - 2) // self.eth_price
+
+    def create_exchange(self, token, token_amount, eth_value):
+        """``Factory.createExchange`` for a successful ICO, returns the token id."""
+        if token in self.exchange_of:
+            raise Revert('exchange already exists')
+        if token_amount == 0:
+            raise Revert('no tokens for the exchange')
+        ndao_amount = self.ndao_amount(eth_value)
+        # the supply minted before is not modelled, only what this mint alone can hold
+        if ndao_amount > MAX_NDAO:
+            raise Revert('NDAO beyond 96 bits')
+        row = self.pools.add(token_amount, ndao_amount, token_amount * 2)
+        self.tokens.append(token)
+        self.exchange_of[token] = row
+        return len(self.tokens)
+
+    def row(self, token_id):
+        """Row in :attr:`pools` of the exchange of ``token_id`` (ids start at 1)."""
+        return np.array(token_id, dtype=np.int64, ndmin=1) - 1
+
+    def token_to_token_input(self, src, dst, tokens_sold, min_tokens_bought=1, min_ndao_bought=1):
+        """``tokenToTokenInput`` from the exchanges of token ids ``src`` to ``dst``.
+
+        Returns ``(tokens_bought, ok)``; both exchanges are left untouched
+        where the trade reverts.
+        """
+        src, dst = self._pairs(src, dst)
+        pools = self.pools
+        tokens_sold, min_tokens_bought, min_ndao_bought = (
+            np.broadcast_to(uint256_array(x), src.shape) for x in (tokens_sold, min_tokens_bought, min_ndao_bought))
+        ndao_bought, src_token, src_ndao, ok = swap_token_to_ndao_input(
+            pools.token_reserve[src], pools.ndao_reserve[src], pools.max_pool[src], tokens_sold, min_ndao_bought)
+        ok &= min_tokens_bought > 0
+        # ndaoToTokenPeerInput on the other exchange
+        tokens_bought, dst_token, dst_ndao, bought = swap_ndao_to_token_input(
+            pools.token_reserve[dst], pools.ndao_reserve[dst], ndao_bought, min_tokens_bought)
+        ok &= bought
+        pools.commit(src, src_token, src_ndao, ok)
+        pools.commit(dst, dst_token, dst_ndao, ok)
+        return np.where(ok, tokens_bought, 0), ok
+
+    def token_to_token_output(self, src, dst, tokens_bought, max_tokens_sold=MAX_UINT256, max_ndao_sold=MAX_UINT256):
+        """``tokenToTokenOutput`` from the exchanges of token ids ``src`` to ``dst``.
+
+        Returns ``(tokens_sold, ok)``.  Like the contract, the selling
+        exchange does not check ``maxPool`` on this path.
+        """
+        src, dst = self._pairs(src, dst)
+        pools = self.pools
+        tokens_bought, max_tokens_sold, max_ndao_sold = (
+            np.broadcast_to(uint256_array(x), src.shape) for x in (tokens_bought, max_tokens_sold, max_ndao_sold))
+        ok = (tokens_bought > 0) & (max_ndao_sold > 0)
+        # ndaoToTokenPeerOutput on the other exchange
+        dst_token, dst_ndao = pools.token_reserve[dst], pools.ndao_reserve[dst]
+        ndao_bought, priced = output_prices(tokens_bought, dst_ndao, dst_token)
+        ok &= priced & (ndao_bought <= max_ndao_sold)
+        src_token, src_ndao = pools.token_reserve[src], pools.ndao_reserve[src]
+        tokens_sold, priced = output_prices(ndao_bought, src_token, src_ndao)
+        ok &= priced & (max_tokens_sold >= tokens_sold)
+        new_dst_ndao = dst_ndao + ndao_bought
+        new_src_token = src_token + tokens_sold
+        ok &= (new_dst_ndao <= MAX_NDAO) & (new_src_token <= MAX_UINT256)
+        pools.commit(dst, np.where(ok, dst_token - tokens_bought, dst_token), new_dst_ndao, ok)
+        pools.commit(src, new_src_token, np.where(ok, src_ndao - ndao_bought, src_ndao), ok)
+        return np.where(ok, tokens_sold, 0), ok
+
+    def _pairs(self, src, dst):
+        src, dst = np.broadcast_arrays(self.row(src), self.row(dst))
+        rows = np.concatenate([src, dst])
+        if (rows < 0).any() or (rows >= len(self.pools)).any():
+            raise Revert('no exchange for the token id')
+        if len(np.unique(rows)) != len(rows):
+            raise ValueError('an exchange can only trade once per batch')
+        return src, dst
@@ -0,0 +1,39 @@
+"""Tests of the contracts on a :class:`~naturaldao.chain.LocalChain`.
+
+Run from the repository root with ``python -m unittest discover tests``;
+they need the same toolchain as :mod:`naturaldao.chain`.
+"""
+import unittest
+
+from naturaldao.chain import LocalChain, deploy_system
+
+MAX_UINT256 = 2 ** 256 - 1
+DEADLINE = 2 ** 32 - 1
+
+
+class ChainTestCase(unittest.TestCase):
+    """One chain and system per class, every test starts from the state ``setUpClass`` left."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chain = LocalChain()
+        cls.system = deploy_system(cls.chain)
+        cls.accounts = cls.chain.accounts
+
+    def setUp(self):
+        self.snapshot = self.chain.tester.take_snapshot()
+
+    def tearDown(self):
+        self.chain.tester.revert_to_snapshot(self.snapshot)
+
+    def assertSucceeds(self, call, sender=None, value=0):
+        receipt = self.chain.transact(call, sender=sender, value=value)
+        self.assertEqual(receipt.status, 1)
+        return receipt
+
+    def assertReverts(self, call, sender=None, value=0):
+        try:
+            receipt = self.chain.transact(call, sender=sender, value=value)
+        except Exception:
+            return  # eth-tester raises when it estimates a reverting call
+        self.assertEqual(receipt.status, 0)
@@ -0,0 +1,127 @@
+import unittest
+
+from eth_abi import encode_abi
+
+from naturaldao.chain import ZERO_ADDRESS, launch_market, swap_data
+
+from tests import DEADLINE, MAX_UINT256, ChainTestCase
+
+
+def short_swap_data(min_bought, deadline, recipient):
+    """The ``transferAndCall`` data without the exchange, 96 bytes."""
+    return encode_abi(['uint256', 'uint256', 'address'], [min_bought, deadline, recipient])
+
+
+class TransferAndCallTest(ChainTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        chain, accounts = cls.chain, cls.accounts
+        cls.ico, cls.exchange = launch_market(chain, cls.system, accounts[1], 'Alpha')
+        cls.ico_b, cls.exchange_b = launch_market(chain, cls.system, accounts[2], 'Beta')
+        cls.trader, cls.recipient = accounts[1], accounts[5]
+
+    def test_tokens_for_ndao_with_96_bytes(self):
+        ndao = self.system.ndao
+        price = self.exchange.functions.getTokenToNdaoInputPrice(10 ** 18).call()
+        data = short_swap_data(1, DEADLINE, self.recipient)
+        self.assertEqual(len(data), 96)
+        self.assertSucceeds(self.ico.functions.transferAndCall(self.exchange.address, 10 ** 18, data), self.trader)
+        self.assertEqual(ndao.functions.balanceOf(self.recipient).call(), price)
+
+    def test_ndao_for_tokens_with_96_bytes(self):
+        price = self.exchange.functions.getNdaoToTokenInputPrice(10 ** 9).call()
+        data = short_swap_data(1, DEADLINE, self.recipient)
+        self.assertSucceeds(self.system.ndao.functions.transferAndCall(self.exchange.address, 10 ** 9, data), self.trader)
+        self.assertEqual(self.ico.functions.balanceOf(self.recipient).call(), price)
+
+    def test_ndao_for_tokens_with_128_bytes(self):
+        price = self.exchange.functions.getNdaoToTokenInputPrice(10 ** 9).call()
+        data = swap_data(1, DEADLINE, self.recipient)
+        self.assertSucceeds(self.system.ndao.functions.transferAndCall(self.exchange.address, 10 ** 9, data), self.trader)
+        self.assertEqual(self.ico.functions.balanceOf(self.recipient).call(), price)
+
+    def test_ndao_with_an_exchange_reverts(self):
+        data = swap_data(1, DEADLINE, self.recipient, self.exchange_b.address)
+        self.assertReverts(self.system.ndao.functions.transferAndCall(self.exchange.address, 10 ** 9, data), self.trader)
+
+    def test_tokens_for_tokens_of_another_exchange(self):
+        ndao = self.exchange.functions.getTokenToNdaoInputPrice(10 ** 18).call()
+        price = self.exchange_b.functions.getNdaoToTokenInputPrice(ndao).call()
+        data = swap_data(1, DEADLINE, self.recipient, self.exchange_b.address)
+        self.assertSucceeds(self.ico.functions.transferAndCall(self.exchange.address, 10 ** 18, data), self.trader)
+        self.assertEqual(self.ico_b.functions.balanceOf(self.recipient).call(), price)
+
+    def test_recipient_defaults_to_the_sender(self):
+        before = self.ico.functions.balanceOf(self.trader).call()
+        price = self.exchange.functions.getNdaoToTokenInputPrice(10 ** 9).call()
+        data = short_swap_data(1, DEADLINE, ZERO_ADDRESS)
+        self.assertSucceeds(self.system.ndao.functions.transferAndCall(self.exchange.address, 10 ** 9, data), self.trader)
+        self.assertEqual(self.ico.functions.balanceOf(self.trader).call(), before + price)
+
+
+class PriceTest(ChainTestCase):
+    """``getPrice`` and ``getPriceCurve`` return 0 where the trade can not happen."""
+
+    NDAO_TO_TOKEN_INPUT, NDAO_TO_TOKEN_OUTPUT, TOKEN_TO_NDAO_INPUT, TOKEN_TO_NDAO_OUTPUT = range(4)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.ico, cls.exchange = launch_market(cls.chain, cls.system, cls.accounts[1], 'Alpha')
+        functions = cls.exchange.functions
+        cls.token_reserve = functions.tokenReserve().call()
+        cls.ndao_reserve = functions.ndaoReserve().call()
+
+    def price(self, amount, direction):
+        return self.exchange.functions.getPrice(amount, direction).call()
+
+    def test_same_as_the_getters(self):
+        functions = self.exchange.functions
+        self.assertEqual(self.price(10 ** 9, self.NDAO_TO_TOKEN_INPUT),
+                         functions.getNdaoToTokenInputPrice(10 ** 9).call())
+        self.assertEqual(self.price(10 ** 18, self.NDAO_TO_TOKEN_OUTPUT),
+                         functions.getNdaoToTokenOutputPrice(10 ** 18).call())
+        self.assertEqual(self.price(10 ** 18, self.TOKEN_TO_NDAO_INPUT),
+                         functions.getTokenToNdaoInputPrice(10 ** 18).call())
+        self.assertEqual(self.price(10 ** 9, self.TOKEN_TO_NDAO_OUTPUT),
+                         functions.getTokenToNdaoOutputPrice(10 ** 9).call())
+
+    def test_output_of_the_whole_reserve(self):
+        self.assertGreater(self.price(self.token_reserve - 1, self.NDAO_TO_TOKEN_OUTPUT), 0)
+        self.assertEqual(self.price(self.token_reserve, self.NDAO_TO_TOKEN_OUTPUT), 0)
+        self.assertEqual(self.price(self.token_reserve + 1, self.NDAO_TO_TOKEN_OUTPUT), 0)
+        self.assertGreater(self.price(self.ndao_reserve - 1, self.TOKEN_TO_NDAO_OUTPUT), 0)
+        self.assertEqual(self.price(self.ndao_reserve, self.TOKEN_TO_NDAO_OUTPUT), 0)
+
+    def test_overflow(self):
+        largest = MAX_UINT256 // self.token_reserve
+        self.assertGreater(self.price(largest, self.NDAO_TO_TOKEN_INPUT), 0)
+        self.assertEqual(self.price(largest + 1, self.NDAO_TO_TOKEN_INPUT), 0)
+        largest = MAX_UINT256 // self.ndao_reserve
+        self.assertGreater(self.price(largest, self.TOKEN_TO_NDAO_INPUT), 0)
+        self.assertEqual(self.price(largest + 1, self.TOKEN_TO_NDAO_INPUT), 0)
+        for direction in range(4):
+            self.assertEqual(self.price(MAX_UINT256, direction), 0)
+
+    def test_nothing_traded(self):
+        for direction in range(4):
+            self.assertEqual(self.price(0, direction), 0)
+        with self.assertRaises(Exception):
+            self.price(1, 4)
+
+    def test_curve(self):
+        for direction in range(4):
+            amounts = [10 ** 9, 10 ** 18, 0, MAX_UINT256, self.token_reserve, self.ndao_reserve,
+                       MAX_UINT256 // self.token_reserve + 1, 3]
+            amounts += [0] * (32 - len(amounts))
+            curve = self.exchange.functions.getPriceCurve(amounts, direction).call()
+            self.assertEqual(curve, [self.price(amount, direction) for amount in amounts])
+        # every amount overflows
+        amounts = [MAX_UINT256] * 32
+        self.assertEqual(self.exchange.functions.getPriceCurve(amounts, self.NDAO_TO_TOKEN_INPUT).call(), [0] * 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
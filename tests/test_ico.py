@@ -0,0 +1,131 @@
+import unittest
+
+from naturaldao.chain import create_ico
+
+from tests import ChainTestCase
+
+STATE_OPEN, STATE_GOAL_REACHED, STATE_SUCCEEDED, STATE_FAILED, STATE_CANCELLED = range(5)
+# goalReached, isEnd, isFailed
+FLAGS = {
+    STATE_OPEN: (False, False, False),
+    STATE_GOAL_REACHED: (True, False, False),
+    STATE_SUCCEEDED: (True, True, False),
+    STATE_FAILED: (False, True, True),
+    STATE_CANCELLED: (True, True, True),
+}
+GOAL = 10 ** 18
+DURATION = 3600
+
+
+class StateTransitionTest(ChainTestCase):
+    """The packed lifecycle and deposits read back the same through every state."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.creator, cls.alice, cls.bob = cls.accounts[1], cls.accounts[2], cls.accounts[3]
+
+    def create(self, lazy=False):
+        self.ico = create_ico(self.chain, self.system, self.creator, 'Gamma', GOAL, duration=DURATION, lazy=lazy)
+        self.start = self.chain.timestamp
+        self.lazy = lazy
+        self.assertIco(STATE_OPEN, 0, 0)
+
+    def assertIco(self, state, amount, count):
+        functions = self.ico.functions
+        self.assertEqual(functions.state().call(), state)
+        self.assertEqual((functions.goalReached().call(), functions.isEnd().call(), functions.isFailed().call()),
+                         FLAGS[state])
+        self.assertEqual(functions.lazyMint().call(), self.lazy)
+        self.assertEqual(functions.depositGoal().call(), GOAL)
+        self.assertEqual(functions.depositStart().call(), self.start)
+        self.assertEqual(functions.depositEnd().call(), self.start + DURATION)
+        self.assertGreater(functions.finalSubmissionTime().call(), self.start + DURATION)
+        self.assertEqual(functions.depositAmount().call(), amount)
+        self.assertEqual(functions.depositorCount().call(), count)
+
+    def deposit(self, sender, value):
+        self.assertSucceeds(self.ico.functions.deposit(), sender, value)
+
+    def reach_goal(self):
+        self.deposit(self.alice, GOAL // 4)
+        self.deposit(self.alice, GOAL // 4)
+        self.assertIco(STATE_OPEN, GOAL // 2, 1)
+        # the deposit over the goal is refunded
+        self.deposit(self.bob, GOAL)
+        self.assertIco(STATE_GOAL_REACHED, GOAL, 2)
+        self.assertEqual(self.ico.functions.depositBalanceOfUser(self.bob).call(), GOAL // 2)
+
+    def end(self):
+        self.chain.time_travel(DURATION + 1)
+
+    def test_open(self):
+        self.create()
+        self.deposit(self.alice, 1)
+        self.assertIco(STATE_OPEN, 1, 1)
+        self.deposit(self.bob, GOAL - 2)
+        self.assertIco(STATE_OPEN, GOAL - 1, 2)
+        self.assertReverts(self.ico.functions.deposit(), self.alice, 0)
+        self.assertIco(STATE_OPEN, GOAL - 1, 2)
+
+    def test_goal_reached(self):
+        self.create()
+        self.reach_goal()
+        self.assertReverts(self.ico.functions.deposit(), self.alice, 1)
+        self.assertIco(STATE_GOAL_REACHED, GOAL, 2)
+
+    def test_succeeded(self):
+        for lazy in (False, True):
+            self.create(lazy)
+            self.reach_goal()
+            self.end()
+            self.assertSucceeds(self.ico.functions.submitICO(), self.creator)
+            self.assertIco(STATE_SUCCEEDED, GOAL, 2)
+
+    def test_failed_at_submission(self):
+        self.create()
+        self.deposit(self.alice, GOAL // 2)
+        self.end()
+        self.assertSucceeds(self.ico.functions.submitICO(), self.creator)
+        self.assertIco(STATE_FAILED, GOAL // 2, 1)
+
+    def test_failed_by_cancel(self):
+        self.create()
+        self.deposit(self.alice, GOAL // 2)
+        self.end()
+        self.assertReverts(self.ico.functions.cancelICO(), self.alice)
+        self.assertSucceeds(self.ico.functions.cancelICO(), self.creator)
+        self.assertIco(STATE_FAILED, GOAL // 2, 1)
+        self.assertSucceeds(self.ico.functions.safeWithdrawal(), self.alice)
+        self.assertIco(STATE_FAILED, GOAL // 2, 1)
+
+    def test_cancelled(self):
+        self.create(lazy=True)
+        self.reach_goal()
+        self.end()
+        self.assertSucceeds(self.ico.functions.cancelICO(), self.creator)
+        self.assertIco(STATE_CANCELLED, GOAL, 2)
+        self.assertReverts(self.ico.functions.submitICO(), self.creator)
+        self.assertIco(STATE_CANCELLED, GOAL, 2)
+
+    def test_open_until_the_end(self):
+        self.create()
+        self.assertReverts(self.ico.functions.submitICO(), self.creator)
+        self.assertReverts(self.ico.functions.cancelICO(), self.creator)
+        self.end()
+        self.assertReverts(self.ico.functions.deposit(), self.alice, 1)
+        self.assertIco(STATE_OPEN, 0, 0)
+
+    def test_goal_is_96_bits(self):
+        chain, functions = self.chain, self.system.factory.functions
+        self.assertReverts(functions.createICO('Delta', 'D', 18, 2 ** 96, DURATION, 10 ** 18), self.creator)
+        ico = create_ico(chain, self.system, self.creator, 'Delta', 2 ** 96 - 1, duration=DURATION)
+        self.assertEqual(ico.functions.depositGoal().call(), 2 ** 96 - 1)
+        self.assertEqual(ico.functions.depositEnd().call(), chain.timestamp + DURATION)
+        self.assertSucceeds(ico.functions.deposit(), self.alice, 10 ** 18)
+        self.assertEqual((ico.functions.depositAmount().call(), ico.functions.depositorCount().call()), (10 ** 18, 1))
+        self.assertEqual(ico.functions.depositGoal().call(), 2 ** 96 - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+
+from eth.vm.forks import LondonVM
+
+from naturaldao.chain import ZERO_ADDRESS, LocalChain
+
+from tests import ChainTestCase
+
+MASK_96 = 2 ** 96 - 1
+
+
+class LateVM(LondonVM):
+    """Starts the chain a few blocks before block 2 ** 32, mining keeps the genesis difficulty."""
+
+    @classmethod
+    def create_genesis_header(cls, **params):
+        return super().create_genesis_header(**params).copy(block_number=2 ** 32 - 3)
+
+    @classmethod
+    def create_header_from_parent(cls, parent_header, **params):
+        # the difficulty bomb would grow past what eth-tester can validate
+        if parent_header is not None:
+            params.setdefault('difficulty', parent_header.difficulty)
+        return LondonVM.create_header_from_parent(parent_header, **params)
+
+
+class CheckpointTest(ChainTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.minter, cls.alice, cls.bob = cls.accounts[0], cls.accounts[1], cls.accounts[2]
+        cls.token = cls.chain.deploy('NDAOToken', cls.minter)
+
+    def transact(self, call, sender=None):
+        """Send ``call`` and return the block it was mined in."""
+        return self.assertSucceeds(call, sender).blockNumber
+
+    def history(self):
+        """Change the balances in blocks with gaps between them, return ``{block: (alice, bob, supply)}``."""
+        functions = self.token.functions
+        changes = [
+            (functions.mint(self.alice, 100), self.minter),
+            (functions.transfer(self.bob, 30), self.alice),
+            (functions.mint(self.alice, 5), self.minter),
+            (functions.transfer(self.alice, 10), self.bob),
+            (functions.burn(25), self.alice),
+            (functions.transfer(self.bob, 1), self.alice),
+            (functions.mint(self.bob, 7), self.minter),
+        ]
+        values = {}
+        for call, sender in changes:
+            self.chain.tester.mine_blocks(2)
+            block = self.transact(call, sender)
+            values[block] = (functions.balanceOf(self.alice).call(), functions.balanceOf(self.bob).call(),
+                             functions.totalSupply().call())
+        self.chain.tester.mine_blocks(1)
+        return values
+
+    def assertHistory(self, values):
+        functions = self.token.functions
+        expected = (0, 0, 0)
+        for block in range(min(values) - 2, self.chain.w3.eth.block_number):
+            expected = values.get(block, expected)
+            self.assertEqual((functions.balanceOfAt(self.alice, block).call(),
+                              functions.balanceOfAt(self.bob, block).call(),
+                              functions.totalSupplyAt(block).call()), expected, 'block %d' % block)
+
+    def test_values_at_every_block(self):
+        # five checkpoints of alice, three of bob and of the supply, at odd and even indexes
+        self.assertHistory(self.history())
+
+    def test_before_the_first_checkpoint(self):
+        first = min(self.history())
+        self.assertEqual(self.token.functions.balanceOfAt(self.alice, first - 1).call(), 0)
+        self.assertEqual(self.token.functions.balanceOfAt(self.alice, 0).call(), 0)
+        self.assertEqual(self.token.functions.totalSupplyAt(first - 1).call(), 0)
+
+    def test_at_the_checkpoint_blocks(self):
+        values = self.history()
+        for block, (alice, bob, supply) in values.items():
+            self.assertEqual(self.token.functions.balanceOfAt(self.alice, block).call(), alice)
+            self.assertEqual(self.token.functions.balanceOfAt(self.bob, block).call(), bob)
+            self.assertEqual(self.token.functions.totalSupplyAt(block).call(), supply)
+
+    def test_supply_does_not_read_the_balance_of_the_zero_address(self):
+        values = self.history()
+        for block, (_, _, supply) in values.items():
+            self.assertEqual(self.token.functions.totalSupplyAt(block).call(), supply)
+            self.assertEqual(self.token.functions.balanceOfAt(ZERO_ADDRESS, block).call(), 0)
+
+    def test_current_block_is_refused(self):
+        block = self.chain.w3.eth.block_number + 1
+        with self.assertRaises(Exception):
+            self.token.functions.balanceOfAt(self.alice, block).call()
+        with self.assertRaises(Exception):
+            self.token.functions.totalSupplyAt(block).call()
+
+    def test_same_block_changes_overwrite(self):
+        functions, tester = self.token.functions, self.chain.tester
+        before = self.transact(functions.mint(self.alice, 100), self.minter)
+        tester.disable_auto_mine_transactions()
+        try:
+            # one sender each, pending transactions of one sender would get the same nonce
+            functions.transfer(self.bob, 30).transact({'from': self.alice, 'gas': 200000})
+            functions.mint(self.alice, 50).transact({'from': self.minter, 'gas': 200000})
+            functions.transfer(self.alice, 10).transact({'from': self.bob, 'gas': 200000})
+            block = self.chain.w3.eth.get_block(tester.mine_blocks(1)[0])
+        finally:
+            tester.enable_auto_mine_transactions()
+        self.assertEqual(len(block.transactions), 3)
+        after = self.transact(functions.transfer(self.bob, 1), self.alice)
+        self.assertHistory({before: (100, 0, 100), block.number: (130, 20, 150), after: (129, 21, 150)})
+
+    def test_balance_and_supply_are_96_bits(self):
+        functions = self.token.functions
+        self.assertReverts(functions.mint(self.alice, MASK_96 + 1), self.minter)
+        self.transact(functions.mint(self.alice, MASK_96), self.minter)
+        self.assertReverts(functions.mint(self.bob, 1), self.minter)
+        self.assertReverts(functions.mint(self.alice, 1), self.minter)
+        self.assertEqual(functions.balanceOf(self.alice).call(), MASK_96)
+        self.assertEqual(functions.totalSupply().call(), MASK_96)
+
+
+class BlockNumberTest(unittest.TestCase):
+    """The checkpoints keep 32 bits of the block number."""
+
+    def test_changes_after_block_2_32_revert(self):
+        chain = LocalChain(vm_configuration=((0, LateVM),))
+        minter = chain.accounts[0]
+        token = chain.deploy('NDAOToken', minter)
+        receipt = chain.transact(token.functions.mint(minter, 100), sender=minter)
+        self.assertEqual((receipt.status, receipt.blockNumber), (1, 2 ** 32 - 1))
+        try:
+            receipt = chain.transact(token.functions.mint(minter, 100), sender=minter)
+        except Exception:
+            pass
+        else:
+            self.assertEqual((receipt.status, receipt.blockNumber), (0, 2 ** 32))
+        self.assertEqual(token.functions.balanceOf(minter).call(), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+
+from naturaldao.chain import create_ico, launch_market, swap_data
+from naturaldao.client import Client, LocalTransport
+from naturaldao.quotes import QuoteService
+
+from tests import DEADLINE, ChainTestCase
+
+
+class ReorgTest(ChainTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.ico, cls.exchange = launch_market(cls.chain, cls.system, cls.accounts[1], 'Alpha')
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.client = Client(LocalTransport(self.chain.w3.provider))
+        self.service = QuoteService(self.client, self.system.factory.address)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.close())
+        self.loop.close()
+        super().tearDown()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def assertReserves(self, exchange):
+        reserves = self.run_async(self.service.reserves(exchange.address))
+        self.assertEqual((reserves.token_reserve, reserves.ndao_reserve),
+                         (exchange.functions.tokenReserve().call(), exchange.functions.ndaoReserve().call()))
+
+    def test_fork_drops_and_picks_up_exchanges(self):
+        chain, service = self.chain, self.service
+        self.run_async(service.sync())
+        self.assertReserves(self.exchange)
+        fork = chain.tester.take_snapshot()
+        ico_b, exchange_b = launch_market(chain, self.system, self.accounts[2], 'Beta')
+        self.run_async(service.sync())
+        self.assertEqual(service.exchange(ico_b.address), exchange_b.address)
+        self.assertReserves(exchange_b)
+
+        # the other branch trades on Alpha and registers Gamma instead of Beta
+        chain.tester.revert_to_snapshot(fork)
+        chain.transact(self.system.ndao.functions.transferAndCall(
+            self.exchange.address, 10 ** 9, swap_data(1, DEADLINE)), sender=self.accounts[1])
+        create_ico(chain, self.system, self.accounts[3], 'Unfunded')
+        ico_c, exchange_c = launch_market(chain, self.system, self.accounts[2], 'Gamma')
+        chain.tester.mine_blocks(3)
+
+        self.run_async(service.sync())
+        self.assertEqual(service.metrics.reorgs, 1)
+        self.assertNotIn(exchange_b.address, service.exchanges)
+        self.assertNotIn(ico_b.address, service.exchange_of)
+        self.assertEqual(service.exchange(ico_c.address), exchange_c.address)
+        self.assertEqual(set(service.exchanges), {self.exchange.address, exchange_c.address})
+        self.assertReserves(self.exchange)
+        self.assertReserves(exchange_c)
+
+    def test_no_reorg(self):
+        self.run_async(self.service.sync())
+        self.assertReserves(self.exchange)
+        self.chain.tester.mine_blocks(2)
+        self.run_async(self.service.sync())
+        self.assertEqual(self.service.metrics.reorgs, 0)
+        self.assertEqual(self.service.metrics.invalidations, 0)
+        self.assertReserves(self.exchange)
+        self.assertEqual(self.service.metrics.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from naturaldao.chain import ZERO_ADDRESS, launch_market
+
+from tests import DEADLINE, MAX_UINT256, ChainTestCase
+
+
+def padded(path):
+    return path + [ZERO_ADDRESS] * (6 - len(path))
+
+
+class RouterTest(ChainTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        chain, accounts = cls.chain, cls.accounts
+        cls.markets = [launch_market(chain, cls.system, accounts[1 + i], 'T%d' % i) for i in range(3)]
+        cls.router = chain.deploy('Router', cls.system.ndao.address)
+        cls.trader, cls.recipient = accounts[1], accounts[5]
+        chain.transact(cls.markets[0][0].functions.approve(cls.router.address, MAX_UINT256), sender=cls.trader)
+        chain.transact(cls.system.ndao.functions.approve(cls.router.address, MAX_UINT256), sender=cls.trader)
+
+    def exchange(self, i):
+        return self.markets[i][1].address
+
+    def swap(self, amount, ndao_in, path):
+        return self.router.functions.swapPathInput(
+            amount, 1, ndao_in, padded(path), DEADLINE, self.recipient)
+
+    def test_three_exchanges(self):
+        # Tokens of T0 to Tokens of T2 through Tokens of T1
+        path = [self.exchange(0), self.exchange(1), self.exchange(1), self.exchange(2)]
+        quote = self.router.functions.getPathInputPrice(10 ** 18, False, padded(path)).call()
+        self.assertGreater(quote, 0)
+        self.assertSucceeds(self.swap(10 ** 18, False, path), self.trader)
+        self.assertEqual(self.markets[2][0].functions.balanceOf(self.recipient).call(), quote)
+        self.assertEqual(self.markets[1][0].functions.balanceOf(self.router.address).call(), 0)
+
+    def test_ndao_in_through_two_exchanges(self):
+        path = [self.exchange(1), self.exchange(1), self.exchange(2)]
+        quote = self.router.functions.getPathInputPrice(10 ** 9, True, padded(path)).call()
+        self.assertSucceeds(self.swap(10 ** 9, True, path), self.trader)
+        self.assertEqual(self.markets[2][0].functions.balanceOf(self.recipient).call(), quote)
+
+    def test_two_hops(self):
+        path = [self.exchange(0), self.exchange(1)]
+        quote = self.router.functions.getPathInputPrice(10 ** 18, False, padded(path)).call()
+        self.assertSucceeds(self.swap(10 ** 18, False, path), self.trader)
+        self.assertEqual(self.markets[1][0].functions.balanceOf(self.recipient).call(), quote)
+
+    def test_tokens_to_another_exchange_are_refused(self):
+        path = [self.exchange(0), self.exchange(1), self.exchange(2)]
+        with self.assertRaises(Exception):
+            self.router.functions.getPathInputPrice(10 ** 18, False, padded(path)).call()
+        self.assertReverts(self.swap(10 ** 18, False, path), self.trader)
+
+
+if __name__ == '__main__':
+    unittest.main()